@@ -1,69 +1,43 @@
 import os
 import re
+import shutil
+import asyncio
 import random
 from datetime import datetime, timedelta
 from collections import defaultdict
 import logging
 
 import pandas as pd
-import cloudinary.api
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from sqlalchemy import text
 from dateutil.parser import parse
 
-from db_pg import engine, get_user_logs, get_user_logs_by_name, get_conn, get_user_name, save_message, transfer_user_data
-from config import ADMIN_IDS, BEIJING_TZ, LOGS_PER_PAGE, DATA_DIR
-from export import export_excel, export_user_excel
+from db_pg import (
+    engine, get_user_logs, get_user_logs_by_name, get_conn, get_user_name, save_message, transfer_user_data,
+    bump_data_version, bump_user_data_version, bump_deleted_data_version, delete_messages_in_chunks
+)
+from config import ADMIN_IDS, BEIJING_TZ, LOGS_PER_PAGE
+from export import export_excel_with_summary, export_user_excel
 from shift_manager import get_shift_options, get_shift_times_short
 from logs_utils import build_and_send_logs, send_logs_page
+from heavy_tasks import shared_heavy_task
+from month_snapshot import invalidate_snapshots
+from raw_export import export_raw, RAW_FORMATS
+from export_spool import open_document, discard_document
+from image_index import build_images_html
+from image_zip import export_images_zip
+from cleaner import delete_images_concurrently
+from image_storage import key_from_url
 
 # ===========================
 # 管理员删除数据
 # ===========================
-# 提取 Cloudinary public_id
-def extract_cloudinary_public_id(url: str) -> str | None:
-    """
-    提取 Cloudinary public_id，支持多级目录。
-    e.g. https://res.cloudinary.com/demo/image/upload/v123456/folder/image.jpg
-         -> folder/image
-    """
-    if "cloudinary.com" not in url:
-        return None
-    try:
-        # 去掉 query 参数
-        url = url.split("?")[0]
-        parts = url.split("/upload/")
-        if len(parts) < 2:
-            return None
-        path = parts[1]
-        # 去掉版本号 vXXXX
-        path_parts = path.split("/")
-        if path_parts[0].startswith("v") and path_parts[0][1:].isdigit():
-            path_parts = path_parts[1:]
-        public_id_with_ext = "/".join(path_parts)
-        public_id = os.path.splitext(public_id_with_ext)[0]
-        return public_id
-    except Exception as e:
-        print(f"⚠️ public_id 提取失败: {url} -> {e}")
-        return None
-
-# 批量删除 Cloudinary
+# 批量删除截图（并发 + 自适应限速，见 cleaner.delete_images_concurrently）
 def batch_delete_cloudinary(public_ids: list, batch_size=100):
-    deleted_total = 0
-    for i in range(0, len(public_ids), batch_size):
-        batch = public_ids[i:i + batch_size]
-        try:
-            response = cloudinary.api.delete_resources(batch)
-            deleted = response.get("deleted", {})
-            failed = response.get("failed", {})
-
-            deleted_total += sum(1 for v in deleted.values() if v == "deleted")
-
-            for pid, error in failed.items():
-                print(f"⚠️ 删除失败: {pid} - {error}")
-        except Exception as e:
-            print(f"❌ 批量删除失败: {e}")
+    deleted_total, failed_ids, _ = delete_images_concurrently(public_ids, batch_size)
+    for pid in failed_ids:
+        print(f"⚠️ 删除失败: {pid}")
     return deleted_total
 
 
@@ -177,19 +151,21 @@ async def delete_one_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # 删除 Cloudinary 图片（仅在 content 是图片 URL 时）
+    # 删除截图（仅在 content 是截图存储的图片 URL 时）
     deleted_images = 0
-    if row.content and "cloudinary.com" in row.content:
-        public_id = extract_cloudinary_public_id(row.content)
-        if public_id:
-            deleted_images = batch_delete_cloudinary([public_id])
+    public_id = key_from_url(row.content)
+    if public_id:
+        deleted_images = batch_delete_cloudinary([public_id])
 
-    # 删除数据库记录
+    # 删除数据库记录（删除前后各递增一次该日期的数据版本，使报表缓存失效）
+    bump_data_version(row.timestamp)
     with engine.begin() as conn:
         conn.execute(text("DELETE FROM messages WHERE id = :id"), {"id": record_id})
+    bump_deleted_data_version(row.timestamp)
+    invalidate_snapshots(row.timestamp)
 
     await update.message.reply_text(
-        f"✅ 删除成功！\n\n{record_info}\n\n🖼 Cloudinary 图片：{'已删除' if deleted_images else '无/未删除'}"
+        f"✅ 删除成功！\n\n{record_info}\n\n🖼 截图：{'已删除' if deleted_images else '无/未删除'}"
     )
 
 # 管理员删除命令（支持删除某用户所有记录 + 自定义姓名）
@@ -216,7 +192,7 @@ async def delete_range_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(args) < 2:
             await update.message.reply_text("⚠️ 用法：/delete_range all <用户名/自定义姓名> [confirm]")
             return
-        username = resolve_username(args[1])
+        username, _ = resolve_username(args[1])
         if len(args) == 3 and args[2].lower() == "confirm":
             confirm = True
 
@@ -235,9 +211,9 @@ async def delete_range_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if args[2].lower() == "confirm":
                 confirm = True
             else:
-                username = resolve_username(args[2])
+                username, _ = resolve_username(args[2])
         elif len(args) == 4:
-            username = resolve_username(args[2])
+            username, _ = resolve_username(args[2])
             confirm = args[3].lower() == "confirm"
 
         # 校验日期格式
@@ -264,8 +240,7 @@ async def delete_range_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         rows = result.fetchall()
 
     total_count = len(rows)
-    image_urls = [r[1] for r in rows if r[1] and "cloudinary.com" in r[1]]
-    public_ids = [extract_cloudinary_public_id(url) for url in image_urls if extract_cloudinary_public_id(url)]
+    public_ids = [pid for pid in (key_from_url(r[1]) for r in rows) if pid]
 
     if not confirm:
         await update.message.reply_text(
@@ -279,32 +254,39 @@ async def delete_range_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # ================= 删除 Cloudinary 图片 =================
+    # ================= 删除截图（当前存储后端） =================
     deleted_images = 0
     if public_ids:
         deleted_images = batch_delete_cloudinary(public_ids)
 
-    # ================= 删除数据库记录 =================
+    # ================= 删除数据库记录（删除前后各递增一次数据版本，使报表缓存失效；分块短事务，在线程中执行不阻塞机器人） =================
     if args[0].lower() == "all":
-        delete_query = "DELETE FROM messages WHERE username = :username RETURNING id"
+        user_days = bump_user_data_version(username)
+        delete_where = "username = :username"
     else:
-        delete_query = """
-            DELETE FROM messages
-            WHERE timestamp >= :start_date AND timestamp <= :end_date
-        """
+        bump_data_version(start_dt, end_dt)
+        delete_where = "timestamp >= :start_date AND timestamp <= :end_date"
         if username:
-            delete_query += " AND username = :username"
-        delete_query += " RETURNING id"
+            delete_where += " AND username = :username"
 
-    with engine.begin() as conn:
-        delete_result = conn.execute(text(delete_query), params)
-        deleted_count = len(delete_result.fetchall())
+    deleted_count = await asyncio.to_thread(
+        delete_messages_in_chunks, delete_where, params,
+        progress=lambda n: logging.info(f"🗑 /delete_range 已删除 {n}/{total_count} 条记录")
+    )
+
+    # 删除期间生成的报表缓存 / 列式快照可能只包含部分删除结果：再递增一次版本，随后让涉及月份的快照失效（all 模式不限日期，全部失效）
+    if args[0].lower() == "all":
+        bump_deleted_data_version(days=user_days)
+        invalidate_snapshots()
+    else:
+        bump_deleted_data_version(start_dt, end_dt)
+        invalidate_snapshots(start_dt, end_dt)
 
     await update.message.reply_text(
         f"✅ 删除完成！\n\n"
         f"👤 用户：{username or '所有用户'}\n"
         f"📄 数据库记录：{deleted_count}/{total_count} 条\n"
-        f"🖼 Cloudinary 图片：{deleted_images}/{len(public_ids)} 张\n"
+        f"🖼 截图：{deleted_images}/{len(public_ids)} 张\n"
         f"📅 范围：{'所有记录' if args[0].lower() == 'all' else start_date + ' ~ ' + end_date}"
     )
     
@@ -666,6 +648,7 @@ async def admin_makeup_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyword=keyword,
         shift=shift_name
     )
+    invalidate_snapshots(punch_dt)
 
     await update.message.reply_text(
         f"✅ 管理员已为 {name}（{username}）补卡：\n"
@@ -700,7 +683,16 @@ def get_month_to_today_range():
 
 
 # ===========================
-# 导出 Excel 命令：/export [YYYY-MM-DD YYYY-MM-DD]
+# 删除导出临时文件
+# ===========================
+def _remove_export_dir(paths):
+    """删除导出分卷及其所在的导出目录（DATA_DIR 下每次导出单独一个目录）"""
+    if paths:
+        shutil.rmtree(os.path.dirname(paths[0]), ignore_errors=True)
+
+
+# ===========================
+# 导出 Excel 命令：/export [YYYY-MM-DD YYYY-MM-DD] [matrix]
 # ===========================
 async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id not in ADMIN_IDS:  # 权限检查：仅管理员可用
@@ -708,40 +700,95 @@ async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     tz = BEIJING_TZ
-    args = context.args
+    args = list(context.args)
+    # ✅ 末尾可选版式参数：matrix / 矩阵 = 用户 × 日期 单页矩阵，默认每天一页
+    layout = "daily"
+    if args and args[-1].lower() in ("matrix", "矩阵"):
+        args.pop()
+        layout = "matrix"
     if len(args) == 2:
         # ✅ 解析日期参数：导出指定日期区间
         try:
             start = parse(args[0]).replace(tzinfo=tz, hour=0, minute=0, second=0, microsecond=0)
             end = parse(args[1]).replace(tzinfo=tz, hour=23, minute=59, second=59, microsecond=999999)
         except Exception:
-            await update.message.reply_text("⚠️ 日期格式错误，请使用 /export YYYY-MM-DD YYYY-MM-DD")
+            await update.message.reply_text("⚠️ 日期格式错误，请使用 /export YYYY-MM-DD YYYY-MM-DD [matrix]")
             return
     else:
         # ✅ 无参数则默认导出本月1日至今日
         start, end = get_month_to_today_range()
 
     status_msg = await update.message.reply_text("⏳ 正在导出 Excel，请稍等...")
-    file_path = export_excel(start, end)  # 调用导出函数，返回文件路径或云端 URL
+    # 调用导出函数，返回 (文件路径或云端 URL, 异常汇总文本)；相同区间的并发请求只导出一次
+    async with shared_heavy_task(
+        ("export", layout, start.isoformat(), end.isoformat()), export_excel_with_summary, start, end, layout,
+        status_msg=status_msg, cleanup=lambda result: result[0] and discard_document(result[0])
+    ) as (doc, summary_text):
 
-    # 删除状态提示消息
-    try:
-        await status_msg.delete()
-    except:
-        pass
+        # 删除状态提示消息
+        try:
+            await status_msg.delete()
+        except:
+            pass
+
+        # ✅ 导出结果处理
+        if not doc:
+            await update.message.reply_text("⚠️ 指定日期内没有数据。")
+            return
+
+        # 直接发送内存中的 Excel（附异常汇总；落盘的大文件以文件句柄发送，在所有等待者发送完毕后删除）
+        with open_document(doc) as document:
+            await update.message.reply_document(
+                document=document, filename=doc[0], caption=summary_text or None
+            )
 
-    # ✅ 导出结果处理
-    if not file_path:
-        await update.message.reply_text("⚠️ 指定日期内没有数据。")
+# ===========================
+# 原始数据流式导出：/export_raw [YYYY-MM-DD YYYY-MM-DD] [csv|ndjson]
+# ===========================
+async def export_raw_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ 无权限，仅管理员可导出记录。")
         return
 
-    if file_path.startswith("http"):  
-        # 文件过大，已上传云端
-        await update.message.reply_text(f"✅ 导出完成，文件过大已上传到云端：\n{file_path}")
+    tz = BEIJING_TZ
+    args = list(context.args)
+    fmt = "csv"
+    if args and args[-1].lower() in RAW_FORMATS:
+        fmt = args.pop().lower()
+
+    if len(args) == 2:
+        try:
+            start = parse(args[0]).replace(tzinfo=tz, hour=0, minute=0, second=0, microsecond=0)
+            end = parse(args[1]).replace(tzinfo=tz, hour=23, minute=59, second=59, microsecond=999999)
+        except Exception:
+            await update.message.reply_text("⚠️ 日期格式错误，请使用 /export_raw YYYY-MM-DD YYYY-MM-DD [csv|ndjson]")
+            return
+    elif not args:
+        start, end = get_month_to_today_range()
     else:
-        # 直接发送 Excel 文件并删除临时文件
-        await update.message.reply_document(document=open(file_path, "rb"))
-        os.remove(file_path)
+        await update.message.reply_text("⚠️ 用法：/export_raw [YYYY-MM-DD YYYY-MM-DD] [csv|ndjson]")
+        return
+
+    status_msg = await update.message.reply_text("⏳ 正在流式导出原始数据，请稍等...")
+    # 相同区间 / 格式的并发请求只导出一次，分卷文件在所有等待者发送完毕后删除
+    async with shared_heavy_task(
+        ("export_raw", fmt, start.isoformat(), end.isoformat()), export_raw, start, end, fmt,
+        status_msg=status_msg, cleanup=_remove_export_dir
+    ) as paths:
+
+        try:
+            await status_msg.delete()
+        except:
+            pass
+
+        if not paths:
+            await update.message.reply_text("⚠️ 指定日期内没有数据。")
+            return
+
+        for i, path in enumerate(paths, 1):
+            caption = f"📦 第 {i}/{len(paths)} 部分" if len(paths) > 1 else None
+            with open(path, "rb") as f:
+                await update.message.reply_document(document=f, filename=os.path.basename(path), caption=caption)
 
 # ===========================
 # /export_user 指  令
@@ -778,24 +825,29 @@ async def exportuser_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     status_msg = await update.message.reply_text(f"⏳ 正在导出 {user_name} 的考勤数据，请稍候...")
 
-    # 删除状态提示消息
-    try:
-        await status_msg.delete()
-    except:
-        pass
+    # 调用导出函数（相同用户 + 区间的并发请求只导出一次）
+    async with shared_heavy_task(
+        ("export_user", user_name, start_datetime.isoformat(), end_datetime.isoformat()),
+        export_user_excel, user_name, start_datetime, end_datetime,
+        status_msg=status_msg, cleanup=discard_document
+    ) as doc:
 
-    # 调用导出函数
-    file_path = export_user_excel(user_name, start_datetime, end_datetime)
-    if not file_path:
-        await update.message.reply_text(f"📭 {user_name} 在指定时间内没有打卡数据。")
-        return
+        # 删除状态提示消息
+        try:
+            await status_msg.delete()
+        except:
+            pass
 
-    # 发送文件
-    try:
-        with open(file_path, "rb") as f:
-            await update.message.reply_document(f, filename=f"{user_name}_考勤详情.xlsx")
-    except Exception as e:
-        await update.message.reply_text(f"❌ 导出失败：{e}")
+        if not doc:
+            await update.message.reply_text(f"📭 {user_name} 在指定时间内没有打卡数据。")
+            return
+
+        # 发送文件
+        try:
+            with open_document(doc) as document:
+                await update.message.reply_document(document, filename=doc[0])
+        except Exception as e:
+            await update.message.reply_text(f"❌ 导出失败：{e}")
 
         
 # ===========================
@@ -820,124 +872,68 @@ async def export_images_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     status_msg = await update.message.reply_text("⏳ 正在生成图片链接列表，请稍等...")
 
-    # 查询数据库
-    with get_conn() as conn:
-        df = pd.read_sql("""
-            SELECT timestamp, keyword, name, content
-            FROM messages
-            WHERE timestamp >= %s AND timestamp <= %s
-            ORDER BY timestamp ASC
-        """, conn, params=(start, end))
-
-    if df.empty:
-        await status_msg.delete()
-        await update.message.reply_text("⚠️ 指定日期内没有数据。")
-        return
-
-    # 过滤图片
-    photo_df = df[df["content"].str.contains(r"\.(?:jpg|jpeg|png|gif|webp)$", case=False, na=False)].copy()
-    if photo_df.empty:
-        await status_msg.delete()
-        await update.message.reply_text("⚠️ 指定日期内没有图片。")
-        return
-
-    # 提取 public_id
-    def extract_public_id(url: str) -> str | None:
-        match = re.search(r'/upload/(?:v\d+/)?(.+?)\.(?:jpg|jpeg|png|gif|webp)$', url, re.IGNORECASE)
-        return match.group(1) if match else None
-
-    photo_df["public_id"] = photo_df["content"].apply(extract_public_id)
-    photo_df.dropna(subset=["public_id"], inplace=True)
-    if photo_df.empty:
-        await status_msg.delete()
-        await update.message.reply_text("⚠️ 没有有效的 Cloudinary 图片链接。")
-        return
-
-    # 构建图片URL
-    photo_df["url"] = photo_df["public_id"].apply(lambda pid: cloudinary.CloudinaryImage(pid).build_url())
-
-    # HTML 头部（样式 + 搜索 + 折叠功能）
-    html_lines = [
-        "<!DOCTYPE html>",
-        "<html><head><meta charset='utf-8'><title>图片导出</title>",
-        "<style>",
-        "body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }",
-        "h2 { text-align: center; color: #333; }",
-        ".search-box { text-align: center; margin-bottom: 20px; }",
-        "input { padding: 8px; width: 300px; border-radius: 5px; border: 1px solid #ccc; }",
-        ".date-block { background: white; margin-bottom: 20px; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); }",
-        ".date-title { font-size: 18px; padding: 10px; background: #3b81cd; color: white; cursor: pointer; border-radius: 8px 8px 0 0; }",
-        ".date-title:hover { background: #0056b3; }",
-        "ul { list-style-type: none; padding: 10px; margin: 0; }",
-        "li { padding: 5px 0; border-bottom: 1px solid #eee; }",
-        "li:last-child { border-bottom: none; }",
-        "a { color: #007bff; text-decoration: none; }",
-        "a:hover { text-decoration: underline; }",
-        ".hidden { display: none; }",
-        "</style>",
-        "<script>",
-        "function filterList() {",
-        "  var input = document.getElementById('searchInput').value.toLowerCase();",
-        "  var items = document.querySelectorAll('li');",
-        "  items.forEach(function(item) {",
-        "    if (item.innerText.toLowerCase().includes(input)) {",
-        "      item.style.display = '';",
-        "    } else {",
-        "      item.style.display = 'none';",
-        "    }",
-        "  });",
-        "}",
-        "function toggleList(id) {",
-        "  var el = document.getElementById(id);",
-        "  if (el.classList.contains('hidden')) {",
-        "    el.classList.remove('hidden');",
-        "  } else {",
-        "    el.classList.add('hidden');",
-        "  }",
-        "}",
-        "</script>",
-        "</head><body>",
-        f"<h2>图片导出：{start.strftime('%Y-%m-%d')} 至 {end.strftime('%Y-%m-%d')}</h2>",
-        "<div class='search-box'><input type='text' id='searchInput' onkeyup='filterList()' placeholder='🔍 输入关键词、姓名或时间筛选...'></div>"
-    ]
-
-    # 生成日期分组 HTML（默认收起）
-    for idx, (date_str, group) in enumerate(photo_df.groupby(photo_df["timestamp"].dt.strftime("%Y-%m-%d"))):
-        list_id = f"list_{idx}"
-        html_lines.append(f"<div class='date-block'>")
-        html_lines.append(f"<div class='date-title' onclick=\"toggleList('{list_id}')\">{date_str} ▼</div>")
-        html_lines.append(f"<ul id='{list_id}' class='hidden'>")
-        for _, row in group.iterrows():
-            ts_local = row["timestamp"].astimezone(BEIJING_TZ).strftime('%H:%M:%S')
-            keyword = row.get("keyword", "无关键词") or "无关键词"
-            name = row.get("name", "未知") or "未知"
-            url = row["url"]
-            html_lines.append(
-                f"<li>{ts_local} - {keyword} - {name} - <a href='{url}' target='_blank'>查看图片</a></li>"
-            )
-        html_lines.append("</ul></div>")
+    # 生成 HTML（相同区间的并发请求只生成一次，落盘的大文件在所有等待者发送完毕后删除）
+    async with shared_heavy_task(
+        ("export_images", start.isoformat(), end.isoformat()), build_images_html, start, end,
+        status_msg=status_msg, cleanup=lambda result: result[0] and discard_document(result[0])
+    ) as (doc, error_text):
 
-    html_lines.append("</body></html>")
+        try:
+            await status_msg.delete()
+        except:
+            pass
 
-    # 保存 HTML
-    start_str = start.strftime("%Y-%m-%d")
-    end_str = end.strftime("%Y-%m-%d")
-    export_dir = os.path.join(DATA_DIR, "links")
-    os.makedirs(export_dir, exist_ok=True)
-    html_path = os.path.join(export_dir, f"图片记录_{start_str}_{end_str}.html")
-    with open(html_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(html_lines))
+        if not doc:
+            await update.message.reply_text(error_text)
+            return
 
-    try:
-        await status_msg.delete()
-    except:
-        pass
+        # 发送 HTML
+        with open_document(doc) as document:
+            await update.message.reply_document(document=document, filename=doc[0])
 
-    # 发送 HTML
-    with open(html_path, "rb") as f:
-        await update.message.reply_document(document=f, filename=os.path.basename(html_path))
 
-    os.remove(html_path)
+# ===========================
+# 截图打包下载：/export_images_zip [YYYY-MM-DD YYYY-MM-DD]
+# ===========================
+async def export_images_zip_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ 无权限，仅管理员可导出记录。")
+        return
+
+    tz = BEIJING_TZ
+    args = context.args
+    if len(args) == 2:
+        try:
+            start = parse(args[0]).replace(tzinfo=tz, hour=0, minute=0, second=0, microsecond=0)
+            end = parse(args[1]).replace(tzinfo=tz, hour=23, minute=59, second=59, microsecond=999999)
+        except Exception:
+            await update.message.reply_text("⚠️ 日期格式错误，请使用 /export_images_zip YYYY-MM-DD YYYY-MM-DD")
+            return
+    else:
+        start, end = get_month_to_today_range()
+
+    status_msg = await update.message.reply_text("⏳ 正在下载并打包截图，图片较多时需要几分钟，请稍等...")
+    # 相同区间的并发请求只打包一次，分卷文件在所有等待者发送完毕后删除
+    async with shared_heavy_task(
+        ("export_images_zip", start.isoformat(), end.isoformat()), export_images_zip, start, end,
+        status_msg=status_msg, cleanup=lambda result: _remove_export_dir(result[0])
+    ) as (paths, failed_count, error_text):
+
+        try:
+            await status_msg.delete()
+        except:
+            pass
+
+        if not paths:
+            await update.message.reply_text(error_text or "⚠️ 没有可打包的截图。")
+            return
+
+        for i, path in enumerate(paths, 1):
+            caption = f"🗜️ 第 {i}/{len(paths)} 部分" if len(paths) > 1 else None
+            with open(path, "rb") as f:
+                await update.message.reply_document(document=f, filename=os.path.basename(path), caption=caption)
+        if failed_count:
+            await update.message.reply_text(f"⚠️ 有 {failed_count} 张截图下载失败已跳过，清单见压缩包内“下载失败.txt”。")
 
 
 # 管理员查看所有预设指令
@@ -956,9 +952,11 @@ async def commands_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "`/userlogs` - 查看指定员工本月打卡记录\n"
         "`/userlogs_lastmonth` - 查看指定员工上月打卡记录\n\n"
         "📤 导出功能（管理员）\n"
-        "`/export` - 导出所有人考勤 Excel\n"
+        "`/export` - 导出所有人考勤 Excel（末尾加 matrix 为用户×日期单页矩阵）\n"
         "`/export_user` - 导出个人考勤 Excel\n"
-        "`/export_images` - 导出所有人图片记录\n\n"
+        "`/export_raw` - 导出原始打卡数据（gzip 压缩的 CSV / NDJSON）\n"
+        "`/export_images` - 导出所有人图片记录\n"
+        "`/export_images_zip` - 打包下载所有人打卡截图（ZIP，超过 45MB 自动分卷）\n\n"
         "⏰ 班次管理（管理员）\n"
         "`/list_shift` - 查看当前班次\n"
         "`/edit_shift` - 添加/修改班次\n"
@@ -26,16 +26,16 @@ from telegram.constants import ChatAction
 # ===========================
 # 项目内部模块
 # ===========================
-from config import TOKEN, KEYWORDS, ADMIN_IDS, DATA_DIR, LOGS_PER_PAGE, BEIJING_TZ, REPORT_ADMIN_IDS
+from config import TOKEN, TELEGRAM_API_URL, TELEGRAM_FILE_URL, KEYWORDS, ADMIN_IDS, DATA_DIR, LOGS_PER_PAGE, BEIJING_TZ, REPORT_ADMIN_IDS
 from upload_image import upload_image
-from cleaner import delete_last_month_data, delete_last_3months_data, delete_last_month_images
+from cleaner import delete_last_month_data, delete_last_3months_data, delete_last_month_images, resume_retention_runs
 from db_pg import (
     init_db, save_message, get_user_logs, save_shift, get_user_name, 
-    set_user_name, get_db, transfer_user_data
+    set_user_name, get_db, transfer_user_data, bump_data_version
 )
 from admin_tools import (
     delete_range_cmd, delete_one_cmd, userlogs_cmd, userlogs_page_callback, transfer_cmd,
-    admin_makeup_cmd, export_cmd, export_images_cmd, exportuser_cmd, userlogs_lastmonth_cmd,
+    admin_makeup_cmd, export_cmd, export_images_cmd, export_images_zip_cmd, exportuser_cmd, export_raw_cmd, userlogs_lastmonth_cmd,
     user_delete_cmd, user_update_cmd, user_list_cmd, user_add_cmd, commands_cmd
 )
 from shift_manager import (
@@ -43,7 +43,8 @@ from shift_manager import (
     list_shifts_cmd, edit_shift_cmd, delete_shift_cmd
 )
 from logs_utils import build_and_send_logs, send_logs_page
-from export import export_excel
+from export import export_excel_with_summary, refresh_month_snapshots, append_closed_day
+from export_spool import open_document, discard_document, purge_spill_dir
 
 app = None  # 全局声明，初始为空
 
@@ -235,11 +236,12 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await file.download_to_drive(tmp_path)
 
-    image_url = upload_image(tmp_path)
+    # 先取打卡时间：截图按该时间所在月份归档，保证目录月份不早于记录月份
+    now = datetime.now(BEIJING_TZ)
 
-    os.remove(tmp_path)
+    image_url = upload_image(tmp_path, now)
 
-    now = datetime.now(BEIJING_TZ)
+    os.remove(tmp_path)
 
     # ==========================
     # 上班打卡
@@ -610,6 +612,8 @@ def delete_checkin_record(username, ts, keyword):
         deleted = cur.rowcount
         conn.commit()
 
+    if deleted:
+        bump_data_version(ts)
     return deleted > 0
 
 
@@ -975,20 +979,25 @@ async def send_custom_report(bot, start_dt, end_dt, title=None):
 
     now = datetime.now(BEIJING_TZ)
 
-    # ⬇ 核心：导出精确到秒的区间报表
-    excel_path = export_excel(start_dt, end_dt)
+    # ⬇ 核心：导出精确到秒的区间报表（附异常汇总；报表在内存中生成，过大时才落盘）
+    doc, summary_text = export_excel_with_summary(start_dt, end_dt)
 
-    # 群发给管理员
-    for admin_id in REPORT_ADMIN_IDS:
-        try:
-            await bot.send_document(
-                chat_id=admin_id,
-                document=open(excel_path, "rb"),
-                caption=f"📊 {title}\n生成时间：{now.strftime('%Y-%m-%d %H:%M:%S')}"
-            )
-            logger.info(f"✅ 已发送 {title} 给管理员 {admin_id}")
-        except Exception as e:
-            logger.error(f"❌ 发送报表给管理员 {admin_id} 失败: {e}")
+    # 群发给管理员（发送完毕后释放 / 删除落盘文件）
+    try:
+        for admin_id in REPORT_ADMIN_IDS:
+            try:
+                with open_document(doc) as document:     # 落盘文件每次发送各自打开一个句柄
+                    await bot.send_document(
+                        chat_id=admin_id,
+                        document=document,
+                        filename=doc[0],
+                        caption=f"📊 {title}\n生成时间：{now.strftime('%Y-%m-%d %H:%M:%S')}\n\n{summary_text}".strip()
+                    )
+                logger.info(f"✅ 已发送 {title} 给管理员 {admin_id}")
+            except Exception as e:
+                logger.error(f"❌ 发送报表给管理员 {admin_id} 失败: {e}")
+    finally:
+        discard_document(doc)
 
 async def send_monthly_report(bot):
     now = datetime.now(BEIJING_TZ)
@@ -1033,6 +1042,22 @@ def setup_scheduler(bot):
         replace_existing=True,
     )
 
+    # 每天 06:10 把刚结束的一天（打卡窗口截至当天 06:00）分类结果追加到按日报表，月报 / 月中导出直接复用
+    scheduler.add_job(
+        append_closed_day,
+        CronTrigger(hour=6, minute=10, timezone=BEIJING_TZ),
+        id="daily_append",
+        replace_existing=True,
+    )
+
+    # 每天 06:30 刷新最近3个已结束月份的列式快照（缺失或因补卡/删除失效的重新生成）
+    scheduler.add_job(
+        refresh_month_snapshots,
+        CronTrigger(hour=6, minute=30, timezone=BEIJING_TZ),
+        id="month_snapshots",
+        replace_existing=True,
+    )
+
     # 每月1日 13:00 删除上个月的图片（仅清空 image_url，保留打卡记录）
     scheduler.add_job(
         delete_last_month_images,
@@ -1041,6 +1066,14 @@ def setup_scheduler(bot):
         replace_existing=True,
     )
 
+    # 每小时续跑中断的清理任务，并按计划重试删除失败的图片
+    scheduler.add_job(
+        resume_retention_runs,
+        CronTrigger(minute=20, timezone=BEIJING_TZ),
+        id="resume_retention",
+        replace_existing=True,
+    )
+
     return scheduler 
 
 async def on_startup(app: Application):
@@ -1049,10 +1082,8 @@ async def on_startup(app: Application):
     scheduler.start()
     logger.info("✅ APScheduler 已启动（在 event loop 运行后）")
 	
-def main():
-    init_db()  
-    # ✅ 初始化数据库（创建表、索引等，确保运行环境准备就绪）
-	
+def build_app() -> Application:
+    """创建 Telegram Bot 应用并注册全部处理器（main 与压测脚本 burst_load.py 共用）"""
     # ===========================
     # 初始化 Telegram Bot 应用
     # ===========================
@@ -1062,13 +1093,12 @@ def main():
         write_timeout=60.0,
         pool_timeout=30.0
     )
-    global app
-    app = Application.builder().token(TOKEN).request(request).post_init(on_startup).build()
-	
-    os.makedirs(DATA_DIR, exist_ok=True)  
-    # ✅ 确保数据存储目录存在，用于导出文件、缓存等
+    app = (
+        Application.builder().token(TOKEN).request(request)
+        .base_url(TELEGRAM_API_URL).base_file_url(TELEGRAM_FILE_URL)    # 默认官方地址，基准测试时指向替身服务
+        .post_init(on_startup).build()
+    )
 
-	
     # ===========================
     # ✅ 注册命令处理器（/命令）
     # ===========================
@@ -1087,6 +1117,8 @@ def main():
     app.add_handler(CommandHandler("export", export_cmd))                # /export：导出考勤 Excel（管理员）
     app.add_handler(CommandHandler("export_images", export_images_cmd))  # /export_images：导出打卡截图 ZIP（管理员）
     app.add_handler(CommandHandler("export_user", exportuser_cmd)) 		 # /export_user 张三 2025-08-01 2025-08-25  导出个人考勤（管理员）
+    app.add_handler(CommandHandler("export_raw", export_raw_cmd))        # /export_raw [起止日期] [csv|ndjson]：流式导出原始打卡数据（管理员）
+    app.add_handler(CommandHandler("export_images_zip", export_images_zip_cmd))  # /export_images_zip [起止日期]：打包下载打卡截图（管理员）
 	
     app.add_handler(CommandHandler("makeup", admin_makeup_cmd))    		 # /admin_makeup：管理员为员工补卡
     app.add_handler(CommandHandler("transfer", transfer_cmd))            # /transfer：用户数据迁移（改用户名时用）
@@ -1121,6 +1153,20 @@ def main():
     app.add_handler(CallbackQueryHandler(back_to_menu_callback, pattern="^back_to_menu$"))
     app.add_handler(CallbackQueryHandler(cancel_checkin_callback, pattern=r"^cancel_checkin:"))
     app.add_handler(CallbackQueryHandler(cancel_checkout_callback, pattern=r"^cancel_checkout:"))
+    return app
+
+
+def main():
+    init_db()  
+    # ✅ 初始化数据库（创建表、索引等，确保运行环境准备就绪）
+    purge_spill_dir()
+    # ✅ 清理上次异常退出遗留的导出落盘文件
+
+    os.makedirs(DATA_DIR, exist_ok=True)  
+    # ✅ 确保数据存储目录存在，用于导出文件、缓存等
+
+    global app
+    app = build_app()
 
     # ===========================
     # 启动 Bot
@@ -0,0 +1,352 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import psycopg2
+import psycopg2.extensions
+
+from fake_services import (
+    start_fake_cloudinary, start_fake_telegram, fake_env, push_update, photo_update, callback_update,
+    wait_for_call, latency_stats,
+)
+
+# ===========================
+# 上班高峰压测（12:00 / 15:00 集中打卡）
+# ===========================
+# 在本进程内运行 bot.build_app()（与线上相同的处理器），数据库使用本地 Postgres（DATABASE_URL），
+# Telegram / Cloudinary 使用 fake_services 替身。N 个合成用户在爬坡时间内依次开始，每人走完整流程：
+#   photo   发送 #上班打卡 截图 -> 收到“请选择今天的班次”键盘
+#   shift   点击班次按钮（shift_callback）-> 消息被编辑为“✅ 上班打卡成功”
+#   cancel  按比例点击“取消打卡”（cancel_checkin_callback）-> 消息被编辑为“✅ 已取消本次上班打卡”
+# 输出：吞吐、各阶段 p50 / p95 / p99、错误率、每次打卡的数据库查询数与连接数；
+# 结果写入 DATA_DIR/loadtest/，并与基线 baseline.json 对比（首次运行或指定 save 时写入基线）。
+#
+# 用法：python burst_load.py [用户数] [取消比例%] [爬坡秒数] [save]
+# 压测用户为 loadtest_0001 ...（姓名 压测0001 ...），开始前与结束后都会清除这些用户及其打卡记录。
+# 为避免误伤线上数据，DATABASE_URL 必须指向本机（设置 LOADTEST_ALLOW_REMOTE_DB=1 可跳过检查）。
+USER_PREFIX = "loadtest_"
+USER_ID_BASE = 9_000_000
+STAGES = ("photo", "shift", "cancel")
+STAGE_TIMEOUT = 60              # 单个阶段等待 bot 回复的上限（秒），超时计为错误
+TELEGRAM_LATENCY_MS = 40        # 替身 Telegram 每个请求的往返延迟
+CLOUDINARY_LATENCY_MS = 300     # 替身 Cloudinary 上传延迟（接近线上单张截图上传耗时）
+REGRESSION_TOLERANCE = 0.20     # 与基线相比，延迟变慢 / 吞吐下降超过 20% 判定为回归
+LOADTEST_DIR_NAME = "loadtest"
+
+
+# ===========================
+# 数据库查询计数（包装 psycopg2.connect，覆盖 get_conn 与 SQLAlchemy engine）
+# ===========================
+_db_counter = {"queries": 0, "connections": 0}
+_db_counter_lock = threading.Lock()
+
+
+def _install_query_counter():
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            with _db_counter_lock:
+                _db_counter["queries"] += 1
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            with _db_counter_lock:
+                _db_counter["queries"] += 1
+            return super().executemany(query, vars_list)
+
+    connect = psycopg2.connect
+
+    def counting_connect(*args, **kwargs):
+        kwargs.setdefault("cursor_factory", CountingCursor)
+        with _db_counter_lock:
+            _db_counter["connections"] += 1
+        return connect(*args, **kwargs)
+
+    psycopg2.connect = counting_connect
+
+
+def _db_snapshot() -> dict:
+    with _db_counter_lock:
+        return dict(_db_counter)
+
+
+def _check_local_database():
+    host = urlsplit(os.getenv("DATABASE_URL") or "").hostname
+    if os.getenv("LOADTEST_ALLOW_REMOTE_DB") != "1" and host not in ("localhost", "127.0.0.1", "::1", None):
+        raise SystemExit(f"❌ DATABASE_URL 指向 {host}，压测只允许使用本地 Postgres（LOADTEST_ALLOW_REMOTE_DB=1 可跳过）")
+    if not os.getenv("DATABASE_URL"):
+        raise SystemExit("❌ 请设置 DATABASE_URL 指向本地 Postgres")
+
+
+# ===========================
+# 压测用户准备 / 清理
+# ===========================
+def _seed_users(users: int):
+    from db_pg import get_conn
+    _purge_users()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.executemany(
+                "INSERT INTO users (username, name) VALUES (%s, %s) ON CONFLICT (username) DO UPDATE SET name = EXCLUDED.name",
+                [(f"{USER_PREFIX}{i:04d}", f"压测{i:04d}") for i in range(1, users + 1)]
+            )
+        conn.commit()
+
+
+def _purge_users():
+    """删除压测用户及其全部记录，并使涉及日期的报表缓存失效"""
+    from db_pg import get_conn, bump_data_version
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM messages WHERE username LIKE %s RETURNING timestamp",
+                (USER_PREFIX.replace("_", r"\_") + "%",)
+            )
+            stamps = [row[0] for row in cur.fetchall()]
+            cur.execute("DELETE FROM users WHERE username LIKE %s", (USER_PREFIX.replace("_", r"\_") + "%",))
+        conn.commit()
+    if stamps:
+        bump_data_version(min(stamps), max(stamps))
+
+
+# ===========================
+# 单个合成用户（在线程中运行，通过替身 Telegram 注入更新并等待 bot 回复）
+# ===========================
+def _simulate_user(tg, index: int, delay: float, cancel: bool, seed: int) -> dict:
+    rng = random.Random(seed)
+    user_id = USER_ID_BASE + index
+    username = f"{USER_PREFIX}{index:04d}"
+    result = {"stages": {}, "error": None}
+    time.sleep(delay)
+
+    def run_stage(stage, update, predicate):
+        start = len(tg.fake["calls"])
+        t0 = time.perf_counter()
+        push_update(tg, update)
+        _, call = wait_for_call(tg, predicate, start, STAGE_TIMEOUT)
+        if call is None:
+            result["error"] = {"stage": stage, "reason": "timeout"}
+            return None
+        result["stages"][stage] = time.perf_counter() - t0
+        return call
+
+    def reply_to(method, message_id=None):
+        return lambda c: (
+            c["endpoint"] == method and c["outcome"] == "ok" and c["chat_id"] == user_id
+            and (message_id is None or c["message_id"] == message_id)
+        )
+
+    # photo：截图 -> 班次键盘
+    call = run_stage("photo", photo_update(user_id, username, "#上班打卡"), reply_to("sendMessage"))
+    if call is None:
+        return result
+    buttons = [row[0]["callback_data"] for row in (call["reply_markup"] or {}).get("inline_keyboard", [])]
+    if not buttons or not buttons[0].startswith("shift:"):
+        result["stages"].pop("photo")
+        result["error"] = {"stage": "photo", "reason": call["text"]}
+        return result
+
+    # shift：选择班次 -> 打卡成功
+    keyboard_message = call["result"]
+    call = run_stage(
+        "shift", callback_update(user_id, username, keyboard_message, rng.choice(buttons)),
+        reply_to("editMessageText", keyboard_message["message_id"])
+    )
+    if call is None:
+        return result
+    if not call["text"].startswith("✅"):
+        result["stages"].pop("shift")
+        result["error"] = {"stage": "shift", "reason": call["text"]}
+        return result
+    if not cancel:
+        return result
+
+    # cancel：取消打卡 -> 已取消（先 answerCallbackQuery，成功时再编辑消息；失败只有弹窗）
+    confirmed_message = call["result"]
+    cancel_data = confirmed_message["reply_markup"]["inline_keyboard"][0][0]["callback_data"]
+    update = callback_update(user_id, username, confirmed_message, cancel_data)
+    query_id = update["callback_query"]["id"]
+    start = len(tg.fake["calls"])
+    t0 = time.perf_counter()
+    push_update(tg, update)
+    _, answer = wait_for_call(
+        tg, lambda c: c["endpoint"] == "answerCallbackQuery" and c["callback_query_id"] == query_id,
+        start, STAGE_TIMEOUT
+    )
+    if answer is None or not (answer["text"] or "").startswith("✅"):
+        result["error"] = {"stage": "cancel", "reason": answer["text"] if answer else "timeout"}
+        return result
+    _, edited = wait_for_call(tg, reply_to("editMessageText", confirmed_message["message_id"]), start, STAGE_TIMEOUT)
+    if edited is None:
+        result["error"] = {"stage": "cancel", "reason": "timeout"}
+        return result
+    result["stages"]["cancel"] = time.perf_counter() - t0
+    return result
+
+
+async def _run_burst(app, tg, users: int, cancel_rate: float, ramp_seconds: float, seed: int):
+    rng = random.Random(seed)
+    plan = [
+        (i, ramp_seconds * (i - 1) / max(users, 1), rng.random() < cancel_rate, rng.randrange(2 ** 31))
+        for i in range(1, users + 1)
+    ]
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0.0, timeout=10, drop_pending_updates=True)
+        loop = asyncio.get_running_loop()
+        db_before = _db_snapshot()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(users, 500)) as pool:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(pool, _simulate_user, tg, i, delay, cancel, user_seed)
+                for i, delay, cancel, user_seed in plan
+            ))
+        elapsed = time.perf_counter() - t0
+        db_after = _db_snapshot()
+        await app.updater.stop()
+        await app.stop()
+
+        # 处理器里启动的后台任务（1 分钟未选班次失效、10 分钟移除取消按钮）不等待，直接取消
+        pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    db = {key: db_after[key] - db_before[key] for key in db_before}
+    return results, elapsed, db
+
+
+# ===========================
+# 汇总、基线对比
+# ===========================
+def summarize(results, elapsed: float, db: dict, tg, cld, config: dict) -> dict:
+    punches = sum(1 for r in results if "shift" in r["stages"])
+    stages = {}
+    for stage in STAGES:
+        samples = [r["stages"][stage] for r in results if stage in r["stages"]]
+        errors = sum(1 for r in results if r["error"] and r["error"]["stage"] == stage)
+        attempts = len(samples) + errors
+        stages[stage] = {**latency_stats(samples), "errors": errors,
+                         "error_rate": round(errors / attempts, 4) if attempts else 0.0}
+    reasons = {}
+    for r in results:
+        if r["error"]:
+            key = f"{r['error']['stage']}: {r['error']['reason']}"
+            reasons[key] = reasons.get(key, 0) + 1
+    return {
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "config": config,
+        "elapsed": round(elapsed, 2),
+        "punches": punches,
+        "punches_per_sec": round(punches / elapsed, 2) if elapsed else 0.0,
+        "stages": stages,
+        "error_reasons": reasons,
+        "db": {**db, "queries_per_punch": round(db["queries"] / punches, 2) if punches else None,
+               "connections_per_punch": round(db["connections"] / punches, 2) if punches else None},
+        "telegram_calls": tg.fake["counts"],
+        "cloudinary_calls": cld.fake["counts"],
+    }
+
+
+def print_report(report: dict):
+    cfg = report["config"]
+    print(f"\n📊 上班高峰压测：{cfg['users']} 人，取消比例 {cfg['cancel_pct']}%，爬坡 {cfg['ramp_seconds']}s")
+    print(f"   完成打卡 {report['punches']} 次，耗时 {report['elapsed']}s，吞吐 {report['punches_per_sec']} 次/秒")
+    for stage, s in report["stages"].items():
+        if s["count"] or s["errors"]:
+            print(f"   {stage:<7} n={s['count']:<5} p50 {s['p50']}ms  p95 {s['p95']}ms  p99 {s['p99']}ms  "
+                  f"max {s['max']}ms  错误 {s['errors']}（{s['error_rate']:.1%}）")
+    db = report["db"]
+    print(f"   数据库：查询 {db['queries']} 次（每次打卡 {db['queries_per_punch']}），"
+          f"新建连接 {db['connections']} 次（每次打卡 {db['connections_per_punch']}）")
+    for reason, count in report["error_reasons"].items():
+        print(f"   ⚠️ {reason} × {count}")
+
+
+def compare_with_baseline(report: dict, baseline: dict) -> bool:
+    """打印与基线的差异；延迟 / 吞吐 / 查询数劣化超过 REGRESSION_TOLERANCE 或错误率上升时返回 False"""
+    if baseline["config"] != report["config"]:
+        print(f"⚠️ 基线配置 {baseline['config']} 与本次不同，差异仅供参考")
+    ok = True
+
+    def delta(label, old, new, higher_is_worse=True):
+        nonlocal ok
+        if old is None or new is None:
+            return
+        change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+        worse = change > REGRESSION_TOLERANCE if higher_is_worse else change < -REGRESSION_TOLERANCE
+        ok &= not worse
+        print(f"   {'❌' if worse else '  '} {label:<22} {old:>9} -> {new:<9} ({change:+.0%})")
+
+    print(f"\n📐 与基线（{baseline['at']}）对比：")
+    delta("吞吐（次/秒）", baseline["punches_per_sec"], report["punches_per_sec"], higher_is_worse=False)
+    for stage in STAGES:
+        for pct in ("p50", "p95", "p99"):
+            delta(f"{stage} {pct}（ms）", baseline["stages"][stage][pct], report["stages"][stage][pct])
+        if report["stages"][stage]["error_rate"] > baseline["stages"][stage]["error_rate"]:
+            ok = False
+            print(f"   ❌ {stage} 错误率 {baseline['stages'][stage]['error_rate']:.1%} -> {report['stages'][stage]['error_rate']:.1%}")
+    delta("每次打卡查询数", baseline["db"]["queries_per_punch"], report["db"]["queries_per_punch"])
+    return ok
+
+
+def run(users: int = 100, cancel_pct: int = 10, ramp_seconds: int = 5, save_baseline: bool = False,
+        seed: int = 0) -> bool:
+    _check_local_database()
+    cld = start_fake_cloudinary(latency_ms=CLOUDINARY_LATENCY_MS)
+    tg = start_fake_telegram(latency_ms=TELEGRAM_LATENCY_MS)
+    os.environ.update(fake_env(cld, tg))
+    _install_query_counter()
+
+    # 环境变量就绪后再导入（config.py 在导入时读取）
+    import bot
+    from config import BEIJING_TZ, DATA_DIR
+    from db_pg import init_db
+
+    if datetime.now(BEIJING_TZ).hour < 6:
+        raise SystemExit("❌ 北京时间 0-6 点 bot 不接受上班打卡（I 班跨天限制），请在其他时间运行压测")
+
+    init_db()
+    _seed_users(users)
+    try:
+        results, elapsed, db = asyncio.run(
+            _run_burst(bot.build_app(), tg, users, cancel_pct / 100, ramp_seconds, seed)
+        )
+    finally:
+        _purge_users()
+        cld.shutdown()
+        tg.shutdown()
+
+    config = {"users": users, "cancel_pct": cancel_pct, "ramp_seconds": ramp_seconds}
+    report = summarize(results, elapsed, db, tg, cld, config)
+    print_report(report)
+
+    out_dir = os.path.join(DATA_DIR, LOADTEST_DIR_NAME)
+    os.makedirs(out_dir, exist_ok=True)
+    run_path = os.path.join(out_dir, f"burst_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(run_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 本次结果：{run_path}")
+
+    baseline_path = os.path.join(out_dir, "baseline.json")
+    ok = all(s["errors"] == 0 for s in report["stages"].values())
+    if os.path.exists(baseline_path) and not save_baseline:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            ok &= compare_with_baseline(report, json.load(f))
+    else:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📌 已保存为基线：{baseline_path}")
+    print("✅ 压测通过" if ok else "❌ 压测发现错误或相对基线的回归")
+    return ok
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4] if a.isdigit()]
+    sys.exit(0 if run(*args, save_baseline="save" in sys.argv[1:]) else 1)
@@ -1,14 +1,25 @@
 import os
+import json
 import time
 import pytz
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
 
 from sqlalchemy import text
-from db_pg import engine
+from config import DATA_DIR, CLOUDINARY_DELETE_WORKERS, CLOUDINARY_FOLDER
+from db_pg import engine, bump_data_version, bump_deleted_data_version, delete_messages_in_chunks
+from month_snapshot import invalidate_snapshots
+from cold_archive import archive_rows
+from retention_journal import (
+    open_run, unfinished_runs, set_phase, record_images, due_images, mark_images, image_counts, prune_runs,
+    prefix_months, mark_prefix_deleted
+)
 
-import cloudinary
-import cloudinary.api
+import image_storage
+from image_storage import StorageRateLimited
 
 
 # ===========================
@@ -20,6 +31,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+COLLECT_CHUNK = 1000        # 每次登记的 messages 行数
+DELETE_CHUNK = 1000         # 每轮交给并发删除引擎的图片数
+_RETENTION_LOCK = threading.Lock()   # 同一进程内清理任务串行执行（定时任务与续跑任务互斥）
+
 # ===========================
 # 入口：删除3个月前的数据（定时任务）
 # ===========================
@@ -82,78 +97,8 @@ def delete_last_month_images():
     end_str = last_day_last_month.strftime('%Y-%m-%d')
 
     logger.info(f"🖼 清理上月图片（保留打卡记录）：{start_str} - {end_str}")
-
-    # 1️⃣ 查询图片 URL
-    with engine.connect() as conn:
-        result = conn.execute(
-            text("""
-                SELECT content FROM messages
-                WHERE timestamp >= :start_date AND timestamp <= :end_date
-                  AND content LIKE 'https://res.cloudinary.com/%'
-            """),
-            {
-                "start_date": f"{start_str} 00:00:00",
-                "end_date": f"{end_str} 23:59:59"
-            }
-        )
-        image_urls = [row[0] for row in result]
-
-    if not image_urls:
-        logger.warning("⚠️ 上月没有可清理的图片。")
-        return
-
-    logger.info(f"🔍 共找到 {len(image_urls)} 张图片")
-
-    # 2️⃣ 提取 public_id 并删除 Cloudinary 图片
-    public_ids = []
-    for url in image_urls:
-        pid = extract_cloudinary_public_id(url)
-        if pid:
-            public_ids.append(pid)
-
-    if not public_ids:
-        logger.warning("⚠️ 未解析到有效 public_id")
-        return
-
-    logger.info(f"📌 成功解析 {len(public_ids)} 个 public_id")
-
-    deleted_total = 0
-    failed_ids = []
-    batch_size = 100
-
-    for i in range(0, len(public_ids), batch_size):
-        batch = public_ids[i:i + batch_size]
-        logger.info(f"🚀 删除图片批次 {i//batch_size + 1}，数量 {len(batch)}")
-        success_count, failed_batch = delete_batch_with_retry(batch, max_retries=3)
-        deleted_total += success_count
-        failed_ids.extend(failed_batch)
-        time.sleep(0.4)
-
-    logger.info(f"🎯 Cloudinary 删除完成：{deleted_total}/{len(public_ids)}")
-
-    # 3️⃣ 将已成功删除图片的 content 置为 NULL（打卡记录行保留）
-    if deleted_total > 0:
-        with engine.begin() as conn:
-            result = conn.execute(
-                text("""
-                    UPDATE messages
-                    SET content = NULL
-                    WHERE timestamp >= :start_date AND timestamp <= :end_date
-                      AND content LIKE 'https://res.cloudinary.com/%'
-                """),
-                {
-                    "start_date": f"{start_str} 00:00:00",
-                    "end_date": f"{end_str} 23:59:59"
-                }
-            )
-            updated_rows = result.rowcount
-
-        logger.info(f"✅ 已清空 {updated_rows} 条记录的图片链接（打卡数据保留）")
-
-    if failed_ids:
-        logger.error(f"❌ 仍有 {len(failed_ids)} 张图片删除失败，对应记录保持不变")
-        for fid in failed_ids:
-            logger.error(f"   失败 public_id: {fid}")
+    with _RETENTION_LOCK:
+        run_retention(open_run("images", start_str, end_str))
 
 
 # ===========================
@@ -161,158 +106,313 @@ def delete_last_month_images():
 # ===========================
 def delete_messages_and_images(start_date: str, end_date: str, batch_size: int = 100, max_retries: int = 3):
     """
-    稳定删除流程：
-    1. 查询 public_id
-    2. 顺序批量删除 Cloudinary（带重试）
-    3. 删除成功后再删除数据库记录
+    稳定删除流程（记入清理任务日志，中断后可续跑）：
+    1. 登记 public_id
+    2. 并发批量删除 Cloudinary（带重试、自适应限速；仍失败的按计划稍后重试）
+    3. 图片全部处理完毕后再删除数据库记录
     """
+    with _RETENTION_LOCK:
+        run_retention(open_run("data", start_date, end_date), batch_size, max_retries)
 
-    # ===========================
-    # 1️⃣ 查询图片 URL（短事务）
-    # ===========================
-    with engine.connect() as conn:
-        result = conn.execute(
-            text("""
-                SELECT content FROM messages
-                WHERE timestamp >= :start_date AND timestamp <= :end_date
-                  AND content LIKE 'https://res.cloudinary.com/%'
-            """),
-            {
-                "start_date": f"{start_date} 00:00:00",
-                "end_date": f"{end_date} 23:59:59"
-            }
-        )
-        image_urls = [row[0] for row in result]
 
-    if not image_urls:
-        logger.warning("⚠️ 指定日期内没有可删除的 Cloudinary 图片。")
+# ===========================
+# 入口：续跑未完成的清理任务（定时任务，每小时）
+# ===========================
+def resume_retention_runs():
+    """继续中断的清理、重试到期的失败图片；已有清理在运行时跳过本次"""
+    if not _RETENTION_LOCK.acquire(blocking=False):
         return
+    try:
+        for run in unfinished_runs():
+            # 单个任务出错（数据库抖动、重试循环之外的存储错误等）只记录日志，不影响其余任务与 prune_runs；
+            # 该任务停留在当前阶段，下一轮续跑时重试
+            try:
+                run_retention(run)
+            except Exception as e:
+                logger.exception(f"❌ 清理任务 #{run['id']} 续跑失败，下次再试: {e}")
+        prune_runs()
+    finally:
+        _RETENTION_LOCK.release()
 
-    logger.info(f"🔍 共找到 {len(image_urls)} 张图片")
+
+# ===========================
+# 按阶段执行一次清理任务（每个阶段都可重复执行）
+# ===========================
+def run_retention(run: dict, batch_size: int = 100, max_retries: int = 3) -> bool:
+    """:return: 是否已全部完成（False 表示还有图片在等待重试，稍后由 resume_retention_runs 继续）"""
+    run_id, phase = run["id"], run["phase"]
+    start_str, end_str = str(run["start_day"]), str(run["end_day"])
+    params = {"start_date": f"{start_str} 00:00:00", "end_date": f"{end_str} 23:59:59"}
 
     # ===========================
-    # 2️⃣ 提取 public_id
+    # 1️⃣ 登记图片（按 id 顺序分块，断点为 last_message_id）
     # ===========================
-    public_ids = []
-    for url in image_urls:
-        pid = extract_cloudinary_public_id(url)
-        if pid:
-            public_ids.append(pid)
-
-    if not public_ids:
-        logger.warning("⚠️ 未解析到有效 public_id")
-        return
-
-    logger.info(f"📌 成功解析 {len(public_ids)} 个 public_id")
+    if phase == "collect":
+        last_id = run["last_message_id"]
+        while True:
+            with engine.connect() as conn:
+                rows = conn.execute(
+                    text("""
+                        SELECT id, content FROM messages
+                        WHERE timestamp >= :start_date AND timestamp <= :end_date
+                          AND content LIKE :url_prefix || '%'
+                          AND id > :last_id
+                        ORDER BY id
+                        LIMIT :limit
+                    """),
+                    {**params, "url_prefix": image_storage.url_prefix(), "last_id": last_id, "limit": COLLECT_CHUNK}
+                ).fetchall()
+            if not rows:
+                break
+            images = [(mid, pid) for mid, pid in ((row[0], image_storage.key_from_url(row[1])) for row in rows) if pid]
+            last_id = rows[-1][0]
+            record_images(run_id, images, last_id)
+        phase = "delete_images"
+        set_phase(run_id, phase)
 
     # ===========================
-    # 3️⃣ 顺序批量删除 Cloudinary
+    # 2️⃣ 删除到期的图片，逐张回写状态
     # ===========================
-    deleted_total = 0
-    failed_ids = []
-
-    start_time = time.time()
-
-    for i in range(0, len(public_ids), batch_size):
-        batch = public_ids[i:i + batch_size]
-        logger.info(f"🚀 删除批次 {i//batch_size + 1}，数量 {len(batch)}")
-
-        success_count, failed_batch = delete_batch_with_retry(batch, max_retries)
-
-        deleted_total += success_count
-        failed_ids.extend(failed_batch)
-
-        logger.info(f"✅ 当前累计删除 {deleted_total}/{len(public_ids)}")
-
-        # 防止 API 限流
-        time.sleep(0.4)
-
-    elapsed = time.time() - start_time
-    logger.info(f"🎯 Cloudinary 删除完成：{deleted_total}/{len(public_ids)}，耗时 {elapsed:.2f} 秒")
+    if phase == "delete_images":
+        # 区间完整覆盖的月份目录：按前缀整月删除，几次 API 调用即可（旧的根目录图片仍走逐张删除）
+        for month in _covered_months(prefix_months(run_id, CLOUDINARY_FOLDER, pending_only=True), run):
+            prefix = f"{CLOUDINARY_FOLDER}/{month}/"
+            if delete_images_by_prefix(prefix) is not None:
+                mark_prefix_deleted(run_id, prefix)
+        while True:
+            public_ids = due_images(run_id, DELETE_CHUNK)
+            if not public_ids:
+                break
+            _, failed_ids, _ = delete_images_concurrently(public_ids, batch_size, max_retries)
+            mark_images(run_id, public_ids, failed_ids)
+
+        counts = image_counts(run_id)
+        logger.info(
+            f"🎯 清理任务 #{run_id} 图片：已删除 {counts.get('deleted', 0)}，"
+            f"等待重试 {counts.get('failed', 0)}，放弃 {counts.get('abandoned', 0)}"
+        )
+        if counts.get("failed"):
+            logger.warning(f"⏳ 清理任务 #{run_id} 还有 {counts['failed']} 张图片等待重试，数据库清理推迟到全部处理完毕")
+            return False
+        if counts.get("abandoned"):
+            logger.error(f"❌ 清理任务 #{run_id} 有 {counts['abandoned']} 张图片多次重试仍删除失败（见 retention_images）")
+        phase = "purge_rows"
+        set_phase(run_id, phase)
 
     # ===========================
-    # 4️⃣ 只有成功删除的才删数据库
+    # 3️⃣ 清理数据库：images 只置空已删除图片的链接，data 先冷归档再删除区间内全部打卡记录
     # ===========================
-    if deleted_total > 0:
-        with engine.begin() as conn:
-            result = conn.execute(
-                text("""
-                    DELETE FROM messages
-                    WHERE timestamp >= :start_date AND timestamp <= :end_date
-                    RETURNING id
-                """),
-                {
-                    "start_date": f"{start_date} 00:00:00",
-                    "end_date": f"{end_date} 23:59:59"
-                }
-            )
-            deleted_rows = len(result.fetchall())
-
-        logger.info(f"🗑 数据库删除 {deleted_rows} 条记录")
-
-    if failed_ids:
-        logger.error(f"❌ 仍有 {len(failed_ids)} 张图片删除失败")
-        for fid in failed_ids:
-            logger.error(f"   失败 public_id: {fid}")
+    if phase == "purge_rows":
+        if run["job"] == "images":
+            with engine.begin() as conn:
+                result = conn.execute(
+                    text("""
+                        UPDATE messages
+                        SET content = NULL
+                        WHERE id IN (
+                            SELECT message_id FROM retention_images
+                            WHERE run_id = :run_id AND status = 'deleted'
+                        )
+                    """),
+                    {"run_id": run_id}
+                )
+                updated_rows = result.rowcount
+                # 按前缀整月删除的目录里可能还有区间外记录引用的图片（如次月补的卡），一并置空链接
+                patterns = [
+                    f"%/{CLOUDINARY_FOLDER}/{month}/%"
+                    for month in _covered_months(prefix_months(run_id, CLOUDINARY_FOLDER), run)
+                ]
+                if patterns:
+                    result = conn.execute(
+                        text("""
+                            UPDATE messages
+                            SET content = NULL
+                            WHERE content LIKE ANY(:patterns)
+                        """),
+                        {"patterns": patterns}
+                    )
+                    updated_rows += result.rowcount
+            logger.info(f"✅ 已清空 {updated_rows} 条记录的图片链接（打卡数据保留）")
+        else:
+            # 先冷归档再删除：只删除到已归档的最大 id，归档之后新写入的行留到下次清理
+            purge_where = "timestamp >= :start_date AND timestamp <= :end_date"
+            max_id = archive_rows(purge_where, params)
+            bump_data_version(start_str, end_str)
+            deleted_rows = 0
+            if max_id is not None:
+                deleted_rows = delete_messages_in_chunks(
+                    f"{purge_where} AND id <= :max_id", {**params, "max_id": max_id},
+                    progress=lambda n: logger.info(f"🗑 清理任务 #{run_id} 已删除 {n} 条记录")
+                )
+
+            # 删除期间生成的报表缓存 / 快照可能只包含部分删除结果：再递增一次版本后让快照失效
+            bump_deleted_data_version(start_str, end_str)
+            invalidate_snapshots(start_str, end_str)
+            logger.info(f"🗑 数据库删除 {deleted_rows} 条记录")
+        set_phase(run_id, "done")
+
+    return True
+
+
+def _covered_months(months, run: dict) -> list[str]:
+    """只保留整月都落在清理区间内的月份（YYYY-MM），这些月份目录才能整体删除"""
+    covered = []
+    for month in months:
+        first = datetime.strptime(month, "%Y-%m").date()
+        last = (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        if run["start_day"] <= first and last <= run["end_day"]:
+            covered.append(month)
+    return covered
 
 
 # ===========================
-# 批量删除 + 重试机制
+# 按目录前缀整月删除（每次调用最多删除 1000 张，返回 partial 时继续调用）
 # ===========================
-def delete_batch_with_retry(public_id_list, max_retries):
-    attempt = 0
-    remaining = public_id_list
-    total_success = 0
-
-    while attempt < max_retries and remaining:
-        attempt += 1
-        logger.info(f"🔁 第 {attempt} 次尝试删除 {len(remaining)} 张图片")
+def delete_images_by_prefix(prefix: str, max_retries: int = 3):
+    """:return: 删除张数；多次重试仍失败返回 None（该目录的图片改走逐张删除）"""
+    deleted = calls = failures = 0
+    cooldown = RATE_LIMIT_COOLDOWN
+    while True:
         try:
-            response = cloudinary.api.delete_resources(remaining, resource_type="image")
-            deleted = response.get("deleted", {})
-
-            success_ids = [pid for pid, status in deleted.items() if status == "deleted"]
-            not_found_ids = [pid for pid, status in deleted.items() if status == "not_found"]
-            failed_ids = list(response.get("failed", {}).keys())
-
-            total_success += len(success_ids)
-            logger.info(f"   本次成功 {len(success_ids)}，not_found {len(not_found_ids)}，失败 {len(failed_ids)}")
-
-            remaining = failed_ids  # not_found 不重试，只重试真正失败的
+            response = image_storage.delete_prefix(prefix)
         except Exception as e:
-            logger.error(f"❌ 删除异常: {e}")
-            time.sleep(1)
+            failures += 1
+            if failures >= max_retries:
+                logger.error(f"❌ 按前缀 {prefix} 删除失败，改为逐张删除: {e}")
+                return None
+            pause = cooldown if isinstance(e, StorageRateLimited) else ERROR_PAUSE
+            logger.warning(f"⏳ 按前缀 {prefix} 删除出错（第 {failures} 次），{pause:.0f} 秒后重试: {e}")
+            time.sleep(pause)
+            cooldown = min(cooldown * 2, MAX_COOLDOWN)
+            continue
+        calls += 1
+        deleted += sum(1 for status in response.get("deleted", {}).values() if status == "deleted")
+        if not response.get("partial"):
+            break
+    logger.info(f"📁 按前缀 {prefix} 删除 {deleted} 张图片，{calls} 次 API 调用")
+    return deleted
 
-    return total_success, remaining
 
 # ===========================
-# 提取 Cloudinary public_id
+# 并发删除引擎：有界并发 + AIMD 自适应限速
 # ===========================
-import re
+# 每批最多 100 个 public_id（Admin API 单次上限），多个批次同时在途，并发上限 limit 按 AIMD 调整：
+# - 批次成功：limit += 1 / limit（每轮约 +1，加性增），不超过 CLOUDINARY_DELETE_WORKERS
+# - 限流（HTTP 420/429）：limit 减半，并暂停提交新批次 cooldown 秒（连续限流时翻倍，成功后复位）
+# - 其他错误：limit 减半，暂停 1 秒
+# - 响应头剩余额度（x-featureratelimit-remaining）不足以支撑当前在途批次：limit 减半（提前减速，不等到被限流）
+# 失败的批次 / public_id 重新排队，每批最多尝试 max_retries 次。
+DELETE_BATCH_SIZE = 100
+ERROR_PAUSE = 1.0           # 普通错误后暂停秒数
+RATE_LIMIT_COOLDOWN = 2.0   # 首次限流后的暂停秒数
+MAX_COOLDOWN = 60.0
+THROUGHPUT_LOG = os.path.join(DATA_DIR, "cleaner_throughput.jsonl")
+
 
-def extract_cloudinary_public_id(url: str):
+def _delete_batch(batch):
+    return image_storage.delete_many(batch)
+
+
+def delete_images_concurrently(public_ids, batch_size: int = DELETE_BATCH_SIZE, max_retries: int = 3,
+                               max_workers: int = CLOUDINARY_DELETE_WORKERS):
     """
-    解析 Cloudinary 图片 URL 提取 public_id
-    示例：
-    https://res.cloudinary.com/demo/image/upload/v1691234567/folder/image.jpg
-    返回 -> folder/image
-    也兼容没有版本号的情况：
-    https://res.cloudinary.com/demo/image/upload/folder/image.jpg
+    :return: (成功删除张数, 最终失败的 public_id 列表, 本次运行统计)
     """
-    if "cloudinary.com" not in url:
-        return None
-
+    queue = deque((public_ids[i:i + batch_size], 1) for i in range(0, len(public_ids), batch_size))
+    stats = {
+        "images": len(public_ids), "batches": len(queue), "requests": 0, "deleted": 0, "not_found": 0,
+        "failed": 0, "rate_limited": 0, "errors": 0, "peak_workers": 0,
+    }
+    failed_ids = []
+    in_flight = {}          # future -> (批次, 第几次尝试, 提交时刻)
+    limit = min(2.0, max_workers)
+    cooldown = RATE_LIMIT_COOLDOWN
+    resume_at = 0.0
+    last_decrease = 0.0
+
+    def requeue(batch, attempt):
+        if attempt < max_retries:
+            queue.appendleft((batch, attempt + 1))
+        else:
+            failed_ids.extend(batch)
+
+    def decrease(submitted_at: float, pause: float = 0.0) -> bool:
+        """乘性减；同一轮在途批次（减速前提交的）接连失败只减一次"""
+        nonlocal limit, resume_at, last_decrease
+        if submitted_at < last_decrease:
+            return False
+        now = time.perf_counter()
+        limit = max(1.0, limit / 2)
+        resume_at = max(resume_at, now + pause)
+        last_decrease = now
+        return True
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while queue or in_flight:
+            now = time.perf_counter()
+            while queue and len(in_flight) < int(limit) and now >= resume_at:
+                batch, attempt = queue.popleft()
+                in_flight[pool.submit(_delete_batch, batch)] = (batch, attempt, now)
+                stats["requests"] += 1
+            stats["peak_workers"] = max(stats["peak_workers"], len(in_flight))
+            if not in_flight:
+                time.sleep(max(resume_at - now, 0))
+                continue
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch, attempt, submitted_at = in_flight.pop(future)
+                try:
+                    response = future.result()
+                except StorageRateLimited as e:
+                    stats["rate_limited"] += 1
+                    if decrease(submitted_at, cooldown):
+                        logger.warning(f"⏳ Cloudinary 限流，并发降到 {int(limit)}，暂停 {cooldown:.1f} 秒: {e}")
+                        cooldown = min(cooldown * 2, MAX_COOLDOWN)
+                    requeue(batch, attempt)
+                    continue
+                except Exception as e:
+                    stats["errors"] += 1
+                    decrease(submitted_at, ERROR_PAUSE)
+                    logger.error(f"❌ 删除异常（第 {attempt} 次），当前并发上限 {int(limit)}: {e}")
+                    requeue(batch, attempt)
+                    continue
+
+                deleted = response.get("deleted", {})
+                stats["deleted"] += sum(1 for status in deleted.values() if status == "deleted")
+                stats["not_found"] += sum(1 for status in deleted.values() if status == "not_found")
+                retry_ids = list(response.get("failed", {}).keys())   # not_found 不重试，只重试真正失败的
+                if retry_ids:
+                    requeue(retry_ids, attempt)
+
+                remaining = response.get("rate_limit_remaining")
+                if remaining is not None and remaining <= len(in_flight):
+                    decrease(submitted_at)
+                else:
+                    limit = min(float(max_workers), limit + 1 / limit)
+                    cooldown = RATE_LIMIT_COOLDOWN
+
+    elapsed = time.perf_counter() - start_time
+    stats["failed"] = len(failed_ids)
+    stats["elapsed"] = round(elapsed, 3)
+    stats["per_second"] = round(stats["deleted"] / elapsed, 1) if elapsed > 0 else 0.0
+    logger.info(
+        f"🎯 Cloudinary 删除完成：{stats['deleted']}/{len(public_ids)}（not_found {stats['not_found']}，"
+        f"失败 {stats['failed']}），{stats['requests']} 次请求，限流 {stats['rate_limited']} 次，"
+        f"峰值并发 {stats['peak_workers']}，耗时 {elapsed:.2f} 秒（{stats['per_second']} 张/秒）"
+    )
+    _record_throughput(stats)
+    return stats["deleted"], failed_ids, stats
+
+
+def _record_throughput(stats: dict):
+    """每次清理的吞吐追加到 DATA_DIR/cleaner_throughput.jsonl，便于对比各月清理耗时与限流情况"""
+    if not stats["images"]:
+        return
     try:
-        parts = url.split("/")
-        idx = parts.index("upload")
-        rest = parts[idx + 1:]
-
-        # 去掉版本号段，例如 v1691234567
-        if rest and re.fullmatch(r"v\d+", rest[0]):
-            rest = rest[1:]
-
-        public_id_with_ext = "/".join(rest)
-        public_id = os.path.splitext(public_id_with_ext)[0]
-        return public_id
-    except Exception:
-        return None
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(THROUGHPUT_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"at": datetime.now(pytz.timezone("Asia/Shanghai")).isoformat(), **stats}) + "\n")
+    except OSError as e:
+        logger.warning(f"⚠️ 吞吐记录写入失败: {e}")
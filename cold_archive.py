@@ -0,0 +1,139 @@
+import os
+import json
+import logging
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+from config import DATA_DIR, BEIJING_TZ
+from db_pg import engine
+from punch_status import PUNCH_KEYWORDS
+
+# ===========================
+# 过期打卡记录的冷归档（按月 Parquet，zstd 压缩）
+# ===========================
+# 定时清理删除打卡记录之前，先把将被删除的行完整写入 DATA_DIR/archive/punches_YYYY-MM.parquet（按北京时间月份分区），
+# 再更新 manifest.json（每个月份的文件名、行数、时间范围、id 范围）。数据库删除只删到已归档的最大 id 为止。
+# /export、/export_user 读取与归档月份有交集的区间时，自动合并归档与数据库两部分（按 id 去重），对调用方透明。
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")
+MANIFEST_PATH = os.path.join(ARCHIVE_DIR, "manifest.json")
+ARCHIVE_COLUMNS = ("id", "username", "name", "keyword", "shift", "timestamp", "content")
+CATEGORY_COLUMNS = ("username", "name", "keyword", "shift")
+FETCH_CHUNK = 50000
+
+logger = logging.getLogger(__name__)
+
+
+def _archive_path(month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"punches_{month}.parquet")
+
+
+def load_manifest() -> dict:
+    if not os.path.exists(MANIFEST_PATH):
+        return {"months": {}}
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest: dict):
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+# ===========================
+# 写入归档（与删除使用同一 WHERE 条件与参数，保证归档的正是将被删除的行）
+# ===========================
+def archive_rows(where: str, params: dict):
+    """
+    把满足 where（SQLAlchemy 命名参数写法）的全部记录按月合并进归档文件，可重复执行（按 id 去重）。
+    :return: 已归档的最大 id；没有记录时返回 None
+    """
+    frames = []
+    after_id = 0
+    sql = text(f"""
+        SELECT {", ".join(ARCHIVE_COLUMNS)} FROM messages
+        WHERE ({where}) AND id > :after_id
+        ORDER BY id
+        LIMIT :limit
+    """)
+    with engine.connect() as conn:
+        while True:
+            chunk = pd.read_sql_query(sql, conn, params={**params, "after_id": after_id, "limit": FETCH_CHUNK})
+            if chunk.empty:
+                break
+            frames.append(chunk)
+            after_id = int(chunk["id"].iloc[-1])
+    if not frames:
+        return None
+
+    df = pd.concat(frames, ignore_index=True)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True).dt.tz_convert(BEIJING_TZ)
+    df["id"] = df["id"].astype("int64")
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    manifest = load_manifest()
+    for month, month_df in df.groupby(df["timestamp"].dt.strftime("%Y-%m"), sort=True):
+        path = _archive_path(month)
+        if os.path.exists(path):
+            month_df = pd.concat([pd.read_parquet(path), month_df], ignore_index=True)
+            month_df = month_df.drop_duplicates("id", keep="last")
+        month_df = month_df.sort_values(["name", "timestamp"], ignore_index=True)
+        for col in CATEGORY_COLUMNS:
+            month_df[col] = month_df[col].astype("category")
+
+        tmp_path = f"{path}.tmp"
+        pq.write_table(pa.Table.from_pandas(month_df, preserve_index=False), tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+        manifest["months"][month] = {
+            "file": os.path.basename(path),
+            "rows": len(month_df),
+            "first": month_df["timestamp"].min().isoformat(),
+            "last": month_df["timestamp"].max().isoformat(),
+            "min_id": int(month_df["id"].min()),
+            "max_id": int(month_df["id"].max()),
+            "bytes": os.path.getsize(path),
+            "updated_at": datetime.now(BEIJING_TZ).isoformat(),
+        }
+        logger.info(f"🗄️ 已归档 {month}：共 {len(month_df)} 条（{os.path.getsize(path) / 1024:.0f} KB）")
+    _save_manifest(manifest)
+    return int(df["id"].max())
+
+
+# ===========================
+# 读取归档（区间与归档月份无交集时返回 None，调用方只查数据库）
+# ===========================
+def archived_months(start_datetime: datetime, end_datetime: datetime) -> list[str]:
+    start = start_datetime.astimezone(BEIJING_TZ).strftime("%Y-%m")
+    end = end_datetime.astimezone(BEIJING_TZ).strftime("%Y-%m")
+    return [m for m in sorted(load_manifest()["months"]) if start <= m <= end]
+
+
+def load_archive(start_datetime: datetime, end_datetime: datetime, columns, user_name: str | None = None,
+                 keywords=PUNCH_KEYWORDS):
+    """读取归档中 [start, end] 内的打卡记录（列、用户、关键词过滤与数据库查询一致），结果含 id 列便于去重"""
+    months = archived_months(start_datetime, end_datetime)
+    if not months:
+        return None
+
+    read_columns = list(dict.fromkeys([*columns, "id", "keyword"]))
+    filters = [("timestamp", ">=", start_datetime), ("timestamp", "<=", end_datetime)]
+    if user_name is not None:
+        filters.append(("name", "==", user_name))
+    if keywords:
+        filters.append(("keyword", "in", list(keywords)))
+
+    frames = [
+        pd.read_parquet(_archive_path(m), columns=read_columns, filters=filters, memory_map=True)
+        for m in months if os.path.exists(_archive_path(m))
+    ]
+    if not frames:
+        return None
+    df = pd.concat(frames, ignore_index=True)
+    df = df[list(dict.fromkeys([*columns, "id"]))]
+    logger.info(f"🗄️ 命中冷归档 {months[0]}~{months[-1]}：{len(df)} 条")
+    return df
@@ -31,15 +31,69 @@ DATA_DIR = os.getenv("DATA_DIR", "./data")
 DATABASE_URL = os.getenv("DATABASE_URL")
 # ✅ PostgreSQL 数据库连接 URL，从环境变量读取。
 
+REPORT_CACHE_MAX_MB = int(os.getenv("REPORT_CACHE_MAX_MB", "200"))
+REPORT_CACHE_MAX_FILES = int(os.getenv("REPORT_CACHE_MAX_FILES", "60"))
+# ✅ 已结束周期报表缓存（DATA_DIR/report_cache）的容量上限，超出后按最近最少使用淘汰。
+
+HEAVY_TASK_CONCURRENCY = int(os.getenv("HEAVY_TASK_CONCURRENCY", "2"))
+# ✅ 导出类重任务（/export、/export_user、/export_images）全局同时运行的上限，超出的排队等待。
+
+EXPORT_MEMORY_BUDGET_MB = int(os.getenv("EXPORT_MEMORY_BUDGET_MB", "256"))
+# ✅ 团队考勤表导出的内存预算（进程峰值 RSS），由 `python export.py` 内存回归检查使用。
+
+RAW_EXPORT_PART_MB = int(os.getenv("RAW_EXPORT_PART_MB", "45"))
+# ✅ /export_raw 单个 gzip 分卷的大小上限（MB），需低于 Telegram 机器人 50MB 的文档上限。
+
+EXPORT_SHEET_WORKERS = int(os.getenv("EXPORT_SHEET_WORKERS", "1"))
+# ✅ 团队考勤表每日明细页的并行生成进程数（默认 1：在当前进程内逐页写出）；多核机器可按 python export.py workers 的实测结果调大。
+
+EXPORT_SPILL_MB = int(os.getenv("EXPORT_SPILL_MB", "20"))
+# ✅ 导出文件在内存中生成并直接发送；超过该大小（MB）才落盘到 DATA_DIR/spill，发送后删除。
+
+DELETE_CHUNK_ROWS = int(os.getenv("DELETE_CHUNK_ROWS", "2000"))
+DELETE_CHUNK_PAUSE_MS = int(os.getenv("DELETE_CHUNK_PAUSE_MS", "50"))
+# ✅ 批量删除打卡记录（定时清理、/delete_range）时每个短事务删除的行数，以及两批之间的停顿（毫秒），避免长时间锁住正在打卡的写入。
+
+IMAGE_ZIP_WORKERS = int(os.getenv("IMAGE_ZIP_WORKERS", "8"))
+# ✅ /export_images_zip 并发下载截图的线程数（每个线程复用一个 HTTP 连接）。
+
+IMAGE_ZIP_PART_MB = int(os.getenv("IMAGE_ZIP_PART_MB", "45"))
+# ✅ /export_images_zip 单个 ZIP 分卷的大小上限（MB），需低于 Telegram 机器人 50MB 的文档上限。
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+TELEGRAM_FILE_URL = os.getenv("TELEGRAM_FILE_URL", "https://api.telegram.org/file/bot")
+# ✅ Telegram Bot API 与文件下载地址（默认官方服务；基准测试时指向本地替身服务，见 fake_services.py）。
+
+# ===========================
+# 截图存储后端
+# ===========================
+IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "cloudinary")
+# ✅ 截图存储后端：cloudinary（默认）或 local（本机磁盘，用于离线测试、基准与内网部署），见 image_storage.py。
+
+IMAGE_STORAGE_DIR = os.getenv("IMAGE_STORAGE_DIR", os.path.join(DATA_DIR, "images"))
+IMAGE_STORAGE_URL = os.getenv("IMAGE_STORAGE_URL", f"file://{os.path.abspath(IMAGE_STORAGE_DIR)}").rstrip("/")
+# ✅ local 后端的存储目录与对外 URL 前缀（内网部署时可改为静态文件服务地址，如 http://host/images）。
+
 # ===========================
 # Cloudinary 云存储配置
 # ===========================
-cloudinary.config(
-    cloud_name=os.environ["cloudinary_cloud_name"],    # 云端名称（Cloudinary 控制台提供）
-    api_key=os.environ["cloudinary_api_key"],          # Cloudinary API Key
-    api_secret=os.environ["cloudinary_api_secret"]     # Cloudinary API Secret
-)
-# ✅ 初始化 Cloudinary 客户端，用于图片上传、删除、导出等操作。
+CLOUDINARY_API_URL = os.getenv("CLOUDINARY_API_URL")
+# ✅ Cloudinary 上传 / Admin API 地址，留空使用官方地址；基准测试时指向本地替身服务（fake_services.py）。
+
+if IMAGE_STORAGE == "cloudinary":
+    cloudinary.config(
+        cloud_name=os.environ["cloudinary_cloud_name"],    # 云端名称（Cloudinary 控制台提供）
+        api_key=os.environ["cloudinary_api_key"],          # Cloudinary API Key
+        api_secret=os.environ["cloudinary_api_secret"],    # Cloudinary API Secret
+        **({"upload_prefix": CLOUDINARY_API_URL} if CLOUDINARY_API_URL else {})
+    )
+# ✅ 使用 Cloudinary 后端时初始化客户端（缺少环境变量立即报错）；local 后端不需要 Cloudinary 账号。
+
+CLOUDINARY_FOLDER = os.getenv("CLOUDINARY_FOLDER", "punches")
+# ✅ 打卡截图按月上传到 Cloudinary 的 {CLOUDINARY_FOLDER}/YYYY-MM/ 目录下，月度图片清理按目录前缀整月删除。
+
+CLOUDINARY_DELETE_WORKERS = int(os.getenv("CLOUDINARY_DELETE_WORKERS", "6"))
+# ✅ 清理图片时同时在途的删除批次上限（每批 100 张）；实际并发由 AIMD 限速在 1 ~ 该值之间自动调整。
 
 
 # BEIJING_TZ = pytz.timezone("Asia/Shanghai")
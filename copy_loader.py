@@ -0,0 +1,119 @@
+import io
+import time
+import logging
+
+import pandas as pd
+
+from config import BEIJING_TZ
+from db_pg import get_conn
+
+# ===========================
+# COPY 批量读取（导出专用快速通道）
+# ===========================
+# read_sql_query 逐行构造 Python 对象再拼 DataFrame；这里直接让 PostgreSQL 把查询结果
+# 以 CSV 流写进内存缓冲区，再用 pyarrow 的 CSV 解析器一次性解析成列。
+# 时间戳统一按 UTC 输出，解析时一次性转为北京时间；低基数文本列直接解析成 category。
+CATEGORY_COLUMNS = ("username", "name", "keyword", "shift")
+
+logger = logging.getLogger(__name__)
+
+
+def copy_query(sql: str, params=None) -> io.BytesIO:
+    """执行 COPY (sql) TO STDOUT，返回 CSV 内容（含表头）的内存缓冲区"""
+    buf = io.BytesIO()
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            # 本连接内统一用 UTC 输出 timestamptz，避免依赖数据库默认时区
+            cur.execute("SET TIME ZONE 'UTC';")
+            bound_sql = cur.mogrify(sql, params).decode("utf-8")
+            cur.copy_expert(f"COPY ({bound_sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buf)
+    finally:
+        conn.close()
+    buf.seek(0)
+    return buf
+
+
+def read_copy_csv(buf) -> pd.DataFrame:
+    """解析 COPY 输出的 CSV：category 列预先定型，timestamp 一次性转为北京时间"""
+    header = buf.readline().decode("utf-8").strip()
+    buf.seek(0)
+    columns = header.split(",") if header else []
+
+    dtype = {col: "category" if col in CATEGORY_COLUMNS else "object" for col in columns if col != "timestamp"}
+    df = pd.read_csv(
+        buf,
+        engine="pyarrow",        # 多线程解析，timestamp 列直接解析为 UTC 时间
+        dtype=dtype,
+        keep_default_na=False,   # 只有空字段才是 NULL，避免把 "NA" 之类的姓名当成缺失值
+        na_values=[""],
+    )
+    if "timestamp" in df.columns:
+        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce", utc=True, format="ISO8601").dt.tz_convert(BEIJING_TZ)
+    return df
+
+
+def load_frame(sql: str, params=None) -> pd.DataFrame:
+    """COPY 读取 + 向量化解析"""
+    t0 = time.perf_counter()
+    buf = copy_query(sql, params)
+    t1 = time.perf_counter()
+    df = read_copy_csv(buf)
+    t2 = time.perf_counter()
+    logger.info(f"📥 COPY 读取 {len(df)} 行（{buf.getbuffer().nbytes / 1024 / 1024:.1f} MB），传输 {t1 - t0:.2f}s，解析 {t2 - t1:.2f}s")
+    return df
+
+
+# ===========================
+# 基准：python copy_loader.py [行数]
+# 在独立的基准表中生成合成数据（结束后删除），对比 read_sql_query(chunksize) 与 COPY 两条读取路径
+# ===========================
+_BENCH_TABLE = "bench_messages"
+
+
+def benchmark(rows: int = 1_000_000):
+    from sqlalchemy import create_engine
+    from config import DATABASE_URL
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {_BENCH_TABLE};")
+            cur.execute(f"""
+                CREATE UNLOGGED TABLE {_BENCH_TABLE} AS
+                SELECT
+                    'user' || (i % 500)                                  AS username,
+                    '用户' || lpad((i % 500)::text, 3, '0')              AS name,
+                    CASE WHEN i % 2 = 0 THEN '#上班打卡' ELSE '#下班打卡' END AS keyword,
+                    CASE WHEN i % 3 = 0 THEN 'I班（15:00-00:00）' ELSE 'F班（12:00-21:00）' END AS shift,
+                    timestamptz '2025-08-01 00:00+08' + (i % (31 * 86400)) * interval '1 second' AS timestamp,
+                    'https://res.cloudinary.com/demo/image/upload/v1/punch_' || i || '.jpg' AS content
+                FROM generate_series(1, %s) AS i;
+            """, (rows,))
+            conn.commit()
+
+    sql = f"SELECT name, timestamp, keyword, shift FROM {_BENCH_TABLE} WHERE keyword = ANY(%(keywords)s)"
+    params = {"keywords": ["#上班打卡", "#下班打卡"]}
+    try:
+        t0 = time.perf_counter()
+        engine = create_engine(DATABASE_URL)
+        old_df = pd.concat(pd.read_sql_query(sql, engine, params=params, chunksize=50000), ignore_index=True)
+        old_df["timestamp"] = pd.to_datetime(old_df["timestamp"], utc=True).dt.tz_convert(BEIJING_TZ)
+        t1 = time.perf_counter()
+        new_df = load_frame(sql, params)
+        t2 = time.perf_counter()
+    finally:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {_BENCH_TABLE};")
+                conn.commit()
+
+    old_mb = old_df.memory_usage(deep=True).sum() / 1024 / 1024
+    new_mb = new_df.memory_usage(deep=True).sum() / 1024 / 1024
+    print(f"read_sql_query：{len(old_df)} 行，{t1 - t0:.2f}s，DataFrame {old_mb:.1f} MB")
+    print(f"COPY          ：{len(new_df)} 行，{t2 - t1:.2f}s，DataFrame {new_mb:.1f} MB")
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,129 @@
+import os
+import shutil
+import logging
+from datetime import datetime, date, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import DATA_DIR, BEIJING_TZ
+from db_pg import get_data_version
+
+# ===========================
+# 按日持久化的团队报表分类结果（每晚追加刚结束的一天，导出时直接复用）
+# ===========================
+# 日期 D 的文件 DATA_DIR/daily/YYYY-MM/YYYY-MM-DD.parquet 保存归属 D 的全部分类后明细行：
+# 当天打卡 + 次日凌晨 I班跨天下班卡 + 补齐的休息/缺勤、未打下班卡行（含状态位，统计可直接由状态位累加）。
+# 归属 D 的打卡落在 [D 00:00, D+1 06:00)，该窗口全部过去才算“已结束”，才允许持久化。
+# 文件元数据记录 D、D+1 两天的数据版本戳与用户/班次配置摘要，任一变化即视为失效、重新生成。
+DAY_STORE_DIR = os.path.join(DATA_DIR, "daily")
+SPILL = timedelta(hours=6)
+CATEGORY_COLUMNS = ("name", "keyword", "shift", "remark")
+
+logger = logging.getLogger(__name__)
+
+
+def day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=BEIJING_TZ)
+
+
+def day_window_end(day: date) -> datetime:
+    """归属 day 的打卡窗口终点（不含）：次日 06:00"""
+    return day_start(day) + timedelta(days=1) + SPILL
+
+
+def is_day_closed(day: date, now: datetime | None = None) -> bool:
+    return day_window_end(day) <= (now or datetime.now(BEIJING_TZ))
+
+
+def last_closed_day(now: datetime | None = None) -> date:
+    return ((now or datetime.now(BEIJING_TZ)) - SPILL).date() - timedelta(days=1)
+
+
+def _day_path(day: date) -> str:
+    return os.path.join(DAY_STORE_DIR, f"{day:%Y-%m}", f"{day:%Y-%m-%d}.parquet")
+
+
+def day_stamp(day: date, digest: str) -> str:
+    """D、D+1 两天的数据版本戳 + 配置摘要；须在查询该日数据之前读取（见 write_day_report）"""
+    return f"{get_data_version(day, day + timedelta(days=1))}|{digest}"
+
+
+# ===========================
+# 区间内可复用的日期：打卡窗口完整落在 [start, end] 内且已结束（连续的一段）
+# ===========================
+def reusable_days(start_datetime: datetime, end_datetime: datetime, now: datetime | None = None) -> list[date]:
+    start = start_datetime if start_datetime.tzinfo else start_datetime.replace(tzinfo=BEIJING_TZ)
+    end = end_datetime if end_datetime.tzinfo else end_datetime.replace(tzinfo=BEIJING_TZ)
+    start = start.astimezone(BEIJING_TZ)
+    end = min(end.astimezone(BEIJING_TZ), now or datetime.now(BEIJING_TZ))
+
+    first = start.date() if day_start(start.date()) >= start else start.date() + timedelta(days=1)
+    days = []
+    current = first
+    while day_window_end(current) <= end:
+        days.append(current)
+        current += timedelta(days=1)
+    return days
+
+
+# ===========================
+# 写入 / 校验 / 读取（先写临时文件再原子替换）
+# ===========================
+def write_day_report(day: date, df: pd.DataFrame, stamp: str) -> str:
+    """
+    stamp 为查询 df 之前由 day_stamp 读取的版本戳：查询与写入之间提交的改动会让当前版本戳变化，
+    文件随之视为失效，不会把新版本记在旧数据上。
+    """
+    path = _day_path(day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = df.copy()
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype(object)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}), b"day_stamp": stamp.encode("utf-8")
+    })
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+    logger.info(f"🗓️ 已写入按日报表 {day:%Y-%m-%d}：{len(df)} 行")
+    return path
+
+
+def day_report_is_valid(day: date, stamp: str) -> bool:
+    """stamp 为当前的 day_stamp(day, digest)"""
+    path = _day_path(day)
+    if not os.path.exists(path):
+        return False
+    metadata = pq.read_schema(path, memory_map=True).metadata or {}
+    return metadata.get(b"day_stamp", b"").decode("utf-8") == stamp
+
+
+def load_day_reports(days) -> pd.DataFrame | None:
+    """读取多天的分类结果并合并；任一天缺失或读取失败返回 None（调用方回退到完整计算）"""
+    try:
+        frames = [pd.read_parquet(_day_path(d), memory_map=True) for d in days]
+    except Exception as e:
+        logger.warning(f"⚠️ 读取按日报表失败，回退完整计算: {e}")
+        return None
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+# ===========================
+# 清理：只保留最近几个月
+# ===========================
+def prune_day_reports(keep_months: int = 3):
+    if not os.path.isdir(DAY_STORE_DIR):
+        return
+    cutoff = datetime.now(BEIJING_TZ).date().replace(day=1)
+    for _ in range(keep_months - 1):
+        cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+    for month_dir in os.listdir(DAY_STORE_DIR):
+        if month_dir < f"{cutoff:%Y-%m}":
+            shutil.rmtree(os.path.join(DAY_STORE_DIR, month_dir), ignore_errors=True)
+            logger.info(f"🧹 已清理按日报表目录 {month_dir}")
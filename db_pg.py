@@ -1,13 +1,16 @@
 import os
+import time
+import logging
 import psycopg2
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from datetime import datetime, timedelta, timezone
-from config import BEIJING_TZ, DATABASE_URL
+from config import BEIJING_TZ, DATABASE_URL, DELETE_CHUNK_ROWS, DELETE_CHUNK_PAUSE_MS
 
 # ===========================
 # 数据库配置
 # ===========================
 engine = create_engine(DATABASE_URL)
+logger = logging.getLogger(__name__)
 
 
 # ===========================
@@ -44,6 +47,10 @@ def init_db():
                 );
             """)
 
+            # 创建 messages 索引（导出 / 清理按时间范围查询，个人导出按 姓名 + 时间范围 查询）
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_name_timestamp ON messages (name, timestamp);")
+
             # 创建 users 表
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -52,6 +59,41 @@ def init_db():
                 );
             """)
 
+            # 创建 data_versions 表（按日期记录数据版本，用于报表缓存失效）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS data_versions (
+                    day DATE PRIMARY KEY,
+                    version BIGINT NOT NULL DEFAULT 0
+                );
+            """)
+
+            # 创建清理任务日志表（定时清理中途中断后可从断点续跑，见 retention_journal.py）
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS retention_runs (
+                    id SERIAL PRIMARY KEY,
+                    job TEXT NOT NULL,
+                    start_day DATE NOT NULL,
+                    end_day DATE NOT NULL,
+                    phase TEXT NOT NULL DEFAULT 'collect',
+                    last_message_id INTEGER NOT NULL DEFAULT 0,
+                    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    finished_at TIMESTAMPTZ
+                );
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS retention_images (
+                    run_id INTEGER NOT NULL REFERENCES retention_runs (id) ON DELETE CASCADE,
+                    message_id INTEGER NOT NULL,
+                    public_id TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (run_id, message_id)
+                );
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_retention_images_status ON retention_images (run_id, status, next_attempt_at);")
+
             # 创建 shifts 表
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS shifts (
@@ -92,6 +134,101 @@ def init_shifts():
     
 init_shifts()
 
+# ===========================
+# 数据版本戳（任何写入/删除 messages 都要递增对应日期的版本，报表缓存据此失效）
+# ===========================
+_BUMP_DAYS_SQL = """
+    INSERT INTO data_versions (day, version)
+    SELECT d::date, 1
+    FROM generate_series(
+        GREATEST(%s::date, (SELECT MIN(timestamp AT TIME ZONE 'Asia/Shanghai')::date FROM messages)),
+        %s::date,
+        interval '1 day'
+    ) AS d
+    ON CONFLICT (day) DO UPDATE SET version = data_versions.version + 1
+"""
+
+_BUMP_USER_DAYS_SQL = """
+    INSERT INTO data_versions (day, version)
+    SELECT DISTINCT (timestamp AT TIME ZONE 'Asia/Shanghai')::date, 1
+    FROM messages
+    WHERE username = %s
+    ON CONFLICT (day) DO UPDATE SET version = data_versions.version + 1
+    RETURNING day
+"""
+
+# 删除完成后的再次递增：数据已删除，无法再按剩余打卡记录确定日期，只递增删除前已登记过版本的日期
+_REBUMP_RANGE_SQL = "UPDATE data_versions SET version = version + 1 WHERE day BETWEEN %s AND %s"
+_REBUMP_DAYS_SQL = "UPDATE data_versions SET version = version + 1 WHERE day = ANY(%s)"
+
+
+def _as_beijing_date(value):
+    """把 datetime / date / 'YYYY-MM-DD' 字符串统一转换成北京时间的 date"""
+    if isinstance(value, str):
+        value = datetime.strptime(value[:10], "%Y-%m-%d")
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(BEIJING_TZ)
+        return value.date()
+    return value
+
+
+def _bump_data_version(cur, start, end=None):
+    """在已有游标（同一事务）内递增 [start, end] 日期区间的数据版本"""
+    start_day = _as_beijing_date(start)
+    end_day = _as_beijing_date(end) if end is not None else start_day
+    cur.execute(_BUMP_DAYS_SQL, (start_day, end_day))
+
+
+def bump_data_version(start, end=None):
+    """
+    递增 [start, end] 日期区间的数据版本（独立连接，供 SQLAlchemy 等外部写入路径调用）。
+    注意：删除类操作需在删除**之前**调用，否则起始日期会被裁剪到剩余数据的最早日期之后。
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _bump_data_version(cur, start, end)
+            conn.commit()
+
+
+def bump_user_data_version(username):
+    """递增某用户所有打卡日期的数据版本（迁移 / 整体删除用户数据前调用），返回涉及的日期列表"""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_BUMP_USER_DAYS_SQL, (username,))
+            days = [row[0] for row in cur.fetchall()]
+            conn.commit()
+    return days
+
+
+def bump_deleted_data_version(start=None, end=None, days=None):
+    """
+    删除完成后再次递增受影响日期的数据版本（[start, end] 区间或 days 日期列表）。
+    删除前的递增只能让删除前的缓存失效；分块删除进行中生成的报表只包含部分删除结果，须在删除后再递增一次。
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            if days is not None:
+                cur.execute(_REBUMP_DAYS_SQL, (list(days),))
+            else:
+                start_day = _as_beijing_date(start)
+                end_day = _as_beijing_date(end) if end is not None else start_day
+                cur.execute(_REBUMP_RANGE_SQL, (start_day, end_day))
+            conn.commit()
+
+
+def get_data_version(start, end):
+    """返回 [start, end] 日期区间的数据版本戳（版本只增不减，求和即可反映任何变动）"""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COALESCE(SUM(version), 0), COUNT(*) FROM data_versions
+                WHERE day BETWEEN %s AND %s
+            """, (_as_beijing_date(start), _as_beijing_date(end)))
+            total, days = cur.fetchone()
+            return f"{total}-{days}"
+
+
 # ===========================
 # 用户打卡检查（指定关键词）
 # ===========================
@@ -130,6 +267,7 @@ def save_message(username, name, content, timestamp, keyword, shift=None):
                 INSERT INTO messages (username, name, content, timestamp, keyword, shift)
                 VALUES (%s, %s, %s, %s, %s, %s)
             """, (username, name, content, timestamp, keyword, shift))
+            _bump_data_version(cur, timestamp)
             conn.commit()
 
 
@@ -167,6 +305,51 @@ def get_user_logs_by_name(name: str, start: datetime, end: datetime):
             """, (name, start, end))
             return cur.fetchall()
             
+# ===========================
+# 分块删除打卡记录（按 id 顺序的键集分页，每块一个短事务）
+# ===========================
+_CHUNK_DELETE_SQL = """
+    WITH batch AS (
+        SELECT id FROM messages
+        WHERE ({where}) AND id > :after_id
+        ORDER BY id
+        LIMIT :chunk_size
+    ),
+    deleted AS (
+        DELETE FROM messages WHERE id IN (SELECT id FROM batch)
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM deleted), (SELECT MAX(id) FROM batch)
+"""
+
+
+def delete_messages_in_chunks(where: str, params: dict, chunk_size: int = DELETE_CHUNK_ROWS,
+                              pause_ms: int = DELETE_CHUNK_PAUSE_MS, progress=None) -> int:
+    """
+    删除满足 where（SQLAlchemy 命名参数写法）的全部打卡记录，返回删除行数。
+    每块最多 chunk_size 行、单独提交，两块之间停顿 pause_ms 毫秒，行锁只在单块内持有，
+    不会长时间阻塞打卡写入；progress(已删除行数) 每块回调一次。
+    数据版本需由调用方在删除前递增。
+    """
+    sql = text(_CHUNK_DELETE_SQL.format(where=where))
+    after_id = 0
+    total = 0
+    started = time.perf_counter()
+    while True:
+        with engine.begin() as conn:
+            deleted, last_id = conn.execute(sql, {**params, "after_id": after_id, "chunk_size": chunk_size}).fetchone()
+        if last_id is None:
+            break
+        total += deleted
+        after_id = last_id
+        if progress:
+            progress(total)
+        if pause_ms:
+            time.sleep(pause_ms / 1000)
+    logger.info(f"🗑 分块删除完成：{total} 条记录，耗时 {time.perf_counter() - started:.1f} 秒")
+    return total
+
+
 # ===========================
 # 删除旧数据（含过期图片）
 # ===========================
@@ -180,8 +363,13 @@ def delete_old_data(days=30):
                 WHERE timestamp < %s AND content LIKE '%%.jpg'
             """, (cutoff,))
             photos = [row[0] for row in cur.fetchall()]
-            cur.execute("DELETE FROM messages WHERE timestamp < %s", (cutoff,))
+            _bump_data_version(cur, "1970-01-01", cutoff)
             conn.commit()
+    delete_messages_in_chunks("timestamp < :cutoff", {"cutoff": cutoff})
+    bump_deleted_data_version("1970-01-01", cutoff)
+
+    from month_snapshot import invalidate_snapshots    # month_snapshot 导入 db_pg，只能在此处导入
+    invalidate_snapshots()      # 截止日期之前不限起点，全部快照失效
     return photos
 
 
@@ -190,8 +378,10 @@ def delete_old_data(days=30):
 # ===========================
 def save_shift(username, shift):
     """更新用户最后一条打卡记录的班次"""
+    now = datetime.now(BEIJING_TZ)
     with get_conn() as conn:
         with conn.cursor() as cur:
+            _bump_data_version(cur, now - timedelta(days=1), now)
             cur.execute("""
                 UPDATE messages 
                 SET shift = %s 
@@ -276,7 +466,8 @@ def transfer_user_data(user_a, user_b):
             if user_a_data[1] and not user_b_data[1]:
                 cur.execute("UPDATE users SET name=%s WHERE username=%s", (user_a_data[1], user_b))
 
-            # 更新 messages：将 A 的记录归属迁移到 B
+            # 更新 messages：将 A 的记录归属迁移到 B（先递增 A 所有打卡日期的数据版本）
+            cur.execute(_BUMP_USER_DAYS_SQL, (user_a,))
             cur.execute("""
                 UPDATE messages
                 SET username=%s, name=(SELECT name FROM users WHERE username=%s)
@@ -323,6 +514,7 @@ def update_today_shift(username, new_shift):
         )
     """, (new_shift, username, today))
 
+    _bump_data_version(cur, today)
     conn.commit()
 
     # ✅ 新增日志
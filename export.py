@@ -1,17 +1,38 @@
+import io
 import os
 import re
+import resource
+import numpy as np
+import pyarrow as pa
 import pandas as pd
 import pytz
 import logging
 from datetime import datetime, timedelta
-from config import DATA_DIR, DATABASE_URL, BEIJING_TZ
-import cloudinary
-import cloudinary.uploader
-from openpyxl import Workbook, load_workbook
+from config import BEIJING_TZ, EXPORT_MEMORY_BUDGET_MB, EXPORT_SHEET_WORKERS
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+from db_pg import get_conn  # 须先于 shift_manager 导入（db_pg 导入时加载班次，见 init_shifts）
 from shift_manager import get_shift_times_short
-from sqlalchemy import create_engine
-from db_pg import get_conn 
+from copy_loader import load_frame
+from cold_archive import load_archive
+from export_spool import spool_target, spool_document, spool_file
+from month_snapshot import (
+    SPILL, month_start, next_month, is_month_closed, month_version, snapshot_is_valid, write_snapshot, load_snapshot
+)
+from punch_status import (
+    REST, NO_CHECKOUT, STATUS_TAGS, STATUS_CODES,
+    STAT_COLUMNS, PUNCH_KEYWORDS, status_remark, status_code, count_status, classify_frame
+)
+from sheet_writer import (
+    DAY_HEADERS, USER_FILLS, register_styles, styled_cell, blank_row, set_column_widths, status_fill, write_day_sheets
+)
+from report_cache import (
+    is_closed_period, report_cache_key, load_cached_report, load_cached_summary, store_cached_report, config_digest
+)
+from day_store import (
+    day_start, last_closed_day, reusable_days, day_stamp, write_day_report, day_report_is_valid, load_day_reports, prune_day_reports
+)
 
 
 # ===========================
@@ -26,64 +47,153 @@ def safe_filename(name: str) -> str:
     return re.sub(r'[\\/*?:"<>|]', "_", str(name))
 
 # ===========================
-# 迟到分钟数 / 签到异常窗口判断（均按“时分”做环形计算，不依赖日期，兼容跨天班次）
+# 补齐缺勤 / 未打下班卡行（用户 × 日期 交叉连接后与实际打卡做反连接，一次生成）
 # ===========================
-def _time_to_minutes(t) -> int:
-    return t.hour * 60 + t.minute
-
-def _late_minutes(ts_time, start_time) -> int:
-    """打卡时间相对班次开始时间晚了多少分钟（环形计算，兼容跨天）"""
-    return (_time_to_minutes(ts_time) - _time_to_minutes(start_time)) % 1440
-
-def _in_shift_window(ts_time, start_time, end_time, margin: int = 30) -> bool:
-    """打卡时间是否落在【班次开始前margin分钟，班次结束后margin分钟】这个窗口内（环形计算，兼容跨天班次）"""
-    t = _time_to_minutes(ts_time)
-    s = (_time_to_minutes(start_time) - margin) % 1440
-    e = (_time_to_minutes(end_time) + margin) % 1440
-    if s <= e:
-        return s <= t <= e
-    else:
-        return t >= s or t <= e
+def _missing_punch_rows(df: pd.DataFrame, names, dates, date_col: str, rest_without_checkin: bool = True) -> pd.DataFrame:
+    """
+    :param rest_without_checkin: True 时当日没有上班卡即记为休息/缺勤（团队表）；
+                                 False 时当日没有任何打卡才记为休息/缺勤（个人表）
+    :return: 待追加的休息/缺勤（REST）与未打下班卡（NO_CHECKOUT）行
+    """
+    grid = pd.MultiIndex.from_product([list(dates), list(names)], names=[date_col, "name"])
+
+    def present(rows: pd.DataFrame):
+        return grid.isin(pd.MultiIndex.from_frame(rows[[date_col, "name"]]))
+
+    has_up = present(df[df["keyword"] == "#上班打卡"])
+    has_down = present(df[df["keyword"] == "#下班打卡"])
+    absent = ~has_up if rest_without_checkin else ~present(df)
+    unclosed = has_up & ~has_down
+
+    rest_df = grid[absent].to_frame(index=False)
+    rest_df["timestamp"] = pd.NaT
+    rest_df["keyword"] = None
+    rest_df["shift"] = None
+    rest_df["remark"] = "休息/缺勤"
+    rest_df["status"] = REST
+
+    unclosed_df = grid[unclosed].to_frame(index=False)
+    unclosed_df["timestamp"] = pd.NaT
+    unclosed_df["keyword"] = "#下班打卡"
+    unclosed_df["shift"] = None
+    unclosed_df["remark"] = "未打下班卡"
+    unclosed_df["status"] = NO_CHECKOUT
+
+    return pd.concat([unclosed_df, rest_df], ignore_index=True)
+
+# ===========================
+# 紧凑列类型：姓名 / 关键词 / 班次 / 备注 用 category（整数编码 + 少量类别字符串）
+# ===========================
+def _compact_dtypes(df: pd.DataFrame, all_user_names=()) -> pd.DataFrame:
+    """原地把 name / keyword / shift 转为 category；类别按字典序排列，排序结果与字符串列一致"""
+    names = set(all_user_names) | set(df["name"].dropna().unique())
+    keywords = set(PUNCH_KEYWORDS) | set(df["keyword"].dropna().unique())
+    df["name"] = df["name"].astype(pd.CategoricalDtype(sorted(names)))
+    df["keyword"] = df["keyword"].astype(pd.CategoricalDtype(sorted(keywords)))
+    df["shift"] = df["shift"].astype("category")
+    return df
 
-def _late_tag(ts_time, start_time) -> str:
-    """根据迟到分钟数生成迟到分档标签"""
-    minutes = _late_minutes(ts_time, start_time)
-    return "迟到（≥15分钟）" if minutes >= 15 else "迟到（<15分钟）"
+def _category_lookup(series: pd.Series, fn=None):
+    """
+    category 列 -> (每行取值数组, 每行文本长度数组)，缺失值为 None / 0。
+    fn（如班次格式化）只对每个类别调用一次，再按编码广播回每一行。
+    """
+    values = [fn(c) if fn else c for c in series.cat.categories]
+    lookup = np.empty(len(values) + 1, dtype=object)
+    lookup[:-1] = values
+    lookup[-1] = None                      # 编码 -1（缺失）取最后一个
+    lengths = np.array([len(str(v)) if pd.notna(v) else 0 for v in values] + [0], dtype=np.int64)
+    codes = series.cat.codes.to_numpy()
+    return lookup[codes], lengths[codes]
 
 # ===========================
-# 上传文件到 Cloudinary
+# 进程峰值 RSS（MB；Linux 下 ru_maxrss 单位为 KB）
 # ===========================
-def upload_to_cloudinary(file_path: str) -> str | None:
-    try:
-        result = cloudinary.uploader.upload(
-            file_path,
-            resource_type="raw",
-            folder="telegram_exports",
-            public_id=os.path.splitext(os.path.basename(file_path))[0]
-        )
-        return result.get("secure_url")
-    except Exception as e:
-        logging.error(f"❌ Cloudinary 上传失败: {e}")
-        return None
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# ===========================
+# 异常统计 -> 聊天消息摘要（与统计表同源）
+# ===========================
+def format_stats_summary(summary_df: pd.DataFrame, top: int = 5) -> str:
+    """summary_df 为 count_status 的结果（以姓名为索引）"""
+    if summary_df is None or summary_df.empty:
+        return ""
+    totals = summary_df.sum()
+    lines = ["📋 异常汇总：" + " | ".join(f"{col} {int(totals[col])}" for col in STAT_COLUMNS)]
+    worst = summary_df[summary_df["异常总数"] > 0].sort_values("异常总数", ascending=False).head(top)
+    if not worst.empty:
+        lines.append("⚠️ 异常最多：" + "、".join(f"{name}({int(n)})" for name, n in worst["异常总数"].items()))
+    return "\n".join(lines)
 
 # ===========================
 # 读取数据库数据到 DataFrame
 # ===========================
-def _fetch_data(start_datetime: datetime, end_datetime: datetime) -> pd.DataFrame:
+# 导出用到的列（团队/个人考勤表都不渲染 content，不必把图片链接读进内存）
+EXPORT_COLUMNS = ("name", "timestamp", "keyword", "shift")
+_ALLOWED_COLUMNS = {"id", "username", "name", "content", "timestamp", "keyword", "shift"}
+
+def _build_export_query(start_datetime: datetime, end_datetime: datetime, columns=EXPORT_COLUMNS,
+                        user_name: str | None = None, keywords=PUNCH_KEYWORDS):
+    """
+    生成导出查询：列裁剪、用户过滤、关键词过滤都下推到 SQL。
+    指定 user_name 时走 (name, timestamp) 索引，只扫描该用户的时间范围。
+    :return: (sql, params)
+    """
+    unknown = set(columns) - _ALLOWED_COLUMNS
+    if unknown:
+        raise ValueError(f"不支持的导出列: {sorted(unknown)}")
+
+    conditions = ["timestamp BETWEEN %(start)s AND %(end)s"]
+    params = {
+        "start": start_datetime.astimezone(pytz.UTC),
+        "end": end_datetime.astimezone(pytz.UTC)
+    }
+    if user_name is not None:
+        conditions.append("name = %(name)s")
+        params["name"] = user_name
+    if keywords:
+        # 只保留真正的打卡类记录，过滤掉 #取消打卡 等审计类关键词
+        conditions.append("keyword = ANY(%(keywords)s)")
+        params["keywords"] = list(keywords)
+
+    query = f"""
+        SELECT {", ".join(columns)}
+        FROM messages
+        WHERE {" AND ".join(conditions)}
+    """
+    return query, params
+
+def _fetch_data(start_datetime: datetime, end_datetime: datetime, user_name: str | None = None,
+                columns=EXPORT_COLUMNS) -> pd.DataFrame:
+    # 区间涉及已冷归档的月份时，合并归档与数据库两部分（归档后、数据库删除完成前两边会有重复行，按 id 去重）
+    archived = load_archive(start_datetime, end_datetime, columns, user_name)
+    if archived is None:
+        return _fetch_live(start_datetime, end_datetime, user_name, columns)
+
+    live = _fetch_live(start_datetime, end_datetime, user_name, tuple(dict.fromkeys([*columns, "id"])))
+    if not live.empty:
+        live["id"] = live["id"].astype("int64")
+    df = pd.concat([f for f in (archived, live) if not f.empty], ignore_index=True)
+    if df.empty:
+        return archived.drop(columns="id")
+    df = df.drop_duplicates("id").drop(columns="id")
+    for col in ("name", "keyword", "shift"):
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df.dropna(subset=["timestamp"]).reset_index(drop=True)
+
+def _fetch_live(start_datetime: datetime, end_datetime: datetime, user_name: str | None = None,
+                columns=EXPORT_COLUMNS) -> pd.DataFrame:
+    # 已结束月份优先读取列式快照（区间被有效快照完整覆盖时才使用，否则查询数据库）
+    df = load_snapshot(start_datetime, end_datetime, columns, user_name)
+    if df is not None:
+        return df.dropna(subset=["timestamp"])
+
     try:
-        engine = create_engine(DATABASE_URL)
-        query = """
-        SELECT username, name, content, timestamp, keyword, shift 
-        FROM messages 
-        WHERE timestamp BETWEEN %(start)s AND %(end)s
-        """
-        params = {
-            "start": start_datetime.astimezone(pytz.UTC),
-            "end": end_datetime.astimezone(pytz.UTC)
-        }
-        # 分块读取（避免大数据内存溢出）
-        df_iter = pd.read_sql_query(query, engine, params=params, chunksize=50000)
-        df = pd.concat(df_iter, ignore_index=True)
+        query, params = _build_export_query(start_datetime, end_datetime, columns, user_name)
+        # COPY 批量读取（timestamp 已转为北京时间，name/keyword/shift 为 category）
+        df = load_frame(query, params)
         logging.info(f"✅ 数据读取完成，共 {len(df)} 条记录")
     except Exception as e:
         logging.error(f"❌ 无法连接数据库或读取数据: {e}")
@@ -92,14 +202,21 @@ def _fetch_data(start_datetime: datetime, end_datetime: datetime) -> pd.DataFram
     if df.empty:
         return df
 
-    # 时间转为北京时区
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce", utc=True).dt.tz_convert(BEIJING_TZ)
-    df = df.dropna(subset=["timestamp"]).copy()
-
-    # 只保留真正的打卡类记录，过滤掉 #取消打卡 等审计类关键词
-    df = df[df["keyword"].isin(["#上班打卡", "#下班打卡"])].copy()
+    return df.dropna(subset=["timestamp"])
 
-    return df
+# ===========================
+# 月度快照刷新（定时任务）：最近几个已结束月份缺失或已失效的快照重新生成
+# ===========================
+def refresh_month_snapshots(months: int = 3):
+    current = month_start(datetime.now(BEIJING_TZ))
+    for _ in range(months):
+        current = month_start(current - timedelta(days=1))
+        if not is_month_closed(current) or snapshot_is_valid(current):
+            continue
+        version = month_version(current)     # 先读版本再查询，查询期间的改动会使快照失效
+        span_end = next_month(current) + SPILL
+        query, params = _build_export_query(current, span_end - timedelta(microseconds=1))
+        write_snapshot(current, load_frame(query, params), version)
 
 # 获取所有用户姓名
 def get_all_user_names():
@@ -108,346 +225,377 @@ def get_all_user_names():
             cur.execute("SELECT name FROM users;")
             return [row[0] for row in cur.fetchall()]
 
-# 导出打卡记录
-def export_excel(start_datetime: datetime, end_datetime: datetime):
-    df = _fetch_data(start_datetime, end_datetime)
-    if df.empty:
+# 团队报表文件名
+def _team_excel_name(start_datetime: datetime, end_datetime: datetime, layout: str = "daily") -> str:
+    start_str = start_datetime.strftime("%Y-%m-%d")
+    end_str = (end_datetime - pd.Timedelta(seconds=1)).strftime("%Y-%m-%d")
+    prefix = "打卡矩阵" if layout == "matrix" else "打卡记录"
+    return f"{prefix}_{start_str}_{end_str}.xlsx"
+
+# 导出打卡记录（layout: daily 每天一页 / matrix 用户 × 日期 单页矩阵）
+def export_excel(start_datetime: datetime, end_datetime: datetime, layout: str = "daily"):
+    return export_excel_with_summary(start_datetime, end_datetime, layout)[0]
+
+# 导出打卡记录并返回 (导出文件, 异常汇总文本)（已结束周期优先命中报表缓存）
+# 导出文件为 export_spool 的 (文件名, 内容)：通常是内存中的 bytes，超过阈值才落盘
+def export_excel_with_summary(start_datetime: datetime, end_datetime: datetime, layout: str = "daily"):
+    if layout not in TEAM_LAYOUTS:
+        raise ValueError(f"不支持的报表版式: {layout}")
+
+    cache_key = None
+    if is_closed_period(end_datetime):
+        cache_key = report_cache_key("team" if layout == "daily" else f"team_{layout}", start_datetime, end_datetime)
+        cached = load_cached_report(cache_key) if cache_key else None
+        if cached is not None:
+            return spool_file(_team_excel_name(start_datetime, end_datetime, layout), cached), load_cached_summary(cache_key)
+
+    doc, summary_df = _build_excel(start_datetime, end_datetime, layout)
+    summary_text = format_stats_summary(summary_df)
+    if cache_key and doc:
+        store_cached_report(cache_key, doc[1], summary_text)
+    return doc, summary_text
+
+def _build_excel(start_datetime: datetime, end_datetime: datetime, layout: str = "daily"):
+    classified = _classify_range(start_datetime, end_datetime, get_all_user_names())
+    excel_name = _team_excel_name(start_datetime, end_datetime, layout)
+    if classified is None:
         logging.warning("⚠️ 指定日期内没有数据")
-        export_dir = os.path.join(DATA_DIR, f"excel_{start_datetime:%Y-%m-%d}_{end_datetime - pd.Timedelta(seconds=1):%Y-%m-%d}")
-        os.makedirs(export_dir, exist_ok=True)
-        excel_path = os.path.join(export_dir, f"打卡记录_{start_datetime:%Y-%m-%d}_{end_datetime - pd.Timedelta(seconds=1):%Y-%m-%d}.xlsx")
-        with pd.ExcelWriter(excel_path, engine="openpyxl") as writer:
+        buf = io.BytesIO()
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
             pd.DataFrame(columns=["姓名", "打卡时间", "关键词", "班次", "备注"]).to_excel(writer, sheet_name="空表", index=False)
-        return excel_path
+        return spool_document(excel_name, buf), None
 
+    df, summary_df = classified
+    # 预计超过落盘阈值的报表直接写入 SPILL_DIR 下的文件，不在内存中生成
+    target = spool_target(excel_name, len(df) * TEAM_XLSX_BYTES_PER_ROW[layout])
+    try:
+        TEAM_LAYOUTS[layout](df, summary_df, target)
+    except Exception:
+        if isinstance(target, str) and os.path.exists(target):
+            os.remove(target)
+        raise
+    size = target.tell() if isinstance(target, io.BytesIO) else os.path.getsize(target)
+    logging.info(f"📈 导出完成：{excel_name}（{size / 1024 / 1024:.1f} MB），进程峰值 RSS {_peak_rss_mb():.0f} MB")
+    return spool_document(excel_name, target), summary_df
+
+def _classify_team_frame(df: pd.DataFrame, all_user_names):
+    """
+    团队报表公共预处理（原地修改 df）：去时区、跨天下班卡归日、状态分类、补齐缺勤 / 未打下班卡、生成备注。
+    :return: (按 日期倒序 / 姓名 / 时间 排好序的明细, 异常统计 summary_df)
+    """
     # ======================== 时间处理 ========================
     if pd.api.types.is_datetime64_any_dtype(df["timestamp"]):
         try:
             df["timestamp"] = df["timestamp"].dt.tz_localize(None)
-        except AttributeError:
+        except (AttributeError, TypeError):
             pass
 
-    df["date"] = df["timestamp"].dt.strftime("%Y-%m-%d")
-    start_str = start_datetime.strftime("%Y-%m-%d")
-    end_str = (end_datetime - pd.Timedelta(seconds=1)).strftime("%Y-%m-%d")
+    _compact_dtypes(df, all_user_names)
 
-    export_dir = os.path.join(DATA_DIR, f"excel_{start_str}_{end_str}")
-    os.makedirs(export_dir, exist_ok=True)
-    excel_path = os.path.join(export_dir, f"打卡记录_{start_str}_{end_str}.xlsx")
+    # I班凌晨下班卡（次日）归入前一天的 sheet（只改日期列，不拆分/复制数据）
+    i_shift_by_code = np.append(df["shift"].cat.categories.astype(str).str.startswith("I班"), False)
+    cross_mask = (
+        (df["keyword"] == "#下班打卡").to_numpy() &
+        i_shift_by_code[df["shift"].cat.codes.to_numpy()] &
+        (df["timestamp"].dt.hour < 6).to_numpy()
+    )
+    day = df["timestamp"].dt.normalize()
+    df["date"] = day.where(~cross_mask, day - pd.Timedelta(days=1))
+    df["remark"] = np.where(cross_mask, "（次日）", None)
 
-    all_user_names = get_all_user_names()
+    # ======================== 迟到/早退/补卡/签到异常（整表向量化分类） ========================
+    df["status"] = classify_frame(df, get_shift_times_short())
 
-    def format_shift(shift):
-        if pd.isna(shift):
-            return shift
-        shift_text = str(shift)
-        if re.search(r'（\d{2}:\d{2}-\d{2}:\d{2}）', shift_text):
-            return shift_text
-        shift_name = shift_text.split("（")[0]
-        if shift_name in get_shift_times_short():
-            start, end = get_shift_times_short()[shift_name]
-            return f"{shift_text}（{start.strftime('%H:%M')}-{end.strftime('%H:%M')}）"
-        return shift_text
+    # ======================== 补齐休息/缺勤、未打下班卡（仅限有打卡记录的日期） ========================
+    filler_df = _missing_punch_rows(df, all_user_names, sorted(df["date"].unique()), "date")
+    filler_df = filler_df.astype({col: df[col].dtype for col in ("name", "keyword", "shift")})
+    df = pd.concat([df, filler_df], ignore_index=True)
 
-    missed_days_count = {u: 0 for u in all_user_names}
+    # 备注文本由状态位生成（无异常的行保留原备注，如 I班跨天下班卡的“（次日）”）；每种状态只生成一次文本
+    status_values = df["status"].to_numpy()
+    remark_by_status = {s: status_remark(s) for s in np.unique(status_values) if s}
+    df["remark"] = np.where(status_values != 0, df["status"].map(remark_by_status), df["remark"])
+    return _finish_team_frame(df, all_user_names)
 
-    # 过滤掉当天 sheet 的 I班凌晨下班卡（次日）
-    i_shift_mask = (
-        (df["keyword"] == "#下班打卡") &
-        (df["shift"].notna()) &
-        (df["shift"].astype(str).str.startswith("I班")) &
-        (df["timestamp"].dt.hour < 6)
-    )
-    cross_df = df[i_shift_mask].copy()
-    df = df[~i_shift_mask]
-    cross_df["remark"] = cross_df.get("remark", "") + "（次日）"
-    cross_df["date"] = (cross_df["timestamp"] - pd.Timedelta(days=1)).dt.strftime("%Y-%m-%d")
-    df = pd.concat([df, cross_df], ignore_index=True)
+def _finish_team_frame(df: pd.DataFrame, all_user_names):
+    """备注转 category、统一排序并计算异常统计（完整计算与按日结果拼接两条路径共用）"""
+    df["remark"] = df["remark"].astype("category")
 
-    with pd.ExcelWriter(excel_path, engine="openpyxl") as writer:
-        sheet_written = False
-
-        for day, group_df in sorted(df.groupby("date"), key=lambda x: x[0], reverse=True):
-            group_df = group_df.copy()
-            if "remark" not in group_df.columns:
-                group_df["remark"] = ""
-
-            # 当日已打上班 / 下班的用户
-            checked_users = set(group_df.loc[group_df["keyword"] == "#上班打卡", "name"].unique())
-            down_checked_users = set(group_df.loc[group_df["keyword"] == "#下班打卡", "name"].unique())
-
-            missed_users = []
-            day_date = datetime.strptime(day, "%Y-%m-%d").date()
-
-            for u in all_user_names:
-                if u not in checked_users:
-                    missed_users.append(u)
-                    missed_days_count[u] += 1
-                elif u not in down_checked_users:
-                    group_df = pd.concat([
-                        group_df,
-                        pd.DataFrame([{
-                            "name": u,
-                            "timestamp": pd.NaT,
-                            "keyword": "#下班打卡",
-                            "shift": None,
-                            "remark": "未打下班卡"
-                        }])
-                    ], ignore_index=True)
-
-            if missed_users:
-                missed_df = pd.DataFrame({
-                    "name": missed_users,
-                    "timestamp": pd.NaT,
-                    "keyword": None,
-                    "shift": None,
-                    "remark": "休息/缺勤"
-                })
-                group_df = pd.concat([group_df, missed_df], ignore_index=True)
-
-            # ======================== 迟到/早退/补卡 ========================
-            for idx, row in group_df.iterrows():
-                shift_val = row["shift"]
-                keyword = row["keyword"]
-                ts = row["timestamp"]
-
-                if not shift_val or pd.isna(ts):
-                    continue
-
-                shift_text = str(shift_val).strip()
-                shift_name = re.split(r'[（(]', shift_text)[0]
-
-                if "补卡" in shift_text:
-                    group_df.at[idx, "remark"] = "补卡"
-                    continue
-
-                if shift_name in get_shift_times_short():
-                    start_time, end_time = get_shift_times_short()[shift_name]
-                    ts_time = ts.time()
-                    tags = []
-
-                    if keyword == "#上班打卡" and ts_time > start_time:
-                        tags.append(_late_tag(ts_time, start_time))
-                    elif keyword == "#下班打卡":
-                        if shift_name == "I班":
-                            if not (ts.hour == 0):
-                                if 15 <= ts.hour <= 23:
-                                    tags.append("早退")
-                        else:
-                            if not (0 <= ts.hour <= 1):
-                                if ts_time < end_time:
-                                    tags.append("早退")
-
-                    if keyword in ("#上班打卡", "#下班打卡") and not _in_shift_window(ts_time, start_time, end_time):
-                        tags.append("签到异常")
-
-                    if tags:
-                        group_df.at[idx, "remark"] = "；".join(tags)
-
-            group_df = group_df.sort_values(["name", "timestamp"], na_position="last")
-            slim_df = group_df[["name", "timestamp", "keyword", "shift", "remark"]].copy()
-            slim_df.columns = ["姓名", "打卡时间", "关键词", "班次", "备注"]
-
-            slim_df["打卡时间"] = slim_df["打卡时间"].apply(lambda x: x.strftime("%H:%M:%S") if pd.notna(x) else "")
-            slim_df["班次"] = slim_df["班次"].apply(format_shift)
-
-            sheet_name = day[:31]
-            sheet = writer.book.create_sheet(sheet_name)
-            headers = ["姓名", "打卡时间", "关键词", "班次", "备注"]
-            sheet.append(headers)
-
-            for user, user_df in slim_df.groupby("姓名"):
-                for _, row in user_df.iterrows():
-                    sheet.append(list(row))
-                sheet.append([None] * len(headers))
-
-            sheet_written = True
-
-        if not sheet_written:
-            pd.DataFrame(columns=["姓名", "打卡时间", "关键词", "班次", "备注"]).to_excel(writer, sheet_name="空表", index=False)
+    # 日期倒序、同日按姓名 / 时间排序，一次排好后按位置切片写出每日明细页
+    df = df.sort_values(["date", "name", "timestamp"], ascending=[False, True, True], na_position="last", ignore_index=True)
 
-    # ======================== 样式处理 ========================
-    wb = load_workbook(excel_path)
-    red_fill = PatternFill(start_color="ffc8c8", end_color="ffc8c8", fill_type="solid")
-    yellow_fill = PatternFill(start_color="fff1c8", end_color="fff1c8", fill_type="solid")
-    blue_fill_light = PatternFill(start_color="c8eaff", end_color="c8eaff", fill_type="solid")
-    purple_fill_light = PatternFill(start_color="E6CCFF", end_color="E6CCFF", fill_type="solid")
-    orange_fill_light = PatternFill(start_color="FFDCB0", end_color="FFDCB0", fill_type="solid")
-    thin_border = Border(
-        left=Side(style="thin", color="000000"),
-        right=Side(style="thin", color="000000"),
-        top=Side(style="thin", color="000000"),
-        bottom=Side(style="thin", color="000000")
-    )
-    from itertools import cycle
-    user_fills = cycle([
-        PatternFill(start_color="f9f9f9", end_color="f9f9f9", fill_type="solid"),
-        PatternFill(start_color="ffffff", end_color="ffffff", fill_type="solid"),
-    ])
+    # ======================== 异常统计（按状态位向量化计数，一次算完，统计页 / 聊天摘要共用） ========================
+    summary_df = count_status(df["name"], df["status"], all_user_names).sort_index()
+    return df, summary_df
 
-    for sheet in wb.worksheets:
-        if sheet.title in ["统计", "异常统计"]:
-            continue
-        current_user = None
-        current_fill = next(user_fills)
-        for row in sheet.iter_rows(min_row=2):
-            if all(cell.value is None for cell in row):
-                continue
-            name_val = row[0].value
-            remark_val = str(row[4].value or "")
-            if name_val != current_user:
-                current_fill = next(user_fills)
-                current_user = name_val
-            for cell in row:
-                cell.fill = current_fill
-            if "迟到" in remark_val or "早退" in remark_val:
-                for cell in row[1:]:
-                    cell.fill = red_fill
-            elif "补卡" in remark_val:
-                for cell in row[1:]:
-                    cell.fill = yellow_fill
-            elif "休息/缺勤" in remark_val:
-                for cell in row[1:]:
-                    cell.fill = blue_fill_light
-            elif "未打下班卡" in remark_val:
-                for cell in row[1:]:
-                    cell.fill = purple_fill_light
-            if "签到异常" in remark_val and "迟到" not in remark_val and "早退" not in remark_val:
-                for cell in row[1:]:
-                    cell.fill = orange_fill_light
-
-        # 合并姓名列
-        name_col = 1
-        merge_start = None
-        prev_name = None
-        for row_idx in range(2, sheet.max_row + 1):
-            cell_val = sheet.cell(row=row_idx, column=name_col).value
-            if cell_val != prev_name:
-                if merge_start and row_idx - merge_start > 1:
-                    sheet.merge_cells(
-                        start_row=merge_start, start_column=name_col,
-                        end_row=row_idx - 1, end_column=name_col
-                    )
-                merge_start = row_idx
-                prev_name = cell_val
-        if merge_start and sheet.max_row - merge_start >= 1:
-            sheet.merge_cells(
-                start_row=merge_start, start_column=name_col,
-                end_row=sheet.max_row, end_column=name_col
-            )
-
-    # ======================== 异常统计 ========================
-    stats = {u: {"休息/缺勤": 0, "迟到<15分钟": 0, "迟到≥15分钟": 0, "早退": 0, "签到异常": 0, "补卡": 0, "未打下班卡": 0} for u in all_user_names}
-    for sheet in wb.worksheets:
-        if sheet.title in ["统计", "异常统计"]:
-            continue
-        df_sheet = pd.DataFrame(sheet.values)
-        if df_sheet.empty or len(df_sheet.columns) < 5:
-            continue
-        df_sheet.columns = ["姓名", "打卡时间", "关键词", "班次", "备注"]
-        last_name = None
-        for i in range(len(df_sheet)):
-            if pd.notna(df_sheet.at[i, "姓名"]):
-                last_name = df_sheet.at[i, "姓名"]
-            elif last_name:
-                df_sheet.at[i, "姓名"] = last_name
-        df_sheet["备注"] = df_sheet["备注"].astype(str).fillna("")
-        for name, g in df_sheet.groupby("姓名"):
-            if not name or name not in stats:
-                continue
-            remarks = g["备注"]
-            stats[name]["补卡"] += int(remarks.apply(lambda s: s.count("补卡")).sum())
-            stats[name]["迟到<15分钟"] += int(remarks.apply(lambda s: s.count("迟到（<15分钟）")).sum())
-            stats[name]["迟到≥15分钟"] += int(remarks.apply(lambda s: s.count("迟到（≥15分钟）")).sum())
-            stats[name]["早退"] += int(remarks.apply(lambda s: s.count("早退")).sum())
-            stats[name]["签到异常"] += int(remarks.apply(lambda s: s.count("签到异常")).sum())
-            stats[name]["休息/缺勤"] += int(remarks.apply(lambda s: s.count("休息/缺勤")).sum())
-            stats[name]["未打下班卡"] += int(remarks.apply(lambda s: s.count("未打下班卡")).sum())
-
-    summary_df = pd.DataFrame([
-        {
-            "姓名": u,
-            **v,
-            "异常总数": v["迟到<15分钟"] + v["迟到≥15分钟"] + v["早退"] + v["签到异常"] + v["补卡"] + v["未打下班卡"],
-        }
-        for u, v in stats.items()
-    ])
-    summary_df = summary_df[
-        ["姓名", "休息/缺勤", "迟到<15分钟", "迟到≥15分钟", "早退", "签到异常", "补卡", "未打下班卡", "异常总数"]
-    ].sort_values(by="姓名", ascending=True)
-
-    if "统计" in [s.title for s in wb.worksheets]:
-        del wb["统计"]
-    if "异常统计" in [s.title for s in wb.worksheets]:
-        del wb["异常统计"]
-
-    stats_sheet = wb.create_sheet("异常统计", 0)
-    headers = ["姓名", "休息/缺勤", "迟到<15分钟", "迟到≥15分钟", "早退", "签到异常", "补卡", "未打下班卡", "异常总数"]
-    for r_idx, row in enumerate([headers] + summary_df.values.tolist(), 1):
-        for c_idx, value in enumerate(row, 1):
-            stats_sheet.cell(row=r_idx, column=c_idx, value=value)
-    stats_sheet.freeze_panes = "A2"
-    header_font = Font(bold=True)
-    center_align = Alignment(horizontal="center")
-    highlight_fill = PatternFill(start_color="FFF8B0", end_color="FFF8B0", fill_type="solid")
-    stats_sheet.auto_filter.ref = stats_sheet.dimensions
-    for cell in stats_sheet[1]:
-        cell.font = header_font
-        cell.alignment = center_align
-    light_red_fill = PatternFill(start_color="FFD6D6", end_color="FFD6D6", fill_type="solid")
-    total_col_idx = len(headers)  # 异常总数所在列（1-based）
-    for row in stats_sheet.iter_rows(min_row=2):
+# ===========================
+# 按日增量：已结束的整天读取每晚生成的分类结果，只对区间首尾不完整的日期现场计算
+# ===========================
+def _classify_range(start_datetime: datetime, end_datetime: datetime, all_user_names):
+    """返回 (分类后的明细, 异常统计 summary_df)，结果与对整个区间完整计算一致；区间内没有打卡时返回 None"""
+    days = reusable_days(start_datetime, end_datetime)
+    stored = None
+    if days:
         try:
-            rest_days = int(row[1].value or 0)   # 休息/缺勤在第2列 (索引1)
-            if rest_days > 4:
-                row[1].fill = light_red_fill
-            abnormal_total = int(row[total_col_idx - 1].value or 0)  # 异常总数在最后一列
-            if abnormal_total > 2:
-                row[total_col_idx - 1].fill = light_red_fill
-        except ValueError:
-            pass
+            build_day_reports(days, all_user_names)
+            stored = load_day_reports(days)
+        except Exception as e:
+            logging.warning(f"⚠️ 按日报表不可用，回退完整计算: {e}")
+
+    if stored is None:
+        df = _fetch_data(start_datetime, end_datetime)
+        return None if df.empty else _classify_team_frame(df, all_user_names)
+
+    # 首尾不完整的日期只需 [start, 首日 06:00) 与 [末日次日 00:00, end] 两段打卡；
+    # 两段合并分类后，只保留不属于已存日期的行（每一天的分类只依赖归属该天的打卡）
+    head = _fetch_data(start_datetime, day_start(days[0]) + SPILL - timedelta(microseconds=1))
+    tail_start = day_start(days[-1]) + timedelta(days=1)
+    tail = _fetch_data(tail_start, end_datetime) if tail_start <= end_datetime else pd.DataFrame()
+    logging.info(f"🗓️ 复用按日报表 {days[0]:%Y-%m-%d}~{days[-1]:%Y-%m-%d}，首尾现场计算 {len(head) + len(tail)} 条打卡")
+
+    parts = [stored] if not stored.empty else []
+    raw = [f for f in (head, tail) if not f.empty]
+    if raw:
+        edge_df, _ = _classify_team_frame(pd.concat(raw, ignore_index=True), all_user_names)
+        parts.append(edge_df[~edge_df["date"].isin(pd.to_datetime(days))])
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    if df.empty:
+        return None
+
+    _compact_dtypes(df, all_user_names)
+    return _finish_team_frame(df, all_user_names)
+
+def build_day_reports(days, all_user_names=None) -> int:
+    """为已结束的日期生成缺失 / 失效的按日分类结果（一次查询覆盖全部待生成日期），返回生成的天数"""
+    all_user_names = get_all_user_names() if all_user_names is None else all_user_names
+    digest = config_digest()
+    # 版本戳在查询之前读取：查询期间提交的改动会让写入的文件立即失效，下次重新生成
+    stamps = {d: day_stamp(d, digest) for d in days}
+    pending = [d for d in days if not day_report_is_valid(d, stamps[d])]
+    if not pending:
+        return 0
+
+    df = _fetch_data(day_start(pending[0]), day_start(pending[-1]) + timedelta(days=1) + SPILL - timedelta(microseconds=1))
+    if df.empty:
+        classified = pd.DataFrame({
+            "name": pd.Series(dtype=object), "timestamp": pd.Series(dtype="datetime64[ns]"),
+            "keyword": pd.Series(dtype=object), "shift": pd.Series(dtype=object),
+            "date": pd.Series(dtype="datetime64[ns]"), "remark": pd.Series(dtype=object),
+            "status": pd.Series(dtype=np.int64),
+        })
+    else:
+        classified, _ = _classify_team_frame(df, all_user_names)
+    for d in pending:
+        write_day_report(d, classified[classified["date"] == pd.Timestamp(d)], stamps[d])
+    return len(pending)
+
+def append_closed_day():
+    """每日定时：为刚结束的一天（及本月此前缺失 / 失效的日期）生成按日分类结果，并清理过旧的目录"""
+    day = last_closed_day()
+    first = day.replace(day=1)
+    built = build_day_reports([first + timedelta(days=i) for i in range((day - first).days + 1)])
+    logging.info(f"🗓️ 按日报表已更新至 {day:%Y-%m-%d}（本次生成 {built} 天）")
+    prune_day_reports()
+
+# ===========================
+# 异常统计页（团队报表第一页，各种版式共用）
+# ===========================
+def _write_stats_sheet(wb: Workbook, styles: dict, summary_df: pd.DataFrame):
+    stats_headers = ["姓名", "休息/缺勤", "迟到<15分钟", "迟到≥15分钟", "早退", "签到异常", "补卡", "未打下班卡", "异常总数"]
     desc_text = (
         "【休息/缺勤：没有打卡记录的天数】\n"
         "【迟到<15分钟 / 迟到≥15分钟：按迟到时长分档统计】\n"
         "【签到异常：打卡时间不在班次开始前30分钟至班次结束后30分钟的窗口内】\n"
         "【异常总数：迟到<15分钟+迟到≥15分钟+早退+签到异常+补卡+未打下班卡】"
     )
-    start_row = summary_df.shape[0] + 3
-    end_row = start_row + 3
-    stats_sheet.merge_cells(start_row=start_row, start_column=1, end_row=end_row, end_column=total_col_idx)
-    cell = stats_sheet.cell(row=start_row, column=1, value=desc_text)
-    cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    cell.fill = PatternFill(fill_type="solid", fgColor="FFFF00")
-    cell.font = Font(bold=True, color="000000")
-
-    # ======================== 列宽/边框/筛选 ========================
-    for sheet in wb.worksheets:
+    summary_rows = summary_df.reset_index()[stats_headers].values.tolist()
+    total_col_idx = len(stats_headers)  # 异常总数所在列（1-based）
+
+    stats_sheet = wb.create_sheet("异常统计")
+    stats_sheet.freeze_panes = "A2"
+    lengths = [len(h) for h in stats_headers]
+    for row in summary_rows:
+        lengths = [max(l, len(str(v if v is not None else ""))) for l, v in zip(lengths, row)]
+    lengths[0] = max(lengths[0], len(desc_text))
+    set_column_widths(stats_sheet, lengths)
+
+    stats_sheet.append([styled_cell(stats_sheet, h, styles["header"]) for h in stats_headers])
+    for row in summary_rows:
+        cells = [styled_cell(stats_sheet, v, styles["plain"]) for v in row]
+        if int(row[1] or 0) > 4:     # 休息/缺勤在第2列 (索引1)
+            cells[1] = styled_cell(stats_sheet, row[1], styles["light_red"])
+        if int(row[total_col_idx - 1] or 0) > 2:     # 异常总数在最后一列
+            cells[total_col_idx - 1] = styled_cell(stats_sheet, row[total_col_idx - 1], styles["light_red"])
+        stats_sheet.append(cells)
+
+    desc_start_row = len(summary_rows) + 3
+    desc_end_row = desc_start_row + 3
+    stats_sheet.append(blank_row(stats_sheet, styles, total_col_idx))
+    for r_idx in range(desc_start_row, desc_end_row + 1):
+        cells = blank_row(stats_sheet, styles, total_col_idx)
+        if r_idx == desc_start_row:
+            cells[0] = styled_cell(stats_sheet, desc_text, styles["note"])
+        stats_sheet.append(cells)
+    stats_sheet.merged_cells.add(f"A{desc_start_row}:{get_column_letter(total_col_idx)}{desc_end_row}")
+    stats_sheet.auto_filter.ref = f"A1:{get_column_letter(total_col_idx)}{desc_end_row}"
+
+# 团队考勤表（按天分页版式）
+def _render_team_excel(df: pd.DataFrame, excel_path, all_user_names, workers: int = EXPORT_SHEET_WORKERS) -> pd.DataFrame:
+    """把原始打卡明细分类后渲染成团队考勤表（原地修改 df），返回异常统计 summary_df"""
+    df, summary_df = _classify_team_frame(df, all_user_names)
+    _write_team_excel(df, summary_df, excel_path, workers)
+    return summary_df
+
+def _write_team_excel(df: pd.DataFrame, summary_df: pd.DataFrame, excel_path, workers: int = EXPORT_SHEET_WORKERS):
+    """
+    df 为 _classify_team_frame 的结果；excel_path 为文件路径或可写的文件对象（如 BytesIO）；
+    workers 为生成每日明细页的进程数
+    """
+    def format_shift(shift):
+        if pd.isna(shift):
+            return shift
+        shift_text = str(shift)
+        if re.search(r'（\d{2}:\d{2}-\d{2}:\d{2}）', shift_text):
+            return shift_text
+        shift_name = shift_text.split("（")[0]
+        if shift_name in get_shift_times_short():
+            start, end = get_shift_times_short()[shift_name]
+            return f"{shift_text}（{start.strftime('%H:%M')}-{end.strftime('%H:%M')}）"
+        return shift_text
+
+    # ======================== 单次流式写出（write-only 模式，样式模板 + 每日明细页可多进程并行生成） ========================
+    # write-only 工作表的列宽、冻结窗格必须在第一行写出前设置，合并区域和筛选在关闭时写出
+    wb = Workbook(write_only=True)
+    styles = register_styles(wb)
+    _write_stats_sheet(wb, styles, summary_df)
+
+    # ---------- 每日明细页 ----------
+    # 每列取值 / 文本长度按类别查表一次生成，整理成一张 Arrow 表；每天只是其中一段连续行，按位置切片写出
+    name_values, name_lengths = _category_lookup(df["name"])
+    keyword_values, keyword_lengths = _category_lookup(df["keyword"])
+    shift_values, shift_lengths = _category_lookup(df["shift"], format_shift)
+    remark_values, remark_lengths = _category_lookup(df["remark"])
+    day_table = pa.table({
+        "name": pa.array(name_values, type=pa.string()),
+        "time": pa.array(df["timestamp"].dt.strftime("%H:%M:%S").fillna("").to_numpy(dtype=object), type=pa.string()),
+        "keyword": pa.array(keyword_values, type=pa.string()),
+        "shift": pa.array(shift_values, type=pa.string()),
+        "remark": pa.array(remark_values, type=pa.string()),
+        "status": pa.array(df["status"].to_numpy(dtype=np.int64)),
+        "name_len": name_lengths,
+        "time_len": np.where(df["timestamp"].isna().to_numpy(), 0, 8),
+        "keyword_len": keyword_lengths,
+        "shift_len": shift_lengths,
+        "remark_len": remark_lengths,
+    })
+
+    date_values = df["date"].to_numpy()
+    name_codes = df["name"].cat.codes.to_numpy()
+    day_starts = np.flatnonzero(np.r_[True, date_values[1:] != date_values[:-1]]) if len(df) else np.array([], dtype=int)
+    day_ends = np.r_[day_starts[1:], len(df)]
+
+    # 用户底色在各 sheet 间连续交替：每个 sheet 开头消耗 1 次，每个用户 1 次，据此预先算出每天的起始偏移
+    tasks = []
+    fill_offset = 0
+    for row_start, row_end in zip(day_starts, day_ends):
+        codes = name_codes[row_start:row_end]
+        tasks.append((pd.Timestamp(date_values[row_start]).strftime("%Y-%m-%d")[:31], int(row_start), int(row_end), fill_offset))
+        fill_offset += 1 + int(np.count_nonzero(np.r_[True, codes[1:] != codes[:-1]]))
+
+    if not tasks:
+        sheet = wb.create_sheet("空表")
         sheet.freeze_panes = "A2"
-        sheet.auto_filter.ref = sheet.dimensions
-        for cell in sheet[1]:
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-        for col in sheet.columns:
-            col_letter = col[0].column_letter
-            max_length = max((19 if isinstance(cell.value, datetime) else len(str(cell.value or "")) for cell in col))
-            for cell in col:
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                cell.border = thin_border
-            sheet.column_dimensions[col_letter].width = min(max_length + 8, 30)
+        set_column_widths(sheet, [len(h) for h in DAY_HEADERS])
+        sheet.append([styled_cell(sheet, h, styles["header"]) for h in DAY_HEADERS])
+        sheet.auto_filter.ref = f"A1:{get_column_letter(len(DAY_HEADERS))}1"
+
+    write_day_sheets(wb, styles, day_table, tasks, excel_path, workers)
+    logging.info("✅ Excel 导出完成")
+
+# 团队考勤表（用户 × 日期 矩阵版式）
+def _write_matrix_excel(df: pd.DataFrame, summary_df: pd.DataFrame, excel_path):
+    """
+    一页看完整个区间：行是用户、列是日期，每格为 上班卡~下班卡 时间 + 状态简码（如 “09:05~18:02 迟”）。
+    df 为 _classify_team_frame 的结果，整表一次 groupby + unstack 透视生成，不再逐日拆分 DataFrame。
+    """
+    all_user_names = summary_df.index
+    # ======================== 透视：(姓名, 日期) -> 最早上班卡 / 最晚下班卡 / 状态位按位或 ========================
+    status_values = df["status"].to_numpy(dtype=np.int64)
+    cells = pd.DataFrame({
+        "name": df["name"],
+        "date": df["date"],
+        "check_in": df["timestamp"].where(df["keyword"] == "#上班打卡"),
+        "check_out": df["timestamp"].where(df["keyword"] == "#下班打卡"),
+        **{f"bit_{flag}": status_values & flag for flag, _ in STATUS_TAGS},
+    })
+    aggs = {"check_in": "min", "check_out": "max", **{f"bit_{flag}": "max" for flag, _ in STATUS_TAGS}}
+    grouped = cells.groupby(["name", "date"], observed=True, sort=False).agg(aggs)
+    cell_status = grouped[[f"bit_{flag}" for flag, _ in STATUS_TAGS]].sum(axis=1).astype(np.int64)
+
+    # 单元格文本：有打卡的格子写时间段，只有休息/缺勤的格子只写简码；每种状态的简码只生成一次
+    times = (
+        grouped["check_in"].dt.strftime("%H:%M").fillna("--:--") + "~" +
+        grouped["check_out"].dt.strftime("%H:%M").fillna("--:--")
+    )
+    no_punch = grouped["check_in"].isna() & grouped["check_out"].isna()
+    codes = cell_status.map({s: status_code(s) for s in cell_status.unique()})
+    text = times.where(~no_punch, "") + np.where((codes != "") & ~no_punch, " ", "") + codes
+
+    # ======================== unstack 成 用户 × 日期 矩阵（日期正序） ========================
+    dates = sorted(grouped.index.get_level_values("date").unique())
+    names = sorted(set(all_user_names) | set(grouped.index.get_level_values("name")))
+    text_matrix = text.unstack("date").reindex(index=names, columns=dates)
+    status_matrix = cell_status.unstack("date").reindex(index=names, columns=dates).fillna(0).astype(np.int64)
+
+    # ======================== 写出（write-only，统计页 + 矩阵页） ========================
+    wb = Workbook(write_only=True)
+    styles = register_styles(wb)
+    _write_stats_sheet(wb, styles, summary_df)
+
+    weekdays = "一二三四五六日"
+    headers = ["姓名"] + [f"{pd.Timestamp(d):%m-%d} {weekdays[pd.Timestamp(d).weekday()]}" for d in dates]
+    legend = "【状态简码】" + "  ".join(f"{code}={tag}" for (_, code), (_, tag) in zip(STATUS_CODES, STATUS_TAGS))
+
+    sheet = wb.create_sheet("考勤矩阵")
+    sheet.freeze_panes = "B2"
+    text_values = text_matrix.fillna("").to_numpy(dtype=object)
+    status_grid = status_matrix.to_numpy()
+    lengths = [max([len("姓名")] + [len(str(n)) for n in names])]
+    lengths += [max([len(h)] + [len(v) for v in text_values[:, j]]) for j, h in enumerate(headers[1:])]
+    set_column_widths(sheet, lengths)
+
+    sheet.append([styled_cell(sheet, h, styles["header"]) for h in headers])
+    for i, name in enumerate(names):
+        row_style = styles[USER_FILLS[i % 2]]
+        row = [styled_cell(sheet, name, row_style)]
+        for j in range(len(dates)):
+            fill_key = status_fill(status_grid[i, j], "red", "yellow", "blue", "purple", "orange")
+            row.append(styled_cell(sheet, text_values[i, j] or None, styles[fill_key] if fill_key else row_style))
+        sheet.append(row)
+
+    legend_row = len(names) + 3
+    sheet.append(blank_row(sheet, styles, len(headers)))
+    legend_cells = blank_row(sheet, styles, len(headers))
+    legend_cells[0] = styled_cell(sheet, legend, styles["note"])
+    sheet.append(legend_cells)
+    sheet.merged_cells.add(f"A{legend_row}:{get_column_letter(len(headers))}{legend_row}")
+    sheet.auto_filter.ref = f"A1:{get_column_letter(len(headers))}{len(names) + 1}"
 
     wb.save(excel_path)
-    logging.info(f"✅ Excel 导出完成: {excel_path}")
-    return excel_path
+    logging.info("✅ Excel 导出完成（矩阵版式）")
+
+# 团队报表版式 -> 写出函数（参数：分类后的明细, 异常统计, 输出文件）
+TEAM_LAYOUTS = {
+    "daily": _write_team_excel,      # 每天一个明细页
+    "matrix": _write_matrix_excel,   # 用户 × 日期 单页矩阵
+}
+# 每行明细的预计文件大小（字节，实测 500 人 × 31 天约 43 / 5，留余量），用于判断是否直接落盘生成
+TEAM_XLSX_BYTES_PER_ROW = {"daily": 64, "matrix": 8}
 
 # 导出个人打卡记录
 def export_user_excel(user_name: str, start_datetime: datetime, end_datetime: datetime):
-    df = _fetch_data(start_datetime, end_datetime)
-    if df.empty:
-        logging.warning(f"⚠️ 指定日期内没有 {user_name} 的数据")
-        return None
-
-    # 只筛选该用户
-    df = df[df["name"] == user_name]
+    # 只查询该用户（过滤下推到 SQL）
+    df = _fetch_data(start_datetime, end_datetime, user_name=user_name)
     if df.empty:
         logging.warning(f"⚠️ {user_name} 在指定日期没有考勤记录")
         return None
@@ -473,47 +621,13 @@ def export_user_excel(user_name: str, start_datetime: datetime, end_datetime: da
             return f"{shift_text}（{start.strftime('%H:%M')}-{end.strftime('%H:%M')}）"
         return shift_text
 
-    # ======================== remark 标注逻辑 ========================
+    # ======================== 状态位 / remark 标注逻辑 ========================
     if "remark" not in df.columns:
         df["remark"] = ""
+    df["status"] = classify_frame(df, get_shift_times_short())
 
-    for idx, row in df.iterrows():
-        shift_val = row["shift"]
-        keyword = row["keyword"]
-        ts = row["timestamp"]
-
-        if not shift_val or pd.isna(ts):
-            continue
-
-        shift_text = str(shift_val).strip()
-        shift_name = re.split(r'[（(]', shift_text)[0]
-
-        if "补卡" in shift_text:
-            df.at[idx, "remark"] = "补卡"
-            continue
-
-        if shift_name in get_shift_times_short():
-            start_time, end_time = get_shift_times_short()[shift_name]
-            ts_time = ts.time()
-            tags = []
-
-            if keyword == "#上班打卡" and ts_time > start_time:
-                tags.append(_late_tag(ts_time, start_time))
-            elif keyword == "#下班打卡":
-                if shift_name == "I班":
-                    if not (ts.hour == 0):
-                        if 15 <= ts.hour <= 23:
-                            tags.append("早退")
-                else:
-                    if not (0 <= ts.hour <= 1):
-                        if ts_time < end_time:
-                            tags.append("早退")
-
-            if keyword in ("#上班打卡", "#下班打卡") and not _in_shift_window(ts_time, start_time, end_time):
-                tags.append("签到异常")
-
-            if tags:
-                df.at[idx, "remark"] = "；".join(tags)
+    flagged = df["status"] != 0
+    df.loc[flagged, "remark"] = df.loc[flagged, "status"].map(status_remark)
 
     # ======================== 处理 I 班跨日下班卡 ========================
     i_shift_mask = (
@@ -528,42 +642,15 @@ def export_user_excel(user_name: str, start_datetime: datetime, end_datetime: da
     cross_df["日期"] = (cross_df["timestamp"] - pd.Timedelta(days=1)).dt.strftime("%Y-%m-%d")
     df = pd.concat([df, cross_df], ignore_index=True)
 
-    # ======================== 补齐休息/缺勤 ========================
+    # ======================== 补齐休息/缺勤、未打下班卡 ========================
     all_dates = pd.date_range(start_datetime.date(), (end_datetime - timedelta(seconds=1)).date(), freq="D")
-    existing_dates = set(df["日期"].unique())
-    missing_dates = [d.strftime("%Y-%m-%d") for d in all_dates if d.strftime("%Y-%m-%d") not in existing_dates]
-
-    if missing_dates:
-        missed_df = pd.DataFrame({
-            "日期": missing_dates,
-            "name": user_name,
-            "timestamp": pd.NaT,
-            "keyword": None,
-            "shift": None,
-            "remark": "休息/缺勤"
-        })
-        df = pd.concat([df, missed_df], ignore_index=True)
-
-    # ======================== 补齐未打下班卡 ========================
-    unclosed_rows = []
-    for day, g in df.groupby("日期"):
-        has_up = g["keyword"].eq("#上班打卡").any()
-        has_down = g["keyword"].eq("#下班打卡").any()
-        if has_up and not has_down:
-            unclosed_rows.append({
-                "日期": day,
-                "name": user_name,
-                "timestamp": pd.NaT,
-                "keyword": "#下班打卡",
-                "shift": None,
-                "remark": "未打下班卡"
-            })
-    if unclosed_rows:
-        df = pd.concat([df, pd.DataFrame(unclosed_rows)], ignore_index=True)
+    dates = sorted(set(all_dates.strftime("%Y-%m-%d")) | set(df["日期"].unique()))
+    filler_df = _missing_punch_rows(df, [user_name], dates, "日期", rest_without_checkin=False)
+    df = pd.concat([df, filler_df], ignore_index=True)
 
     # ======================== 整理数据表 ========================
-    slim_df = df[["日期", "name", "timestamp", "keyword", "shift", "remark"]].copy()
-    slim_df.columns = ["日期", "姓名", "打卡时间", "关键词", "班次", "备注"]
+    slim_df = df[["日期", "name", "timestamp", "keyword", "shift", "remark", "status"]].copy()
+    slim_df.columns = ["日期", "姓名", "打卡时间", "关键词", "班次", "备注", "状态"]
 
     slim_df["打卡时间"] = slim_df["打卡时间"].apply(lambda x: x.strftime("%H:%M:%S") if pd.notna(x) else "")
     slim_df["班次"] = slim_df["班次"].apply(format_shift)
@@ -572,29 +659,10 @@ def export_user_excel(user_name: str, start_datetime: datetime, end_datetime: da
     slim_df["kw_order"] = slim_df["关键词"].map(keyword_order).fillna(9)
     slim_df = slim_df.sort_values(["日期", "姓名", "班次", "kw_order", "打卡时间"]).drop(columns=["kw_order"])
 
-    # ======================== 异常统计（单用户总表用） ========================
-    remarks_all = slim_df["备注"].astype(str).fillna("")
-    user_stats = {
-        "休息/缺勤": int(remarks_all.apply(lambda s: s.count("休息/缺勤")).sum()),
-        "迟到<15分钟": int(remarks_all.apply(lambda s: s.count("迟到（<15分钟）")).sum()),
-        "迟到≥15分钟": int(remarks_all.apply(lambda s: s.count("迟到（≥15分钟）")).sum()),
-        "早退": int(remarks_all.apply(lambda s: s.count("早退")).sum()),
-        "签到异常": int(remarks_all.apply(lambda s: s.count("签到异常")).sum()),
-        "补卡": int(remarks_all.apply(lambda s: s.count("补卡")).sum()),
-        "未打下班卡": int(remarks_all.apply(lambda s: s.count("未打下班卡")).sum()),
-    }
-    user_stats["异常总数"] = (
-        user_stats["迟到<15分钟"] + user_stats["迟到≥15分钟"] + user_stats["早退"]
-        + user_stats["签到异常"] + user_stats["补卡"] + user_stats["未打下班卡"]
-    )
+    # ======================== 异常统计（单用户总表用，按状态位向量化计数） ========================
+    user_stats = count_status(slim_df["姓名"], slim_df["状态"], [user_name]).loc[user_name].to_dict()
 
     # ======================== 导出 Excel ========================
-    start_str = start_datetime.strftime("%Y-%m-%d")
-    end_str = (end_datetime - pd.Timedelta(seconds=1)).strftime("%Y-%m-%d")
-    export_dir = os.path.join(DATA_DIR, f"user_excel_{start_str}_{end_str}")
-    os.makedirs(export_dir, exist_ok=True)
-    file_path = os.path.join(export_dir, f"{user_name}_考勤详情.xlsx")
-
     wb = Workbook()
     ws = wb.active
     ws.title = f"{user_name}考勤详情"
@@ -658,12 +726,14 @@ def export_user_excel(user_name: str, start_datetime: datetime, end_datetime: da
         cell.alignment = center_align
 
     current_row = detail_header_row + 1
+    row_status = {}  # 工作表行号 -> 状态位（用于着色）
     dates_in_order = slim_df["日期"].drop_duplicates().tolist()
     for i, date_val in enumerate(dates_in_order):
         day_rows = slim_df[slim_df["日期"] == date_val]
         for _, row in day_rows.iterrows():
-            for c_idx, value in enumerate(row, 1):
+            for c_idx, value in enumerate(row[detail_headers], 1):
                 ws.cell(row=current_row, column=c_idx + detail_col_offset, value=value)
+            row_status[current_row] = int(row["状态"])
             current_row += 1
         if i != len(dates_in_order) - 1:
             current_row += 1  # 不同日期之间空一行
@@ -681,7 +751,7 @@ def export_user_excel(user_name: str, start_datetime: datetime, end_datetime: da
         if all(cell.value is None for cell in row):
             continue
         date_val = row[0].value
-        remark_val = str(row[5].value or "")
+        status = row_status.get(row[0].row, 0)
 
         if date_val != prev_date:
             current_fill = next(user_fills)
@@ -692,22 +762,10 @@ def export_user_excel(user_name: str, start_datetime: datetime, end_datetime: da
             cell.alignment = center_align
             cell.border = thin_border
 
-        if "迟到" in remark_val or "早退" in remark_val:
-            for cell in row[2:]:
-                cell.fill = red_fill
-        elif "补卡" in remark_val:
-            for cell in row[2:]:
-                cell.fill = yellow_fill
-        elif "休息/缺勤" in remark_val:
-            for cell in row[2:]:
-                cell.fill = blue_fill_light
-        elif "未打下班卡" in remark_val:
-            for cell in row[2:]:
-                cell.fill = purple_fill
-
-        if "签到异常" in remark_val and "迟到" not in remark_val and "早退" not in remark_val:
+        row_fill = status_fill(status, red_fill, yellow_fill, blue_fill_light, purple_fill, orange_fill)
+        if row_fill is not None:
             for cell in row[2:]:
-                cell.fill = orange_fill
+                cell.fill = row_fill
 
     # ======================== 列宽（首列/末列10，其余20） ========================
     total_columns = max(len(detail_headers) + detail_col_offset, len(summary_headers))
@@ -721,6 +779,99 @@ def export_user_excel(user_name: str, start_datetime: datetime, end_datetime: da
     ws.auto_filter.ref = f"{detail_first_col_letter}{detail_header_row}:{detail_last_col_letter}{detail_last_row}"
     ws.freeze_panes = "A3"
 
-    wb.save(file_path)
-    logging.info(f"✅ 已导出用户 {user_name} 的考勤详情：{file_path}")
-    return file_path
+    buf = io.BytesIO()
+    wb.save(buf)
+    logging.info(f"✅ 已导出用户 {user_name} 的考勤详情（{buf.tell() / 1024:.0f} KB）")
+    return spool_document(f"{user_name}_考勤详情.xlsx", buf)
+
+# ===========================
+# 内存回归检查：python export.py [用户数] [天数]
+# 用合成数据渲染整月团队考勤表，进程峰值 RSS 超出 EXPORT_MEMORY_BUDGET_MB 时以非 0 状态退出
+# ===========================
+def _synthetic_punches(users: int, days: int, start: datetime = datetime(2025, 8, 1), seed: int = 0) -> pd.DataFrame:
+    """生成与 _fetch_data 结果同构的合成打卡数据（F班 / I班各半，约 10% 缺勤、5% 未打下班卡）"""
+    rng = np.random.default_rng(seed)
+    n = users * days
+    user_idx = np.repeat(np.arange(users), days)
+    punch_day = pd.Timestamp(start) + pd.to_timedelta(np.tile(np.arange(days), users), unit="D")
+    present = rng.random(n) < 0.9
+    is_i = rng.random(n) < 0.5
+    shift_start = np.where(is_i, 15 * 60, 12 * 60)
+
+    up_ts = punch_day + pd.to_timedelta(shift_start + rng.integers(-25, 30, n), unit="min")
+    down_ts = punch_day + pd.to_timedelta(shift_start + 9 * 60 + rng.integers(-30, 45, n), unit="min")
+    has_down = present & (rng.random(n) < 0.95)
+
+    names = np.array([f"用户{i:03d}" for i in range(users)], dtype=object)
+    up_labels = np.where(is_i, "I班（15:00-00:00）", "F班（12:00-21:00）")
+    down_labels = np.where(is_i, "I班", "F班")
+    df = pd.DataFrame({
+        "name": np.concatenate([names[user_idx[present]], names[user_idx[has_down]]]),
+        "timestamp": np.concatenate([up_ts[present], down_ts[has_down]]),
+        "keyword": ["#上班打卡"] * int(present.sum()) + ["#下班打卡"] * int(has_down.sum()),
+        "shift": np.concatenate([up_labels[present], down_labels[has_down]]),
+    })
+    df["timestamp"] = df["timestamp"].dt.tz_localize(BEIJING_TZ)
+    return df.astype({"name": "category", "keyword": "category", "shift": "category"})
+
+def memory_check(users: int = 500, days: int = 31, budget_mb: int = EXPORT_MEMORY_BUDGET_MB) -> bool:
+    import tempfile
+
+    baseline_mb = _peak_rss_mb()
+    df = _synthetic_punches(users, days)
+    names = df["name"].cat.categories.tolist()
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = datetime.now()
+        _render_team_excel(df, os.path.join(tmp, "memory_check.xlsx"), names)
+        elapsed = (datetime.now() - t0).total_seconds()
+    peak_mb = _peak_rss_mb()
+
+    ok = peak_mb <= budget_mb
+    print(
+        f"{'✅' if ok else '❌'} {users} 人 × {days} 天（{len(df)} 条打卡）：耗时 {elapsed:.1f}s，"
+        f"导出前 RSS {baseline_mb:.0f} MB，峰值 RSS {peak_mb:.0f} MB，预算 {budget_mb} MB"
+    )
+    return ok
+
+# ===========================
+# 每日明细页并行基准：python export.py workers [用户数] [天数]
+# 同一份合成数据分别用 1/2/4/8 个进程生成团队考勤表，输出耗时与相对单进程的加速比
+# ===========================
+def sheet_workers_benchmark(users: int = 300, days: int = 31, worker_counts=(1, 2, 4, 8)):
+    import tempfile
+    from openpyxl import load_workbook
+
+    def sheet_contents(path):
+        wb = load_workbook(path)
+        try:
+            return [
+                (ws.title, ws.auto_filter.ref, [tuple((c.value, c.style) for c in row) for row in ws.iter_rows()])
+                for ws in wb.worksheets
+            ]
+        finally:
+            wb.close()
+
+    base_df = _synthetic_punches(users, days)
+    names = base_df["name"].cat.categories.tolist()
+    print(f"{users} 人 × {days} 天（{len(base_df)} 条打卡），CPU 核数 {os.cpu_count()}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in worker_counts:
+            t0 = datetime.now()
+            _render_team_excel(base_df.copy(), os.path.join(tmp, f"workers_{workers}.xlsx"), names, workers=workers)
+            elapsed = (datetime.now() - t0).total_seconds()
+            baseline = baseline or elapsed
+            print(f"  {workers} 进程：{elapsed:.2f}s，加速比 {baseline / elapsed:.2f}x")
+        # 并行拼装出的工作簿须与单进程逐页写出的内容、样式完全一致
+        expected = sheet_contents(os.path.join(tmp, f"workers_{worker_counts[0]}.xlsx"))
+        for workers in worker_counts[1:]:
+            same = sheet_contents(os.path.join(tmp, f"workers_{workers}.xlsx")) == expected
+            print(f"  {workers} 进程输出与 {worker_counts[0]} 进程{'一致' if same else '不一致 ❌'}")
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["workers"]:
+        sheet_workers_benchmark(*[int(a) for a in sys.argv[2:4]])
+        sys.exit(0)
+    args = [int(a) for a in sys.argv[1:3]]
+    sys.exit(0 if memory_check(*args) else 1)
@@ -0,0 +1,96 @@
+import io
+import os
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+
+from config import DATA_DIR, EXPORT_SPILL_MB
+
+# ===========================
+# 导出文件的内存交付（超过阈值才落盘）
+# ===========================
+# 导出结果统一表示为 (文件名, 内容)：
+# - 内容为 bytes：文件只存在于内存中，直接交给 reply_document / send_document，全程不写 DATA_DIR；
+# - 内容为 str：文件超过 EXPORT_SPILL_MB，已落盘到 SPILL_DIR 下的临时文件（发送完毕后由 discard_document 删除）。
+# 预计较大的文件由 spool_target 直接分配落盘路径、生成时直接写盘，不在内存中完整保留一份。
+SPILL_DIR = os.path.join(DATA_DIR, "spill")
+
+logger = logging.getLogger(__name__)
+
+
+def _spill_limit() -> int:
+    return EXPORT_SPILL_MB * 1024 * 1024
+
+
+def _spill_path(filename: str) -> str:
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=SPILL_DIR, suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    return path
+
+
+def spool_target(filename: str, estimated_bytes: int) -> io.BytesIO | str:
+    """按预计大小选择生成目标：不超过阈值时返回 BytesIO，否则返回 SPILL_DIR 下的临时文件路径（直接写盘）"""
+    if estimated_bytes <= _spill_limit():
+        return io.BytesIO()
+    return _spill_path(filename)
+
+
+def spool_document(filename: str, content) -> tuple[str, bytes | str]:
+    """
+    content 为 bytes、已写完的 BytesIO，或 spool_target 分配的落盘路径（已写完）。
+    内存中的内容不超过阈值时留在内存，否则写入临时文件。
+    """
+    if isinstance(content, str):
+        logger.info(f"💾 导出文件 {filename}（{os.path.getsize(content) / 1024 / 1024:.1f} MB）已直接落盘: {content}")
+        return filename, content
+
+    data = content.getbuffer() if isinstance(content, io.BytesIO) else content
+    if len(data) <= _spill_limit():
+        return filename, bytes(data)
+
+    path = _spill_path(filename)
+    with open(path, "wb") as f:
+        f.write(data)
+    logger.info(f"💾 导出文件 {filename}（{len(data) / 1024 / 1024:.1f} MB）超过 {EXPORT_SPILL_MB} MB，已落盘: {path}")
+    return filename, path
+
+
+def spool_file(filename: str, path: str) -> tuple[str, bytes | str]:
+    """交付一个已有文件（如报表缓存）：小文件读入内存，大文件复制到 SPILL_DIR（原文件随时可能被淘汰）"""
+    if os.path.getsize(path) <= _spill_limit():
+        with open(path, "rb") as f:
+            return filename, f.read()
+    spill_path = _spill_path(filename)
+    shutil.copyfile(path, spill_path)
+    return filename, spill_path
+
+
+@contextmanager
+def open_document(doc: tuple[str, bytes | str]):
+    """
+    取出可直接交给 reply_document / send_document 的内容：内存中的 bytes 原样返回，
+    落盘文件返回打开的文件句柄（退出 with 时关闭）；每次发送各自打开一次。
+    """
+    _, content = doc
+    if isinstance(content, bytes):
+        yield content
+        return
+    with open(content, "rb") as f:
+        yield f
+
+
+def discard_document(doc: tuple[str, bytes | str]):
+    """释放导出结果；落盘的临时文件在这里删除"""
+    _, content = doc
+    if isinstance(content, str) and os.path.exists(content):
+        os.remove(content)
+
+
+def purge_spill_dir():
+    """启动时清理上次进程异常退出遗留的落盘文件"""
+    if not os.path.isdir(SPILL_DIR):
+        return
+    for fname in os.listdir(SPILL_DIR):
+        os.remove(os.path.join(SPILL_DIR, fname))
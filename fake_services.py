@@ -0,0 +1,647 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from email import message_from_bytes
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+import numpy as np
+
+# ===========================
+# 本地替身服务：Cloudinary（上传 / Admin API）与 Telegram Bot API
+# ===========================
+# 用于离线基准与回归：上传、删除、导出发送、消息收发都不再依赖真实的 Cloudinary / Telegram。
+# 两个服务都可配置：
+#   latency_ms / jitter_ms   每个请求的固定延迟与随机抖动（模拟网络往返）
+#   error_rate               随机返回 500 的比例
+#   rate_per_sec             令牌桶限流（0 表示不限）；超出时 Cloudinary 返回 420，Telegram 返回 429 + retry_after
+# 服务端状态放在 server.fake（dict），包括每个接口的调用次数、调用记录与已上传的资源，供基准脚本读取与断言。
+#
+# 接入 bot.py（TELEGRAM_API_URL / TELEGRAM_FILE_URL / CLOUDINARY_API_URL 见 config.py）：
+#   python fake_services.py serve   启动两个替身服务并打印需要导出的环境变量，供另一个终端里的 bot.py 使用
+#   python fake_services.py bot     在同一进程内启动替身服务并运行 bot.main()（仍需 DATABASE_URL 指向本地 Postgres）
+#   python fake_services.py bench   不依赖数据库的自检与基准：上传、删除、消息发送、文件下载的吞吐与尾延迟
+#   python fake_services.py cleaner 清理任务并发删除引擎（cleaner.delete_images_concurrently）对比顺序流程的吞吐
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+FAKE_CLOUD_NAME = "fake-cloud"
+FAKE_BOT_ID = 123456
+PREFIX_PAGE = 1000          # 与 Cloudinary 一致：按前缀删除每次最多 1000 张，剩余时返回 partial
+# getUpdates 等轮询 / 启动接口不注入故障（真实服务也不对其限流），否则 bot 无法启动
+TELEGRAM_EXEMPT_METHODS = {"getMe", "getUpdates", "deleteWebhook", "close", "logOut"}
+# python-telegram-bot 对字符串参数原样发送，其余参数为 JSON 编码；这些字段始终按字符串处理
+TELEGRAM_TEXT_PARAMS = {"text", "caption", "callback_query_id", "file_id", "parse_mode", "inline_message_id"}
+
+
+# ===========================
+# 公共部分：故障注入、表单解析、服务启动
+# ===========================
+def _new_state(latency_ms: int, jitter_ms: int, error_rate: float, rate_per_sec: float, seed: int) -> dict:
+    return {
+        "latency_ms": latency_ms,
+        "jitter_ms": jitter_ms,
+        "error_rate": error_rate,
+        "rate_per_sec": rate_per_sec,
+        "lock": threading.Lock(),
+        "cond": threading.Condition(),
+        "rng": random.Random(seed),
+        "bucket": {"tokens": rate_per_sec, "at": time.perf_counter()},
+        "counts": {},           # 接口 -> {"ok": n, "error": n, "rate_limited": n}
+        "calls": [],            # 按时间顺序的调用记录
+    }
+
+
+def _inject_fault(state: dict) -> str | None:
+    """按配置先延迟，再决定本次请求是否限流 / 出错；返回 "rate_limited"、"error" 或 None"""
+    with state["lock"]:
+        jitter = state["rng"].uniform(0, state["jitter_ms"]) if state["jitter_ms"] else 0
+        failed = state["error_rate"] and state["rng"].random() < state["error_rate"]
+    time.sleep((state["latency_ms"] + jitter) / 1000)
+
+    rate = state["rate_per_sec"]
+    if rate:
+        with state["lock"]:
+            bucket = state["bucket"]
+            now = time.perf_counter()
+            bucket["tokens"] = min(rate, bucket["tokens"] + (now - bucket["at"]) * rate)
+            bucket["at"] = now
+            if bucket["tokens"] < 1:
+                return "rate_limited"
+            bucket["tokens"] -= 1
+    return "error" if failed else None
+
+
+def _record(state: dict, endpoint: str, outcome: str, **fields):
+    with state["lock"]:
+        counts = state["counts"].setdefault(endpoint, {"ok": 0, "error": 0, "rate_limited": 0})
+        counts[outcome] += 1
+        state["calls"].append({"endpoint": endpoint, "outcome": outcome, "at": time.perf_counter(), **fields})
+    with state["cond"]:
+        state["cond"].notify_all()
+
+
+def _parse_form(content_type: str, body: bytes) -> tuple[dict, dict]:
+    """解析 urlencoded / multipart / JSON 请求体，返回 (文本字段, 文件字段 -> 字节)"""
+    if not body:
+        return {}, {}
+    if content_type.startswith("application/json"):
+        return json.loads(body), {}
+    if content_type.startswith("multipart/form-data"):
+        message = message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body, policy=HTTP)
+        fields, files = {}, {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True) or b""
+            if part.get_filename():
+                files[name] = payload
+            else:
+                fields[name] = payload.decode("utf-8")
+        return fields, files
+    return dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True)), {}
+
+
+def _send_json(handler: BaseHTTPRequestHandler, status: int, payload: dict, headers: dict | None = None):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    handler.send_response(status)
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(data)))
+    for key, value in (headers or {}).items():
+        handler.send_header(key, str(value))
+    handler.end_headers()
+    handler.wfile.write(data)
+
+
+def _serve(handler_class, state: dict, port: int = 0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler_class)
+    server.daemon_threads = True
+    server.fake = state
+    state["base_url"] = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def latency_stats(samples) -> dict:
+    """耗时样本（秒）-> {"count", "p50", "p95", "p99", "max"}（毫秒）"""
+    if not len(samples):
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    ms = np.asarray(samples, dtype=float) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"count": len(ms), "p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1), "max": round(ms.max(), 1)}
+
+
+# ===========================
+# Cloudinary 替身
+# ===========================
+# POST   /v1_1/<cloud>/image/upload             上传（multipart，返回 secure_url / public_id 等）
+# DELETE /v1_1/<cloud>/resources/image/upload   按 public_ids 或 prefix 删除（返回结构与 Admin API 一致）
+# GET    /<cloud>/image/upload/[v版本/]<public_id>.<扩展名>   图片下载（内容为与资源大小相同的随机字节，不存在返回 404）
+# secure_url 与真实格式相同（https://res.cloudinary.com/...），入库后清理任务的前缀筛选照常生效；
+# 下载类基准用 delivery_url 得到指向替身的同路径 URL。
+# 只有已上传（或经 seed_resources 预置）的 public_id 会被删除 / 下载，其余返回 not_found / 404；
+# item_failure_rate 为单个 public_id 首次删除时进入 failed、首次下载时返回 500 的比例（重试成功，模拟部分失败）。
+def start_fake_cloudinary(latency_ms: int = 80, jitter_ms: int = 40, error_rate: float = 0.0, rate_per_sec: float = 0,
+                          cloud_name: str = FAKE_CLOUD_NAME, port: int = 0, seed: int = 0, item_failure_rate: float = 0.0):
+    state = _new_state(latency_ms, jitter_ms, error_rate, rate_per_sec, seed)
+    state["cloud_name"] = cloud_name
+    state["resources"] = {}     # public_id -> 字节数
+    state["failed_once"] = set()   # (接口, public_id)：已经失败过一次的资源
+    state["blobs"] = {}             # 字节数 -> 下载内容
+    upload_path = f"/v1_1/{cloud_name}/image/upload"
+    resources_path = f"/v1_1/{cloud_name}/resources/image/upload"
+    delivery_re = re.compile(rf"^/{re.escape(cloud_name)}/image/upload/(?:v\d+/)?(.+)\.[A-Za-z0-9]+$")
+
+    def fail_once(endpoint: str, pid: str) -> bool:
+        """调用方持有 state["lock"]"""
+        if not item_failure_rate or (endpoint, pid) in state["failed_once"]:
+            return False
+        if state["rng"].random() >= item_failure_rate:
+            return False
+        state["failed_once"].add((endpoint, pid))
+        return True
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _read_form(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            return _parse_form(self.headers.get("Content-Type", ""), body)
+
+        def _fault(self, endpoint: str) -> bool:
+            outcome = _inject_fault(state)
+            if outcome == "rate_limited":
+                _record(state, endpoint, outcome)
+                _send_json(self, 420, {"error": {"message": "Rate Limit Exceeded"}},
+                           {"X-FeatureRateLimit-Remaining": 0, "X-FeatureRateLimit-Limit": int(rate_per_sec)})
+                return True
+            if outcome == "error":
+                _record(state, endpoint, outcome)
+                _send_json(self, 500, {"error": {"message": "General Error (fake)"}})
+                return True
+            return False
+
+        def do_POST(self):
+            path = unquote(urlsplit(self.path).path)
+            fields, files = self._read_form()
+            if path != upload_path:
+                _send_json(self, 404, {"error": {"message": f"Unknown endpoint {path}"}})
+                return
+            if self._fault("upload"):
+                return
+
+            public_id = fields.get("public_id") or os.urandom(10).hex()
+            if fields.get("folder"):
+                public_id = f"{fields['folder']}/{public_id}"
+            size = len(files.get("file", b""))
+            version = int(time.time())
+            with state["lock"]:
+                state["resources"][public_id] = size
+            _record(state, "upload", "ok", public_id=public_id, bytes=size)
+            secure_url = f"https://res.cloudinary.com/{cloud_name}/image/upload/v{version}/{public_id}.jpg"
+            _send_json(self, 200, {
+                "public_id": public_id, "version": version, "resource_type": "image", "type": "upload",
+                "format": "jpg", "bytes": size, "width": 1080, "height": 1920,
+                "tags": [t for t in fields.get("tags", "").split(",") if t],
+                "url": secure_url.replace("https://", "http://", 1), "secure_url": secure_url,
+            })
+
+        def do_DELETE(self):
+            path = unquote(urlsplit(self.path).path)
+            fields, _ = self._read_form()
+            if path != resources_path:
+                _send_json(self, 404, {"error": {"message": f"Unknown endpoint {path}"}})
+                return
+            endpoint = "delete_prefix" if fields.get("prefix") else "delete_resources"
+            if self._fault(endpoint):
+                return
+
+            deleted = {}
+            partial = False
+            with state["lock"]:
+                if fields.get("prefix"):
+                    matched = [pid for pid in state["resources"] if pid.startswith(fields["prefix"])]
+                    partial = len(matched) > PREFIX_PAGE
+                    ids = matched[:PREFIX_PAGE]
+                else:
+                    ids = fields.get("public_ids") or []
+                failed = {}
+                for pid in ids:
+                    if pid in state["resources"] and fail_once("delete", pid):
+                        failed[pid] = "temporarily unavailable"
+                        continue
+                    deleted[pid] = "deleted" if state["resources"].pop(pid, None) is not None else "not_found"
+            _record(state, endpoint, "ok", count=len(deleted))
+            remaining = max(int(state["bucket"]["tokens"]), 0) if rate_per_sec else 5000
+            _send_json(self, 200, {"deleted": deleted, "failed": failed, "deleted_counts": {}, "partial": partial},
+                       {"X-FeatureRateLimit-Remaining": remaining, "X-FeatureRateLimit-Limit": int(rate_per_sec or 5000)})
+
+        def do_GET(self):
+            match = delivery_re.match(unquote(urlsplit(self.path).path))
+            if not match:
+                _send_json(self, 404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+                return
+            if self._fault("deliver"):
+                return
+            pid = match.group(1)
+            with state["lock"]:
+                size = state["resources"].get(pid)
+                flaky = size is not None and fail_once("deliver", pid)
+                if size is not None and size not in state["blobs"]:
+                    state["blobs"][size] = os.urandom(size)
+                body = state["blobs"].get(size)
+            if size is None or flaky:
+                _record(state, "deliver", "error", public_id=pid)
+                _send_json(self, 500 if flaky else 404, {"error": {"message": "Resource not found" if size is None else "Internal error"}})
+                return
+            _record(state, "deliver", "ok", public_id=pid, bytes=size)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return _serve(Handler, state, port)
+
+
+def seed_resources(server, public_ids, size: int = 200 * 1024):
+    """不经上传直接登记已存在的资源（删除类基准用）"""
+    with server.fake["lock"]:
+        server.fake["resources"].update((pid, size) for pid in public_ids)
+
+
+def delivery_url(server, public_id: str, ext: str = "jpg") -> str:
+    """资源在替身上的下载地址（路径与真实 secure_url 相同）"""
+    return f"{server.fake['base_url']}/{server.fake['cloud_name']}/image/upload/v1/{public_id}.{ext}"
+
+
+# ===========================
+# Telegram Bot API 替身
+# ===========================
+# POST /bot<token>/<method>          getUpdates 长轮询返回 push_update 注入的更新；发送 / 编辑类接口返回 Message
+# GET  /file/bot<token>/<file_path>  getFile 之后的文件下载（内容为 photo_kb 大小的随机字节）
+# 每次调用记录 method / chat_id / text / reply_markup，基准脚本用 wait_for_call 等待 bot 的回复。
+def start_fake_telegram(latency_ms: int = 40, jitter_ms: int = 20, error_rate: float = 0.0, rate_per_sec: float = 0,
+                        token: str = FAKE_TOKEN, photo_kb: int = 200, port: int = 0, seed: int = 0):
+    state = _new_state(latency_ms, jitter_ms, error_rate, rate_per_sec, seed)
+    state.update({
+        "token": token,
+        "updates": [],
+        "next_update_id": 1,
+        "next_message_id": {},      # chat_id -> 下一个 message_id
+        "photo": os.urandom(photo_kb * 1024),
+    })
+    api_prefix = f"/bot{token}/"
+    file_prefix = f"/file/bot{token}/"
+
+    def new_message(chat_id, params: dict) -> dict:
+        with state["lock"]:
+            message_id = state["next_message_id"].get(chat_id, 1000)
+            state["next_message_id"][chat_id] = message_id + 1
+        message = {
+            "message_id": message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"},
+        }
+        for key in ("text", "caption", "reply_markup"):
+            if params.get(key):
+                message[key] = params[key]
+        return message
+
+    def handle(method: str, params: dict, files: dict):
+        if method == "getMe":
+            return {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            deadline = time.monotonic() + float(params.get("timeout") or 0)
+            with state["cond"]:
+                while True:
+                    with state["lock"]:
+                        state["updates"] = [u for u in state["updates"] if u["update_id"] >= offset]
+                        batch = state["updates"][:int(params.get("limit") or 100)]
+                    remaining = deadline - time.monotonic()
+                    if batch or remaining <= 0:
+                        return batch
+                    state["cond"].wait(min(remaining, 0.5))
+        if method == "getFile":
+            return {"file_id": params["file_id"], "file_unique_id": params["file_id"][:16],
+                    "file_size": len(state["photo"]), "file_path": f"photos/{params['file_id']}.jpg"}
+        if method in ("sendMessage", "sendPhoto", "sendDocument"):
+            return new_message(params["chat_id"], params)
+        if method in ("editMessageText", "editMessageReplyMarkup", "editMessageCaption"):
+            if params.get("inline_message_id"):
+                return True
+            message = new_message(params["chat_id"], params)
+            message["message_id"] = int(params["message_id"])
+            message["edit_date"] = int(time.time())
+            return message
+        if method in ("answerCallbackQuery", "sendChatAction", "deleteMessage", "deleteWebhook",
+                      "setMyCommands", "close", "logOut"):
+            return True
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            path = unquote(urlsplit(self.path).path)
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not path.startswith(api_prefix):
+                _send_json(self, 404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                return
+            method = path[len(api_prefix):]
+            fields, files = _parse_form(self.headers.get("Content-Type", ""), body)
+            params = {}
+            for key, value in fields.items():
+                if key in TELEGRAM_TEXT_PARAMS:
+                    params[key] = value
+                    continue
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+
+            outcome = None if method in TELEGRAM_EXEMPT_METHODS else _inject_fault(state)
+            if outcome == "rate_limited":
+                _record(state, method, outcome, chat_id=params.get("chat_id"))
+                _send_json(self, 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                       "parameters": {"retry_after": 1}})
+                return
+            if outcome == "error":
+                _record(state, method, outcome, chat_id=params.get("chat_id"))
+                _send_json(self, 500, {"ok": False, "error_code": 500, "description": "Internal Server Error (fake)"})
+                return
+
+            result = handle(method, params, files)
+            if result is None:
+                _send_json(self, 404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"})
+                return
+            if method != "getUpdates":
+                _record(state, method, "ok", chat_id=params.get("chat_id"), text=params.get("text"),
+                        reply_markup=params.get("reply_markup"), message_id=params.get("message_id"),
+                        callback_query_id=params.get("callback_query_id"),
+                        result=result, bytes=sum(len(v) for v in files.values()))
+            _send_json(self, 200, {"ok": True, "result": result})
+
+        def do_GET(self):
+            path = unquote(urlsplit(self.path).path)
+            if not path.startswith(file_prefix):
+                _send_json(self, 404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                return
+            time.sleep(state["latency_ms"] / 1000)
+            _record(state, "downloadFile", "ok", bytes=len(state["photo"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(state["photo"])))
+            self.end_headers()
+            self.wfile.write(state["photo"])
+
+        def log_message(self, *args):
+            pass
+
+    return _serve(Handler, state, port)
+
+
+# ===========================
+# Telegram 替身：注入更新与等待回复
+# ===========================
+def push_update(server, update: dict) -> int:
+    """注入一条更新（不含 update_id），bot 下一次 getUpdates 即可取到；返回分配的 update_id"""
+    state = server.fake
+    with state["lock"]:
+        update_id = state["next_update_id"]
+        state["next_update_id"] += 1
+        state["updates"].append({"update_id": update_id, **update})
+    with state["cond"]:
+        state["cond"].notify_all()
+    return update_id
+
+
+def fake_user(user_id: int, username: str) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": username, "username": username, "language_code": "zh-hans"}
+
+
+def photo_update(user_id: int, username: str, caption: str, file_kb: int = 200) -> dict:
+    """私聊发送带说明文字的截图（chat_id 与 user_id 相同）"""
+    file_id = f"photo-{user_id}-{os.urandom(4).hex()}"
+    return {"message": {
+        "message_id": int(time.time() * 1000) % 10 ** 9, "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"}, "from": fake_user(user_id, username),
+        "caption": caption,
+        "photo": [{"file_id": file_id, "file_unique_id": file_id[-16:], "width": 1080, "height": 1920,
+                   "file_size": file_kb * 1024}],
+    }}
+
+
+def callback_update(user_id: int, username: str, message: dict, data: str) -> dict:
+    """点击 bot 消息上的内联按钮；message 为 bot 发出 / 编辑后的 Message（wait_for_call 结果里的 result）"""
+    return {"callback_query": {
+        "id": os.urandom(8).hex(), "from": fake_user(user_id, username),
+        "chat_instance": str(user_id), "data": data, "message": message,
+    }}
+
+
+def wait_for_call(server, predicate, start: int = 0, timeout: float = 30.0):
+    """等待第一条满足 predicate 的调用记录（从下标 start 开始查找）；返回 (下标, 记录)，超时返回 (None, None)"""
+    state = server.fake
+    deadline = time.monotonic() + timeout
+    with state["cond"]:
+        while True:
+            with state["lock"]:
+                calls = state["calls"]
+                for i in range(start, len(calls)):
+                    if predicate(calls[i]):
+                        return i, calls[i]
+                start = len(calls)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, None
+            state["cond"].wait(min(remaining, 0.5))
+
+
+def fake_env(cloudinary_server, telegram_server) -> dict:
+    """把 bot.py（经 config.py）指向替身服务所需的环境变量"""
+    return {
+        "TOKEN": telegram_server.fake["token"],
+        "TELEGRAM_API_URL": f"{telegram_server.fake['base_url']}/bot",
+        "TELEGRAM_FILE_URL": f"{telegram_server.fake['base_url']}/file/bot",
+        "IMAGE_STORAGE": "cloudinary",
+        "CLOUDINARY_API_URL": cloudinary_server.fake["base_url"],
+        "cloudinary_cloud_name": cloudinary_server.fake["cloud_name"],
+        "cloudinary_api_key": "fake-key",
+        "cloudinary_api_secret": "fake-secret",
+    }
+
+
+# ===========================
+# 自检 / 基准：python fake_services.py bench [请求数] [并发]
+# 通过真实客户端（cloudinary SDK、python-telegram-bot）访问替身服务，
+# 分别在无故障与 故障 + 限流 两种配置下统计吞吐与 p50 / p95 / p99
+# ===========================
+def benchmark(count: int = 300, workers: int = 8) -> bool:
+    import asyncio
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    import cloudinary
+    import cloudinary.uploader
+    from telegram import Bot
+    from telegram.error import NetworkError, RetryAfter
+    from telegram.request import HTTPXRequest
+
+    ok = True
+    for label, faults in (("无故障", {}), ("5% 错误 + 限流", {"error_rate": 0.05, "rate_per_sec": 100})):
+        cld = start_fake_cloudinary(**faults)
+        tg = start_fake_telegram(**faults)
+        cloudinary.config(cloud_name=cld.fake["cloud_name"], api_key="k", api_secret="s", upload_prefix=cld.fake["base_url"])
+
+        # Cloudinary：并发上传
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as f:
+            f.write(os.urandom(200 * 1024))
+            f.flush()
+
+            def upload_one(i):
+                t0 = time.perf_counter()
+                try:
+                    cloudinary.uploader.upload(f.name, public_id=f"punches/2025-08/bench_{i}")
+                    return time.perf_counter() - t0, None
+                except Exception as e:
+                    return time.perf_counter() - t0, type(e).__name__
+
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(workers) as pool:
+                results = list(pool.map(upload_one, range(count)))
+            elapsed = time.perf_counter() - t0
+        errors = sum(1 for _, err in results if err)
+        stats = latency_stats([t for t, err in results if not err])
+        print(f"[{label}] Cloudinary 上传：{count / elapsed:.0f} 次/秒，p50 {stats['p50']}ms p95 {stats['p95']}ms "
+              f"p99 {stats['p99']}ms，失败 {errors}")
+        ok &= len(cld.fake["resources"]) == count - errors
+
+        # Telegram：并发发送消息 + 文件下载
+        async def telegram_burst():
+            bot = Bot(tg.fake["token"], base_url=f"{tg.fake['base_url']}/bot",
+                      base_file_url=f"{tg.fake['base_url']}/file/bot",
+                      request=HTTPXRequest(connection_pool_size=workers))
+            samples, errors = [], 0
+            semaphore = asyncio.Semaphore(workers)
+
+            async def send_one(i):
+                nonlocal errors
+                async with semaphore:
+                    t0 = time.perf_counter()
+                    try:
+                        await bot.send_message(chat_id=1000 + i % 50, text=f"✅ 上班打卡成功！#{i}")
+                        if i % 10 == 0:
+                            file = await bot.get_file(f"photo-{i}")
+                            await file.download_as_bytearray()
+                        samples.append(time.perf_counter() - t0)
+                    except (NetworkError, RetryAfter):
+                        errors += 1
+
+            async with bot:
+                t0 = time.perf_counter()
+                await asyncio.gather(*(send_one(i) for i in range(count)))
+                return samples, errors, time.perf_counter() - t0
+
+        samples, errors, elapsed = asyncio.run(telegram_burst())
+        stats = latency_stats(samples)
+        print(f"[{label}] Telegram 发送：{count / elapsed:.0f} 次/秒，p50 {stats['p50']}ms p95 {stats['p95']}ms "
+              f"p99 {stats['p99']}ms，失败 {errors}")
+        sent = tg.fake["counts"].get("sendMessage", {})
+        ok &= sent.get("ok", 0) + sent.get("error", 0) + sent.get("rate_limited", 0) == count
+        ok &= (errors == 0) if not faults else (sent.get("error", 0) + sent.get("rate_limited", 0) == errors)
+
+        cld.shutdown()
+        tg.shutdown()
+    print("✅ 替身服务自检通过" if ok else "❌ 替身服务自检失败")
+    return ok
+
+
+# ===========================
+# 清理任务删除基准：python fake_services.py cleaner [图片数] [每秒请求上限] [单次延迟ms]
+# 替身 Cloudinary 令牌桶限流（超出返回 420），约 2% 的 id 不存在（not_found），约 1% 的 id 首次进入 failed、重试成功；
+# 对比原顺序流程（每批 sleep 0.4）与 cleaner.delete_images_concurrently 的吞吐（cleaner 导入 db_pg，需 DATABASE_URL）
+# ===========================
+def cleaner_benchmark(count: int = 5000, rate_per_sec: int = 8, latency_ms: int = 300) -> bool:
+    import cloudinary
+    from cleaner import DELETE_BATCH_SIZE, delete_images_concurrently
+    import image_storage
+
+    server = start_fake_cloudinary(latency_ms=latency_ms, jitter_ms=0, rate_per_sec=rate_per_sec, item_failure_rate=0.01)
+    cloudinary.config(cloud_name=server.fake["cloud_name"], api_key="k", api_secret="s", upload_prefix=server.fake["base_url"])
+
+    def seed(prefix):
+        public_ids = [f"bench/{prefix}_{n}" for n in range(count)]
+        seed_resources(server, [pid for n, pid in enumerate(public_ids) if n % 50 != 7])
+        return public_ids
+
+    not_found = sum(1 for n in range(count) if n % 50 == 7)
+    ok = True
+
+    # 原流程：顺序批次 + 固定 sleep 0.4
+    public_ids = seed("seq")
+    t0 = time.perf_counter()
+    deleted = 0
+    for i in range(0, count, DELETE_BATCH_SIZE):
+        for attempt in range(3):
+            try:
+                response = image_storage.delete_many(public_ids[i:i + DELETE_BATCH_SIZE])
+                deleted += sum(1 for status in response.get("deleted", {}).values() if status == "deleted")
+                retry_ids = list(response.get("failed", {}).keys())
+                if retry_ids:
+                    retried = image_storage.delete_many(retry_ids)
+                    deleted += sum(1 for status in retried.get("deleted", {}).values() if status == "deleted")
+                break
+            except Exception:
+                time.sleep(1)
+        time.sleep(0.4)
+    elapsed = time.perf_counter() - t0
+    print(f"顺序流程：{elapsed:.2f}s，{deleted / elapsed:.0f} 张/秒，删除 {deleted}/{count}")
+    ok &= deleted == count - not_found
+
+    # 并发引擎
+    for workers in (4, 8):
+        public_ids = seed(f"w{workers}")
+        deleted, failed_ids, stats = delete_images_concurrently(public_ids, max_workers=workers)
+        print(
+            f"并发引擎（上限 {workers}）：{stats['elapsed']:.2f}s，{stats['per_second']:.0f} 张/秒，"
+            f"删除 {deleted}/{count}，请求 {stats['requests']} 次，限流 {stats['rate_limited']} 次，峰值并发 {stats['peak_workers']}"
+        )
+        ok &= deleted == count - not_found and not failed_ids
+
+    ok &= not server.fake["resources"]
+    server.shutdown()
+    print("✅ 删除结果校验通过" if ok else "❌ 删除结果校验失败")
+    return ok
+
+
+def _serve_forever(run_bot: bool):
+    cld = start_fake_cloudinary(port=int(os.getenv("FAKE_CLOUDINARY_PORT", "0")))
+    tg = start_fake_telegram(port=int(os.getenv("FAKE_TELEGRAM_PORT", "0")))
+    env = fake_env(cld, tg)
+    if run_bot:
+        os.environ.update(env)
+        import bot
+        bot.main()
+        return
+    print("\n".join(f"export {key}='{value}'" for key, value in env.items()))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    import sys
+    mode = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if mode == "bench":
+        sys.exit(0 if benchmark(*[int(a) for a in sys.argv[2:4]]) else 1)
+    if mode == "cleaner":
+        sys.exit(0 if cleaner_benchmark(*[int(a) for a in sys.argv[2:5]]) else 1)
+    _serve_forever(run_bot=(mode == "bot"))
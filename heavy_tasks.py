@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from config import HEAVY_TASK_CONCURRENCY
+
+# ===========================
+# 导出类重任务：相同请求合并（single-flight）+ 全局并发上限 + 排队位置提示
+# ===========================
+logger = logging.getLogger(__name__)
+
+_inflight = {}      # key -> {"future": Future, "users": 引用计数}
+_queue = []         # 等待执行槽位的任务（先进先出）
+_running = 0
+_cond = None
+_background = set()     # 后台任务的强引用（事件循环只保留弱引用，未完成的任务可能被回收）
+
+
+def _get_cond():
+    global _cond
+    if _cond is None:
+        _cond = asyncio.Condition()
+    return _cond
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def _edit_status(status_msg, text):
+    if status_msg is None:
+        return
+    try:
+        await status_msg.edit_text(text)
+    except Exception:
+        pass
+
+
+async def _run_limited(func, args, status_msg):
+    """排队获取执行槽位后，在线程中执行阻塞的导出函数（不阻塞事件循环）"""
+    global _running
+    cond = _get_cond()
+    token = object()
+    _queue.append(token)
+    last_pos = None
+
+    async with cond:
+        try:
+            while True:
+                pos = _queue.index(token)
+                if pos == 0 and _running < HEAVY_TASK_CONCURRENCY:
+                    break
+                if pos + 1 != last_pos:
+                    last_pos = pos + 1
+                    _spawn(_edit_status(status_msg, f"⏳ 导出任务排队中，当前排在第 {last_pos} 位..."))
+                await cond.wait()
+        except BaseException:
+            # 等待被取消 / 出错：移出队列，否则留在队首的 token 会永久挡住后面的任务
+            _queue.remove(token)
+            cond.notify_all()
+            raise
+        _queue.pop(0)
+        _running += 1
+        # 队列前移，通知其余等待者刷新排队位置
+        cond.notify_all()
+
+    if last_pos is not None:
+        _spawn(_edit_status(status_msg, "⏳ 已轮到你的任务，正在导出，请稍等..."))
+
+    try:
+        return await asyncio.to_thread(func, *args)
+    finally:
+        async with cond:
+            _running -= 1
+            cond.notify_all()
+
+
+async def _compute(entry, func, args, status_msg):
+    future = entry["future"]
+    try:
+        result = await _run_limited(func, args, status_msg)
+    except asyncio.CancelledError:
+        future.cancel()     # 计算被取消：所有合并的等待者随之结束，不会永远挂起
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # 标记已读取，避免无人等待时的告警
+        if not isinstance(e, Exception):
+            raise
+    else:
+        future.set_result(result)
+
+
+@asynccontextmanager
+async def shared_heavy_task(key, func, *args, status_msg=None, cleanup=None):
+    """
+    运行（或加入正在运行的）重任务，并在 with 块内返回结果：
+    - 相同 key 的并发请求只计算一次，所有等待者拿到同一个结果；
+    - 最后一个使用者退出 with 块后才调用 cleanup(result)（例如删除临时文件）。
+    用法：
+        async with shared_heavy_task(("export", start, end), export_excel, start, end, status_msg=msg) as doc:
+            ...
+    """
+    entry = _inflight.get(key)
+    if entry is None:
+        entry = {"future": asyncio.get_running_loop().create_future(), "users": 0}
+        _inflight[key] = entry
+        _spawn(_compute(entry, func, args, status_msg))
+        logger.info(f"🚀 重任务开始: {key}")
+    else:
+        logger.info(f"🔗 合并到进行中的重任务: {key}")
+        await _edit_status(status_msg, "⏳ 相同的导出任务正在进行，完成后将一并发送结果...")
+
+    entry["users"] += 1
+    result = None
+    try:
+        result = await asyncio.shield(entry["future"])
+        yield result
+    finally:
+        entry["users"] -= 1
+        if entry["users"] == 0:
+            _inflight.pop(key, None)
+            if cleanup and result:
+                try:
+                    cleanup(result)
+                except Exception as e:
+                    logger.warning(f"⚠️ 重任务结果清理失败: {key} -> {e}")
@@ -0,0 +1,253 @@
+import json
+import time
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import cloudinary
+
+from config import BEIJING_TZ
+from db_pg import get_conn
+from export_spool import spool_document
+from image_storage import cloudinary_url_parts, keys_from_urls, url_parts
+
+# ===========================
+# 打卡截图索引（/export_images）：数据一次性嵌入为紧凑 JSON，页面按天展开、虚拟滚动、缩略图懒加载
+# ===========================
+PHOTO_RE = r"\.(?:jpg|jpeg|png|gif|webp)$"
+THUMB_OPTIONS = dict(width=240, height=160, crop="fill", quality="auto", fetch_format="auto")
+
+logger = logging.getLogger(__name__)
+
+
+# ===========================
+# 查询区间内的截图记录（只取图片行，存储 key 向量化提取）
+# ===========================
+def load_photo_rows(start: datetime, end: datetime) -> tuple[pd.DataFrame | None, str | None]:
+    """返回 (按时间排序的截图记录, None)；没有可用截图时返回 (None, 提示文本)"""
+    with get_conn() as conn:
+        df = pd.read_sql("""
+            SELECT timestamp, keyword, name, content
+            FROM messages
+            WHERE timestamp >= %s AND timestamp <= %s
+            ORDER BY timestamp ASC
+        """, conn, params=(start, end))
+
+    if df.empty:
+        return None, "⚠️ 指定日期内没有数据。"
+
+    photo_df = df[df["content"].str.contains(PHOTO_RE, case=False, na=False)].copy()
+    if photo_df.empty:
+        return None, "⚠️ 指定日期内没有图片。"
+
+    photo_df["public_id"] = keys_from_urls(photo_df["content"])
+    photo_df.dropna(subset=["public_id"], inplace=True)
+    if photo_df.empty:
+        return None, "⚠️ 没有有效的截图链接。"
+
+    photo_df["timestamp"] = pd.to_datetime(photo_df["timestamp"], utc=True).dt.tz_convert(BEIJING_TZ)
+    return photo_df.reset_index(drop=True), None
+
+
+# ===========================
+# Cloudinary URL 向量化构造（实现见 image_storage.cloudinary_url_parts）
+# ===========================
+def cloudinary_urls(public_ids: pd.Series, **options) -> pd.Series:
+    prefix, paths = cloudinary_url_parts(public_ids, **options)
+    return prefix + paths
+
+
+# ===========================
+# 生成 HTML
+# ===========================
+_HTML_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset='utf-8'><title>图片导出</title>
+<style>
+body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
+h2 { text-align: center; color: #333; }
+.search-box { text-align: center; margin-bottom: 20px; }
+input { padding: 8px; width: 300px; border-radius: 5px; border: 1px solid #ccc; }
+.date-block { background: white; margin-bottom: 20px; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); }
+.date-title { font-size: 18px; padding: 10px; background: #3b81cd; color: white; cursor: pointer; border-radius: 8px 8px 0 0; }
+.date-title:hover { background: #0056b3; }
+.viewport { height: 480px; overflow-y: auto; position: relative; }
+.spacer { position: relative; }
+.row { position: absolute; left: 0; right: 0; height: __ROW__px; box-sizing: border-box; padding: 6px 10px;
+       border-bottom: 1px solid #eee; display: flex; align-items: center; gap: 12px; }
+.row img { width: 96px; height: 64px; object-fit: cover; border-radius: 4px; background: #eee; }
+a { color: #007bff; text-decoration: none; }
+a:hover { text-decoration: underline; }
+.hidden { display: none; }
+</style>
+</head><body>
+<h2>图片导出：__TITLE__</h2>
+<div class='search-box'><input type='text' id='searchInput' placeholder='🔍 输入关键词、姓名或时间筛选...'></div>
+<div id='days'></div>
+<script id='photo-data' type='application/json'>__DATA__</script>
+<script>
+// 数据：days[天] = [日期, 起始下标, 条数]；rows[i] = [时间, 关键词下标, 姓名下标, 图片路径]
+var D = JSON.parse(document.getElementById('photo-data').textContent);
+var ROW = __ROW__, OVERSCAN = 6;
+var filter = '';
+var blocks = D.days.map(function (day, idx) {
+  var block = document.createElement('div');
+  block.className = 'date-block';
+  var title = document.createElement('div');
+  title.className = 'date-title';
+  var viewport = document.createElement('div');
+  viewport.className = 'viewport hidden';
+  var spacer = document.createElement('div');
+  spacer.className = 'spacer';
+  viewport.appendChild(spacer);
+  block.appendChild(title);
+  block.appendChild(viewport);
+  document.getElementById('days').appendChild(block);
+  var state = { day: day, title: title, viewport: viewport, spacer: spacer, items: null, open: false };
+  title.onclick = function () {
+    state.open = !state.open;
+    viewport.classList.toggle('hidden', !state.open);
+    render(state);
+  };
+  viewport.onscroll = function () { render(state); };
+  return state;
+});
+
+function text(i) {
+  var r = D.rows[i];
+  return r[0] + ' - ' + (D.keywords[r[1]] || '无关键词') + ' - ' + (D.names[r[2]] || '未知');
+}
+
+// 按当前筛选条件计算每一天的命中行（只扫描数据数组，不遍历 DOM）
+function applyFilter() {
+  blocks.forEach(function (b) {
+    var start = b.day[1], count = b.day[2], items = [];
+    for (var i = start; i < start + count; i++) {
+      if (!filter || text(i).toLowerCase().indexOf(filter) >= 0) items.push(i);
+    }
+    b.items = items;
+    b.title.textContent = b.day[0] + '（' + items.length + '）▼';
+    b.title.parentNode.classList.toggle('hidden', filter !== '' && items.length === 0);
+    b.spacer.style.height = (items.length * ROW) + 'px';
+    render(b);
+  });
+}
+
+// 虚拟滚动：只为可视区域内（及上下少量缓冲）的行创建节点，缩略图懒加载
+function render(b) {
+  if (!b.open) return;
+  var top = b.viewport.scrollTop, height = b.viewport.clientHeight || 480;
+  var first = Math.max(0, Math.floor(top / ROW) - OVERSCAN);
+  var last = Math.min(b.items.length, Math.ceil((top + height) / ROW) + OVERSCAN);
+  var html = [];
+  for (var k = first; k < last; k++) {
+    var i = b.items[k], path = D.rows[i][3];
+    html.push("<div class='row' style='top:" + (k * ROW) + "px'>" +
+      "<a href='" + D.full + path + "' target='_blank'><img loading='lazy' src='" + D.thumb + path + "'></a>" +
+      "<span>" + escapeHtml(text(i)) + " - <a href='" + D.full + path + "' target='_blank'>查看图片</a></span></div>");
+  }
+  b.spacer.innerHTML = html.join('');
+}
+
+function escapeHtml(s) {
+  return s.replace(/[&<>"']/g, function (c) {
+    return { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c];
+  });
+}
+
+var timer = null;
+document.getElementById('searchInput').oninput = function (e) {
+  clearTimeout(timer);
+  timer = setTimeout(function () { filter = e.target.value.toLowerCase(); applyFilter(); }, 150);
+};
+applyFilter();
+</script>
+</body></html>
+"""
+ROW_HEIGHT = 76
+
+
+def render_images_html(photo_df: pd.DataFrame, start: datetime, end: datetime) -> str:
+    """photo_df 为 load_photo_rows 的结果（已按时间排序）"""
+    full_prefix, paths = url_parts(photo_df["public_id"])
+    thumb_prefix, _ = url_parts(photo_df["public_id"].iloc[:1], **THUMB_OPTIONS)
+
+    ts = photo_df["timestamp"]
+    dates = ts.dt.strftime("%Y-%m-%d")
+    keyword_codes, keywords = pd.factorize(photo_df["keyword"])
+    name_codes, names = pd.factorize(photo_df["name"])
+
+    # 已按时间排序，同一天的行连续：每天记 [日期, 起始下标, 条数]
+    date_values = dates.to_numpy()
+    day_starts = np.flatnonzero(np.r_[True, date_values[1:] != date_values[:-1]])
+    day_counts = np.diff(np.r_[day_starts, len(date_values)])
+
+    data = {
+        "full": full_prefix,
+        "thumb": thumb_prefix,
+        "keywords": keywords.tolist(),
+        "names": names.tolist(),
+        "days": [[date_values[s], int(s), int(c)] for s, c in zip(day_starts, day_counts)],
+        "rows": list(zip(
+            ts.dt.strftime("%H:%M:%S").tolist(),
+            np.where(keyword_codes < 0, -1, keyword_codes).tolist(),
+            np.where(name_codes < 0, -1, name_codes).tolist(),
+            paths.tolist(),
+        )),
+    }
+    # 紧凑 JSON；转义 “</” 防止提前结束 <script>
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+    title = f"{start.strftime('%Y-%m-%d')} 至 {end.strftime('%Y-%m-%d')}"
+    return (
+        _HTML_TEMPLATE
+        .replace("__ROW__", str(ROW_HEIGHT))
+        .replace("__TITLE__", title)
+        .replace("__DATA__", payload)
+    )
+
+
+def build_images_html(start: datetime, end: datetime):
+    """返回 (导出文件, None)；没有可导出的图片时返回 (None, 提示文本)"""
+    photo_df, error_text = load_photo_rows(start, end)
+    if photo_df is None:
+        return None, error_text
+
+    html = render_images_html(photo_df, start, end).encode("utf-8")
+    logger.info(f"🖼️ 图片索引生成完成：{len(photo_df)} 张，{len(html) / 1024:.0f} KB")
+    start_str = start.strftime("%Y-%m-%d")
+    end_str = end.strftime("%Y-%m-%d")
+    return spool_document(f"图片记录_{start_str}_{end_str}.html", html), None
+
+
+# ===========================
+# 基准：python image_index.py [张数]
+# 对比逐行 build_url 与向量化 URL 构造（并校验结果一致），以及整页 HTML 生成耗时 / 大小
+# ===========================
+def benchmark(rows: int = 20000):
+    rng = np.random.default_rng(0)
+    start = datetime(2025, 8, 1, tzinfo=BEIJING_TZ)
+    offsets = np.sort(rng.integers(0, 31 * 86400, rows))
+    photo_df = pd.DataFrame({
+        "timestamp": pd.to_datetime(start) + pd.to_timedelta(offsets, unit="s"),
+        "keyword": rng.choice(["#上班打卡", "#下班打卡", None], rows),
+        "name": [f"用户{i:03d}" for i in rng.integers(0, 500, rows)],
+        "public_id": [f"punch/2025-08/{i:06d}_截图" if i % 3 == 0 else f"p{i:06d}" for i in range(rows)],
+    })
+
+    t0 = time.perf_counter()
+    old_urls = photo_df["public_id"].apply(lambda pid: cloudinary.CloudinaryImage(pid).build_url())
+    t1 = time.perf_counter()
+    new_urls = cloudinary_urls(photo_df["public_id"])
+    t2 = time.perf_counter()
+    html = render_images_html(photo_df, start, start)
+    t3 = time.perf_counter()
+
+    mismatches = int((old_urls != new_urls).sum())
+    print(f"{rows} 张：逐行 build_url {t1 - t0:.2f}s，向量化 {t2 - t1:.3f}s，不一致 {mismatches} 条")
+    print(f"整页 HTML：{t3 - t2:.2f}s，{len(html.encode('utf-8')) / 1024:.0f} KB")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(0 if benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000) else 1)
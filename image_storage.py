@@ -0,0 +1,261 @@
+import os
+import re
+import mmap
+import uuid
+import shutil
+import logging
+
+import numpy as np
+import pandas as pd
+import cloudinary
+import cloudinary.api
+import cloudinary.uploader
+from cloudinary.exceptions import RateLimited
+
+from config import IMAGE_STORAGE, IMAGE_STORAGE_DIR, IMAGE_STORAGE_URL
+
+# ===========================
+# 截图存储后端（IMAGE_STORAGE 选择：cloudinary / local）
+# ===========================
+# 统一接口（模块级函数，按配置分派到具体后端）：
+#   put(本地文件, 目录) -> URL        get(key) -> 图片内容        url(key) -> URL
+#   delete_many(keys) / delete_prefix(前缀) -> {"deleted": {key: "deleted" | "not_found"}, "failed": {...}, "partial": bool,
+#                                              "rate_limit_remaining": 剩余请求额度或 None}
+#   key_from_url(URL) / keys_from_urls(Series) -> key；url_parts(keys) -> (公共前缀, 每行路径)；url_prefix() -> 本后端 URL 的固定开头
+# key 即 Cloudinary 的 public_id（不含扩展名）；本地后端为 目录/随机文件名.扩展名（每次上传一个独立文件）。
+# 删除结果沿用 Cloudinary Admin API 的返回结构，被限流时抛出 StorageRateLimited，清理引擎无需区分后端。
+logger = logging.getLogger(__name__)
+
+
+class StorageRateLimited(Exception):
+    """存储后端限流（如 Cloudinary Admin API 返回 420 / 429），调用方应降速后重试"""
+
+
+# ===========================
+# Cloudinary 后端
+# ===========================
+CLOUDINARY_URL_PREFIX = "https://res.cloudinary.com/"
+PUBLIC_ID_RE = r"/upload/(?:v\d+/)?(.+?)\.(?:jpg|jpeg|png|gif|webp)$"
+
+
+def _cloudinary_put(local_path: str, folder: str) -> str:
+    response = cloudinary.uploader.upload(
+        local_path,
+        public_id=f"{folder}/{uuid.uuid4().hex}",    # 目录写进 public_id，固定 / 动态目录模式下前缀删除都适用
+        tags=[folder.replace("/", "_")],             # 同时打上月份标签（punches_YYYY-MM），便于控制台按月筛选
+    )
+    return response["secure_url"]
+
+
+def _cloudinary_get(key: str) -> bytes:
+    import requests
+    resp = requests.get(_cloudinary_url(key), timeout=(5, 30))
+    resp.raise_for_status()
+    return resp.content
+
+
+def _cloudinary_url(key: str) -> str:
+    return cloudinary.CloudinaryImage(key).build_url()
+
+
+def _cloudinary_key_from_url(url: str) -> str | None:
+    """
+    解析 Cloudinary 图片 URL 提取 public_id（支持多级目录，去掉版本号段与扩展名）
+    https://res.cloudinary.com/demo/image/upload/v1691234567/folder/image.jpg -> folder/image
+    """
+    if "cloudinary.com" not in url:
+        return None
+    parts = url.split("?")[0].split("/upload/")
+    if len(parts) < 2:
+        return None
+    rest = parts[1].split("/")
+    if rest and re.fullmatch(r"v\d+", rest[0]):
+        rest = rest[1:]
+    return os.path.splitext("/".join(rest))[0] or None
+
+
+def _cloudinary_keys_from_urls(urls: pd.Series) -> pd.Series:
+    return urls.str.extract(PUBLIC_ID_RE, flags=re.IGNORECASE, expand=False)
+
+
+def _escape(match: re.Match) -> str:
+    return "".join(f"%{b:02X}" for b in match.group(0).encode("utf-8"))
+
+
+def cloudinary_url_parts(public_ids: pd.Series, **options) -> tuple[str, pd.Series]:
+    """
+    Cloudinary URL 向量化构造（与 CloudinaryImage(pid).build_url(**options) 结果一致）。
+    返回 (公共前缀, 每行路径)，前缀 + 路径 即完整 URL。
+    前缀（域名 / 转换参数）只调用一次 build_url 生成；路径部分按 build_url 的规则批量处理：
+    含 “/” 且不以版本号开头的 public_id 补 v1/，非安全字符按 UTF-8 百分号转义。
+    """
+    placeholder = "PUBLICID"
+    prefix = cloudinary.CloudinaryImage(placeholder).build_url(**options)[:-len(placeholder)]
+    escaped = public_ids.str.replace(r"[^a-zA-Z0-9_.\-/:]+", _escape, regex=True)
+    needs_version = public_ids.str.contains("/", regex=False) & ~public_ids.str.match(r"v[0-9]+")
+    paths = pd.Series(np.where(needs_version, "v1/", ""), index=public_ids.index) + escaped
+    return prefix, paths
+
+
+def _cloudinary_admin_call(method, *args, **kwargs) -> dict:
+    """调用 Admin API：限流转换为 StorageRateLimited，响应头中的剩余额度放进结果的 rate_limit_remaining"""
+    try:
+        response = method(*args, **kwargs)
+    except RateLimited as e:
+        raise StorageRateLimited(str(e)) from e
+    return {**response, "rate_limit_remaining": getattr(response, "rate_limit_remaining", None)}
+
+
+def _cloudinary_delete_many(keys) -> dict:
+    return _cloudinary_admin_call(cloudinary.api.delete_resources, list(keys), resource_type="image")
+
+
+def _cloudinary_delete_prefix(prefix: str) -> dict:
+    """每次调用最多删除 1000 张，返回 partial 时需继续调用"""
+    return _cloudinary_admin_call(cloudinary.api.delete_resources_by_prefix, prefix, resource_type="image")
+
+
+# ===========================
+# 本地磁盘后端（读取时内存映射）
+# ===========================
+# 文件位于 IMAGE_STORAGE_DIR/目录/随机文件名.扩展名，URL 为 IMAGE_STORAGE_URL/目录/随机文件名.扩展名。
+# 每次上传都是独立文件（与 Cloudinary 的随机 public_id 一致）：内容相同的两条记录互不影响，删除其一不会删掉另一条的截图。
+# 写入先写临时文件再原子替换。
+def _local_path(key: str) -> str:
+    path = os.path.normpath(os.path.join(IMAGE_STORAGE_DIR, key))
+    if not path.startswith(os.path.normpath(IMAGE_STORAGE_DIR) + os.sep):
+        raise ValueError(f"非法的图片 key: {key}")
+    return path
+
+
+def _local_put(local_path: str, folder: str) -> str:
+    ext = os.path.splitext(local_path)[1].lower() or ".jpg"
+    key = f"{folder}/{uuid.uuid4().hex}{ext}"
+    path = _local_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    shutil.copyfile(local_path, tmp_path)
+    os.replace(tmp_path, path)
+    return _local_url(key)
+
+
+def _local_get(key: str):
+    """返回只读内存映射（支持 len / 切片 / 缓冲区协议，可直接写入 ZIP 或发送）；空文件返回 b\"\""""
+    with open(_local_path(key), "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _local_url(key: str) -> str:
+    return f"{IMAGE_STORAGE_URL}/{key}"
+
+
+def _local_key_from_url(url: str) -> str | None:
+    prefix = f"{IMAGE_STORAGE_URL}/"
+    if not url.startswith(prefix):
+        return None
+    return url[len(prefix):] or None
+
+
+def _local_keys_from_urls(urls: pd.Series) -> pd.Series:
+    prefix = f"{IMAGE_STORAGE_URL}/"
+    return urls.where(urls.str.startswith(prefix, na=False)).str[len(prefix):]
+
+
+def _local_url_parts(keys: pd.Series, **options) -> tuple[str, pd.Series]:
+    """本地后端不做图片转换，缩略图与原图同一地址"""
+    return f"{IMAGE_STORAGE_URL}/", keys
+
+
+def _local_delete_many(keys) -> dict:
+    deleted = {}
+    failed = {}
+    for key in keys:
+        try:
+            os.remove(_local_path(key))
+            deleted[key] = "deleted"
+        except FileNotFoundError:
+            deleted[key] = "not_found"
+        except (OSError, ValueError) as e:
+            failed[key] = str(e)
+    return {"deleted": deleted, "failed": failed, "partial": False, "rate_limit_remaining": None}
+
+
+def _local_delete_prefix(prefix: str) -> dict:
+    root = _local_path(prefix.rstrip("/"))
+    deleted = {}
+    if os.path.isdir(root):
+        for dirpath, _, filenames in os.walk(root):
+            for fname in filenames:
+                key = os.path.relpath(os.path.join(dirpath, fname), IMAGE_STORAGE_DIR).replace(os.sep, "/")
+                deleted[key] = "deleted"
+        shutil.rmtree(root)
+    return {"deleted": deleted, "failed": {}, "partial": False, "rate_limit_remaining": None}
+
+
+# ===========================
+# 后端注册表与统一入口
+# ===========================
+STORAGE_BACKENDS = {
+    "cloudinary": {
+        "put": _cloudinary_put, "get": _cloudinary_get, "url": _cloudinary_url,
+        "key_from_url": _cloudinary_key_from_url, "keys_from_urls": _cloudinary_keys_from_urls,
+        "url_parts": cloudinary_url_parts, "url_prefix": CLOUDINARY_URL_PREFIX,
+        "delete_many": _cloudinary_delete_many, "delete_prefix": _cloudinary_delete_prefix,
+    },
+    "local": {
+        "put": _local_put, "get": _local_get, "url": _local_url,
+        "key_from_url": _local_key_from_url, "keys_from_urls": _local_keys_from_urls,
+        "url_parts": _local_url_parts, "url_prefix": f"{IMAGE_STORAGE_URL}/",
+        "delete_many": _local_delete_many, "delete_prefix": _local_delete_prefix,
+    },
+}
+if IMAGE_STORAGE not in STORAGE_BACKENDS:
+    raise ValueError(f"不支持的 IMAGE_STORAGE: {IMAGE_STORAGE}（可选 {', '.join(STORAGE_BACKENDS)}）")
+_backend = STORAGE_BACKENDS[IMAGE_STORAGE]
+
+
+def put(local_path: str, folder: str) -> str:
+    return _backend["put"](local_path, folder)
+
+
+def get(key: str):
+    return _backend["get"](key)
+
+
+def url(key: str) -> str:
+    return _backend["url"](key)
+
+
+def url_prefix() -> str:
+    """本后端所有图片 URL 的固定开头（SQL 中用 LIKE 前缀筛选图片行）"""
+    return _backend["url_prefix"]
+
+
+def key_from_url(image_url: str | None) -> str | None:
+    """不是本后端的图片 URL 时返回 None"""
+    if not image_url:
+        return None
+    try:
+        return _backend["key_from_url"](image_url)
+    except Exception as e:
+        logger.warning(f"⚠️ 图片 key 提取失败: {image_url} -> {e}")
+        return None
+
+
+def keys_from_urls(urls: pd.Series) -> pd.Series:
+    """向量化提取 key，非本后端的 URL 为 NaN"""
+    return _backend["keys_from_urls"](urls)
+
+
+def url_parts(keys: pd.Series, **options) -> tuple[str, pd.Series]:
+    return _backend["url_parts"](keys, **options)
+
+
+def delete_many(keys) -> dict:
+    return _backend["delete_many"](keys)
+
+
+def delete_prefix(prefix: str) -> dict:
+    return _backend["delete_prefix"](prefix)
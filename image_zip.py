@@ -0,0 +1,225 @@
+import os
+import time
+import shutil
+import zipfile
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import image_storage
+from config import DATA_DIR, IMAGE_STORAGE, IMAGE_ZIP_WORKERS, IMAGE_ZIP_PART_MB
+from image_index import load_photo_rows
+
+# ===========================
+# 打卡截图打包下载（/export_images_zip）
+# ===========================
+# 线程池并发下载（共享 Session，连接复用），主线程按原顺序把下载结果写入 ZIP：
+# 同时在途的下载不超过 workers × 2 张，内存占用与图片总数无关。
+# 归档内目录为 日期/姓名/时间_关键词.jpg；截图本身已压缩，条目直接存储（ZIP_STORED）不再压缩。
+# 单个 ZIP 超过 part_mb 时切换到下一个分卷（每个分卷都是独立完整的 ZIP）。
+# 下载失败自动重试（指数退避），仍失败的跳过，并在最后一个分卷写入“下载失败.txt”清单。
+RETRIES = 3
+TIMEOUT = (5, 30)           # (连接, 读取) 超时秒数
+ENTRY_OVERHEAD = 256       # 每个条目的本地头 + 中央目录记录预留字节（含中文路径）
+
+logger = logging.getLogger(__name__)
+_thread_local = threading.local()
+
+
+def _session() -> requests.Session:
+    """每个下载线程复用一个 Session（HTTP keep-alive），避免每张图重新建立 TLS 连接"""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _thread_local.session = session
+    return session
+
+
+def download(url: str, retries: int = RETRIES) -> bytes | None:
+    """下载单张图片；超时 / 连接错误 / 5xx / 429 重试，其余错误（如 404）直接放弃；最终失败返回 None"""
+    for attempt in range(retries):
+        try:
+            resp = _session().get(url, timeout=TIMEOUT)
+            if resp.status_code == 200:
+                return resp.content
+            if resp.status_code != 429 and resp.status_code < 500:
+                logger.warning(f"⚠️ 图片下载失败（HTTP {resp.status_code}），跳过: {url}")
+                return None
+        except requests.RequestException as e:
+            logger.warning(f"⚠️ 图片下载出错（第 {attempt + 1} 次）: {url} -> {e}")
+        time.sleep(0.5 * 2 ** attempt)
+    return None
+
+
+def fetch(url: str):
+    """本地存储的截图直接内存映射读取，其余按 URL 下载"""
+    key = image_storage.key_from_url(url) if IMAGE_STORAGE == "local" else None
+    if key is None:
+        return download(url)
+    try:
+        return image_storage.get(key)
+    except OSError as e:
+        logger.warning(f"⚠️ 本地截图读取失败，跳过: {key} -> {e}")
+        return None
+
+
+def _entry_names(photo_df) -> list[str]:
+    """日期/姓名/时间_关键词.扩展名；同名文件追加序号"""
+    ts = photo_df["timestamp"]
+    dates = ts.dt.strftime("%Y-%m-%d")
+    times = ts.dt.strftime("%H%M%S")
+    names = photo_df["name"].fillna("未知").astype(str).str.replace(r'[\\/*?:"<>|]', "_", regex=True)
+    keywords = photo_df["keyword"].fillna("").astype(str).str.replace(r'[#\\/*?:"<>|]', "", regex=True)
+    exts = photo_df["content"].str.extract(r"\.([A-Za-z0-9]+)$", expand=False).fillna("jpg").str.lower()
+    stems = dates + "/" + names + "/" + times + ("_" + keywords).where(keywords != "", "")
+
+    seen = {}
+    entries = []
+    for stem, ext in zip(stems.tolist(), exts.tolist()):
+        n = seen.get(stem, 0)
+        seen[stem] = n + 1
+        entries.append(f"{stem}.{ext}" if n == 0 else f"{stem}_{n + 1}.{ext}")
+    return entries
+
+
+def write_images_zip(items, base_path: str, workers: int = IMAGE_ZIP_WORKERS, part_mb: int = IMAGE_ZIP_PART_MB):
+    """
+    items: [(归档内路径, 图片 URL)]，按写入顺序排列。
+    :return: (分卷路径列表, 失败的 (归档内路径, URL) 列表)
+    """
+    part_limit = part_mb * 1024 * 1024
+    paths, failed = [], []
+    zf = None
+
+    def open_part():
+        path = f"{base_path}_part{len(paths) + 1}.zip"
+        paths.append(path)
+        return zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    pending = deque()
+    item_iter = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit_next():
+            item = next(item_iter, None)
+            if item is not None:
+                pending.append((item, pool.submit(fetch, item[1])))
+
+        for _ in range(workers * 2):
+            submit_next()
+        try:
+            while pending:
+                (entry, url), future = pending.popleft()
+                data = future.result()
+                submit_next()
+                if data is None:
+                    failed.append((entry, url))
+                    continue
+                # 当前分卷放不下这张图时切换分卷（空分卷至少放一张）
+                if zf is None or (
+                    zf.fp.tell() + (len(zf.filelist) + 2) * ENTRY_OVERHEAD + len(data) > part_limit and zf.filelist
+                ):
+                    if zf is not None:
+                        zf.close()
+                    zf = open_part()
+                zf.writestr(entry, data)
+            if failed:
+                if zf is None:
+                    zf = open_part()
+                zf.writestr("下载失败.txt", "\n".join(f"{entry}\t{url}" for entry, url in failed))
+        finally:
+            if zf is not None:
+                zf.close()
+
+    # 只有一个分卷时去掉分卷后缀
+    if len(paths) == 1:
+        single_path = f"{base_path}.zip"
+        os.replace(paths[0], single_path)
+        paths = [single_path]
+    return paths, failed
+
+
+def export_images_zip(start: datetime, end: datetime):
+    """
+    导出区间内全部打卡截图。
+    :return: (分卷路径列表, 失败张数, 提示文本)；没有可导出的图片时路径列表为空。
+    分卷位于 DATA_DIR 下本次导出单独的目录，发送完毕后由调用方连同目录一起删除。
+    """
+    photo_df, error_text = load_photo_rows(start, end)
+    if photo_df is None:
+        return [], 0, error_text
+
+    start_str = start.strftime("%Y-%m-%d")
+    end_str = end.strftime("%Y-%m-%d")
+    export_dir = os.path.join(DATA_DIR, f"images_{start_str}_{end_str}")
+    os.makedirs(export_dir, exist_ok=True)
+
+    t0 = time.perf_counter()
+    items = list(zip(_entry_names(photo_df), photo_df["content"].tolist()))
+    try:
+        paths, failed = write_images_zip(items, os.path.join(export_dir, f"打卡截图_{start_str}_{end_str}"))
+    except BaseException:
+        shutil.rmtree(export_dir, ignore_errors=True)    # 打包中途失败：删除已写出的分卷及导出目录
+        raise
+    elapsed = time.perf_counter() - t0
+    size_mb = sum(os.path.getsize(p) for p in paths) / 1024 / 1024
+    logger.info(
+        f"🗜️ 截图打包完成：{len(items) - len(failed)}/{len(items)} 张，{len(paths)} 个分卷，"
+        f"{size_mb:.1f} MB，耗时 {elapsed:.1f}s（{size_mb / max(elapsed, 1e-6):.1f} MB/s）"
+    )
+    return paths, len(failed), None
+
+
+# ===========================
+# 基准 / 自检：python image_zip.py [张数] [单张KB] [延迟ms]
+# 图片来自 fake_services 的 Cloudinary 替身（每张固定延迟；约 5% 首次返回 500、重试成功，1% 不存在返回 404），
+# 对比串行与并发下载的吞吐，并校验归档内容（条目数、CRC、失败清单、分卷大小）
+# ===========================
+def benchmark(count: int = 400, size_kb: int = 200, latency_ms: int = 50) -> bool:
+    import tempfile
+    from fake_services import start_fake_cloudinary, seed_resources, delivery_url
+
+    server = start_fake_cloudinary(latency_ms=latency_ms, jitter_ms=0, item_failure_rate=0.05)
+    missing = {i for i in range(count) if i % 100 == 7}
+    expected_ok = count - len(missing)
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in (1, 8, 16):
+            # 每轮使用不同的 public_id，每轮都有首次下载失败的图片
+            public_ids = [f"punches/2025-08/w{workers}_{i}" for i in range(count)]
+            seed_resources(server, [pid for i, pid in enumerate(public_ids) if i not in missing], size_kb * 1024)
+            items = [
+                (f"2025-08-{i % 28 + 1:02d}/用户{i % 37:03d}/{i:06d}.jpg", delivery_url(server, pid))
+                for i, pid in enumerate(public_ids)
+            ]
+            t0 = time.perf_counter()
+            paths, failed = write_images_zip(items, os.path.join(tmp, f"w{workers}"), workers=workers, part_mb=20)
+            elapsed = time.perf_counter() - t0
+            entries = 0
+            for path in paths:
+                with zipfile.ZipFile(path) as zf:
+                    ok &= zf.testzip() is None
+                    entries += len([n for n in zf.namelist() if n != "下载失败.txt"])
+                ok &= os.path.getsize(path) <= 20 * 1024 * 1024
+            ok &= entries == expected_ok and len(failed) == count - expected_ok
+            mb = entries * size_kb / 1024
+            print(f"{workers:>2} 线程：{elapsed:.2f}s，{mb / elapsed:.1f} MB/s，{entries} 张成功，{len(failed)} 张失败，{len(paths)} 个分卷")
+    flaky = sum(1 for endpoint, _ in server.fake["failed_once"] if endpoint == "deliver")
+    print(f"替身共注入 {flaky} 次首次下载失败（均已重试成功）")
+    server.shutdown()
+    print("✅ 归档校验通过" if ok else "❌ 归档校验失败")
+    return ok
+
+
+if __name__ == "__main__":
+    import sys
+    args = [int(a) for a in sys.argv[1:4]]
+    sys.exit(0 if benchmark(*args) else 1)
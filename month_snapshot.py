@@ -0,0 +1,162 @@
+import os
+import logging
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import DATA_DIR, BEIJING_TZ
+from db_pg import get_data_version
+
+# ===========================
+# 已结束月份的列式快照（Parquet，zstd 压缩，读取时内存映射）
+# ===========================
+# 每个自然月一个文件 punches_YYYY-MM.parquet，只含打卡类记录的导出列。
+# 文件覆盖 [当月1日 00:00, 次月1日 06:00)：次月1日凌晨的 I班下班卡归属上月最后一天，一并收录。
+# 文件元数据记录写入时该月的数据版本戳，读取时版本不一致（有补卡 / 删除等改动）即视为失效。
+SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshots")
+SPILL = timedelta(hours=6)
+CATEGORY_COLUMNS = ("name", "keyword", "shift")
+
+logger = logging.getLogger(__name__)
+
+
+def _to_beijing(value) -> datetime:
+    """datetime / date / 'YYYY-MM-DD' 统一转为北京时间 datetime"""
+    if isinstance(value, str):
+        value = datetime.strptime(value[:10], "%Y-%m-%d")
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=BEIJING_TZ)
+    return value.astimezone(BEIJING_TZ)
+
+
+def month_start(value) -> datetime:
+    dt = _to_beijing(value)
+    return datetime(dt.year, dt.month, 1, tzinfo=BEIJING_TZ)
+
+
+def next_month(start: datetime) -> datetime:
+    return month_start(start + timedelta(days=32))
+
+
+def _snapshot_path(start: datetime) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"punches_{start:%Y-%m}.parquet")
+
+
+def is_month_closed(start: datetime) -> bool:
+    """快照覆盖范围（含次月凌晨）已全部过去，才允许写快照"""
+    return next_month(start) + SPILL <= datetime.now(BEIJING_TZ)
+
+
+def month_version(start: datetime) -> str:
+    """快照覆盖到次月1日 06:00（SPILL），版本区间须包含次月1日，否则该时段内的改动不会使快照失效"""
+    return get_data_version(start.date(), next_month(start).date())
+
+
+def _months_between(first: datetime, last: datetime):
+    months = []
+    current = first
+    while current <= last:
+        months.append(current)
+        current = next_month(current)
+    return months
+
+
+# ===========================
+# 写入快照（先写临时文件再原子替换，读取方永远看不到写了一半的文件）
+# ===========================
+def write_snapshot(start: datetime, df: pd.DataFrame, version: str) -> str:
+    """
+    df 为该月覆盖范围内的打卡记录（timestamp 为北京时间）；返回快照路径。
+    version 须在查询 df 之前由 month_version 读取：查询期间提交的改动会让版本变化，快照随之视为失效，
+    不会把新版本号记在旧数据上。
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+    df = df.sort_values(["name", "timestamp"], ignore_index=True)
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"data_version": version.encode("utf-8")})
+
+    path = _snapshot_path(start)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+    logger.info(f"🧊 已写入月度快照 {os.path.basename(path)}：{len(df)} 条，版本 {version}")
+    return path
+
+
+def snapshot_is_valid(start: datetime) -> bool:
+    path = _snapshot_path(start)
+    if not os.path.exists(path):
+        return False
+    metadata = pq.read_schema(path, memory_map=True).metadata or {}
+    return metadata.get(b"data_version", b"").decode("utf-8") == month_version(start)
+
+
+# ===========================
+# 失效（补卡 / 删除区间等改动涉及的月份）
+# ===========================
+def invalidate_snapshots(start=None, end=None):
+    """删除与 [start, end] 有交集的月度快照；不传参数时删除全部快照"""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return
+    if start is None:
+        targets = [os.path.join(SNAPSHOT_DIR, f) for f in os.listdir(SNAPSHOT_DIR) if f.endswith(".parquet")]
+    else:
+        end = start if end is None else end
+        # 当月1日凌晨的改动也落在上月快照的覆盖范围内
+        months = _months_between(month_start(_to_beijing(start) - SPILL), month_start(end))
+        targets = [_snapshot_path(m) for m in months]
+
+    for path in targets:
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"🧹 月度快照已失效：{os.path.basename(path)}")
+
+
+# ===========================
+# 读取快照（区间被有效快照完整覆盖时才返回，否则返回 None 回退数据库）
+# ===========================
+def load_snapshot(start_datetime: datetime, end_datetime: datetime, columns, user_name: str | None = None):
+    try:
+        start = _to_beijing(start_datetime)
+        end = _to_beijing(end_datetime)
+        first = month_start(start)
+        last = month_start(end)
+        # 区间终点落在上月快照的次月凌晨部分时，无需下个月的快照
+        if last > first and end < last + SPILL:
+            last = month_start(last - timedelta(days=1))
+        months = _months_between(first, last)
+
+        if not all(is_month_closed(m) and snapshot_is_valid(m) for m in months):
+            return None
+        if not set(columns) <= set(pq.read_schema(_snapshot_path(months[0])).names):
+            return None
+
+        filters = [("name", "==", user_name)] if user_name is not None else None
+        frames = []
+        for i, m in enumerate(months):
+            df = pd.read_parquet(_snapshot_path(m), columns=list(columns), filters=filters, memory_map=True)
+            ts = df["timestamp"]
+            mask = (ts >= start) & (ts <= end)
+            if i > 0:
+                mask &= ts >= m
+            if i < len(months) - 1:
+                mask &= ts < next_month(m)
+            frames.append(df[mask])
+
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0].reset_index(drop=True)
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+        logger.info(f"🧊 命中月度快照 {months[0]:%Y-%m}~{months[-1]:%Y-%m}：{len(df)} 条")
+        return df
+    except Exception as e:
+        logger.warning(f"⚠️ 读取月度快照失败，回退数据库: {e}")
+        return None
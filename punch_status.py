@@ -0,0 +1,306 @@
+import re
+import numpy as np
+import pandas as pd
+
+# ===========================
+# 打卡状态位（可按位叠加，如 迟到 + 签到异常）
+# ===========================
+LATE_LT15 = 1         # 迟到（<15分钟）
+LATE_GE15 = 2         # 迟到（≥15分钟）
+EARLY = 4             # 早退
+OUT_OF_WINDOW = 8     # 签到异常（不在班次前后30分钟窗口内）
+MAKEUP = 16           # 补卡
+REST = 32             # 休息/缺勤
+NO_CHECKOUT = 64      # 未打下班卡
+
+LATE = LATE_LT15 | LATE_GE15
+
+# 备注文本（按此顺序用“；”拼接）
+STATUS_TAGS = [
+    (LATE_LT15, "迟到（<15分钟）"),
+    (LATE_GE15, "迟到（≥15分钟）"),
+    (EARLY, "早退"),
+    (OUT_OF_WINDOW, "签到异常"),
+    (MAKEUP, "补卡"),
+    (REST, "休息/缺勤"),
+    (NO_CHECKOUT, "未打下班卡"),
+]
+
+# 矩阵版式单元格里的状态简码（与 STATUS_TAGS 同序）
+STATUS_CODES = [
+    (LATE_LT15, "迟"),
+    (LATE_GE15, "迟+"),
+    (EARLY, "早"),
+    (OUT_OF_WINDOW, "异"),
+    (MAKEUP, "补"),
+    (REST, "休"),
+    (NO_CHECKOUT, "未"),
+]
+
+# 异常统计表的列 -> 状态位
+STAT_COLUMNS = {
+    "休息/缺勤": REST,
+    "迟到<15分钟": LATE_LT15,
+    "迟到≥15分钟": LATE_GE15,
+    "早退": EARLY,
+    "签到异常": OUT_OF_WINDOW,
+    "补卡": MAKEUP,
+    "未打下班卡": NO_CHECKOUT,
+}
+
+# 计入“异常总数”的列（休息/缺勤不算异常）
+ABNORMAL_COLUMNS = ["迟到<15分钟", "迟到≥15分钟", "早退", "签到异常", "补卡", "未打下班卡"]
+
+
+def status_remark(status) -> str:
+    """状态位 -> 备注文本，例如 LATE_LT15 | OUT_OF_WINDOW -> 迟到（<15分钟）；签到异常"""
+    status = int(status)
+    return "；".join(tag for flag, tag in STATUS_TAGS if status & flag)
+
+
+def status_code(status) -> str:
+    """状态位 -> 简码，例如 LATE_GE15 | MAKEUP -> 迟+补"""
+    status = int(status)
+    return "".join(code for flag, code in STATUS_CODES if status & flag)
+
+
+def count_status(names, status, all_names=None) -> pd.DataFrame:
+    """
+    按姓名统计各状态出现次数（向量化 groupby，一次算完）。
+    :param names: 每行的姓名
+    :param status: 每行的状态位
+    :param all_names: 需要出现在结果中的全部姓名（无记录的补 0；不在名单中的姓名被丢弃），None 表示不限制
+    :return: 以姓名为索引，列为 STAT_COLUMNS + 异常总数 的 DataFrame
+    """
+    codes = np.asarray(status, dtype=np.int64)
+    flags = pd.DataFrame(
+        {col: (codes & flag) != 0 for col, flag in STAT_COLUMNS.items()},
+        index=pd.Index(np.asarray(names, dtype=object), name="姓名"),
+    )
+    counts = flags.groupby(level=0).sum().astype(int)
+    if all_names is not None:
+        counts = counts.reindex(pd.Index(list(all_names), name="姓名"), fill_value=0)
+    counts["异常总数"] = counts[ABNORMAL_COLUMNS].sum(axis=1)
+    return counts
+
+
+# ===========================
+# 向量化分类引擎（NumPy，一次处理全部打卡记录）
+# ===========================
+KW_NONE = 0
+KW_UP = 1       # #上班打卡
+KW_DOWN = 2     # #下班打卡
+
+# 真正的打卡类关键词（#取消打卡 等审计类关键词不参与考勤统计）
+PUNCH_KEYWORDS = ("#上班打卡", "#下班打卡")
+
+_KEYWORD_CODES = {"#上班打卡": KW_UP, "#下班打卡": KW_DOWN}
+
+
+def classify_punches(seconds, keyword_codes, shift_codes, shift_start, shift_end, makeup, margin: int = 30) -> np.ndarray:
+    """
+    按班次规则为每条打卡计算状态位（与逐行判断等价，均按“时分”做环形计算，兼容跨天班次）。
+    :param seconds: 打卡时刻在当天的秒数（0-86399），无时间的行为 -1
+    :param keyword_codes: KW_UP / KW_DOWN / KW_NONE
+    :param shift_codes: 班次编号（shift_start / shift_end 的下标），未识别的班次为 -1
+    :param shift_start: 各班次开始时间（当天分钟数）
+    :param shift_end: 各班次结束时间（当天分钟数）
+    :param makeup: 是否为补卡班次（班次文本含“补卡”）
+    :param margin: 签到窗口（班次开始前 / 结束后的分钟数）
+    :return: int64 状态位数组
+    """
+    seconds = np.asarray(seconds, dtype=np.int64)
+    kw = np.asarray(keyword_codes, dtype=np.int8)
+    code = np.asarray(shift_codes, dtype=np.int64)
+    makeup = np.asarray(makeup, dtype=bool)
+    shift_start = np.asarray(shift_start, dtype=np.int64)
+    shift_end = np.asarray(shift_end, dtype=np.int64)
+
+    status = np.zeros(len(seconds), dtype=np.int64)
+    has_time = seconds >= 0
+
+    # 补卡：只打标记，不再判断迟到/早退
+    is_makeup = has_time & makeup
+    status[is_makeup] = MAKEUP
+
+    known = has_time & ~makeup & (code >= 0)
+    if not known.any() or len(shift_start) == 0:
+        return status
+
+    safe_code = np.where(code >= 0, code, 0)
+    start = shift_start[safe_code]
+    end = shift_end[safe_code]
+    minutes = seconds // 60
+    hour = seconds // 3600
+    up = known & (kw == KW_UP)
+    down = known & (kw == KW_DOWN)
+
+    # 迟到：打卡时刻（含秒）晚于班次开始；迟到分钟数按环形差值分档
+    late = up & (seconds > start * 60)
+    late_minutes = (minutes - start) % 1440
+    status[late & (late_minutes >= 15)] |= LATE_GE15
+    status[late & (late_minutes < 15)] |= LATE_LT15
+
+    # 早退：跨天班次（结束 <= 开始）在开始之后、次日结束时间之前下班即早退（如 18:00-02:00 班 22:00 或 01:30 下班）；
+    #       普通班次早于结束时间下班即早退（00:00-01:59 的下班卡视为次日补打，不算早退）
+    cross_day = end <= start
+    early_cross = cross_day & ((minutes >= start) | (seconds < end * 60))
+    early_normal = ~cross_day & (hour > 1) & (seconds < end * 60)
+    status[down & (early_cross | early_normal)] |= EARLY
+
+    # 签到异常：不在【开始前 margin 分钟，结束后 margin 分钟】窗口内（窗口可能跨午夜）
+    s = (start - margin) % 1440
+    e = (end + margin) % 1440
+    in_window = np.where(s <= e, (minutes >= s) & (minutes <= e), (minutes >= s) | (minutes <= e))
+    status[(up | down) & ~in_window] |= OUT_OF_WINDOW
+
+    return status
+
+
+def encode_punches(timestamps: pd.Series, keywords: pd.Series, shifts: pd.Series, shift_times: dict):
+    """
+    把 DataFrame 列编码成 classify_punches 需要的数组。
+    班次文本只对去重后的取值解析一次（通常只有几种），再按编号广播回每一行。
+    :param shift_times: {班次简称: (开始 time, 结束 time)}，即 get_shift_times_short()
+    """
+    ts = pd.to_datetime(timestamps)
+    seconds = (ts.dt.hour * 3600 + ts.dt.minute * 60 + ts.dt.second).fillna(-1).to_numpy(dtype=np.int64)
+
+    keyword_codes = np.full(len(keywords), KW_NONE, dtype=np.int8)
+    for keyword, code in _KEYWORD_CODES.items():
+        keyword_codes[(keywords == keyword).to_numpy(dtype=bool)] = code
+
+    names = list(shift_times)
+    shift_start = np.array([t[0].hour * 60 + t[0].minute for t in shift_times.values()], dtype=np.int64)
+    shift_end = np.array([t[1].hour * 60 + t[1].minute for t in shift_times.values()], dtype=np.int64)
+
+    uniques_codes, uniques = pd.factorize(shifts, use_na_sentinel=True)
+    value_code = np.full(len(uniques), -1, dtype=np.int64)
+    value_makeup = np.zeros(len(uniques), dtype=bool)
+    for i, value in enumerate(uniques):
+        if not value:
+            continue
+        text = str(value).strip()
+        if "补卡" in text:
+            value_makeup[i] = True
+            continue
+        shift_name = re.split(r"[（(]", text)[0]
+        if shift_name in shift_times:
+            value_code[i] = names.index(shift_name)
+
+    present = uniques_codes >= 0
+    shift_codes = np.where(present, value_code[uniques_codes], -1)
+    makeup = present & value_makeup[uniques_codes]
+    return seconds, keyword_codes, shift_codes, shift_start, shift_end, makeup
+
+
+def classify_frame(df: pd.DataFrame, shift_times: dict) -> np.ndarray:
+    """对含 timestamp / keyword / shift 列的 DataFrame 计算状态位"""
+    if df.empty:
+        return np.zeros(0, dtype=np.int64)
+    return classify_punches(*encode_punches(df["timestamp"], df["keyword"], df["shift"], shift_times))
+
+
+# ===========================
+# 微基准：python punch_status.py [条数]
+# ===========================
+def _classify_one(ts, keyword, shift_val, shift_times, margin: int = 30) -> int:
+    """
+    逐行参考实现，仅用于基准对比与结果校验。
+    早退按通用的跨天规则（结束 <= 开始即跨天班次）判断，不再是旧版 iterrows 中只针对 I班 的分支：
+    I班（15:00-00:00）结果与旧版相同，其他跨天班次（如 18:00-02:00）旧版从不判早退。
+    """
+    if not shift_val or pd.isna(ts):
+        return 0
+    shift_text = str(shift_val).strip()
+    shift_name = re.split(r"[（(]", shift_text)[0]
+    if "补卡" in shift_text:
+        return MAKEUP
+    if shift_name not in shift_times:
+        return 0
+    start_time, end_time = shift_times[shift_name]
+    t = ts.hour * 60 + ts.minute
+    s_min = start_time.hour * 60 + start_time.minute
+    e_min = end_time.hour * 60 + end_time.minute
+    ts_time = ts.time()
+    status = 0
+    if keyword == "#上班打卡" and ts_time > start_time:
+        status |= LATE_GE15 if (t - s_min) % 1440 >= 15 else LATE_LT15
+    elif keyword == "#下班打卡":
+        if e_min <= s_min:
+            if t >= s_min or ts_time < end_time:
+                status |= EARLY
+        elif not (0 <= ts.hour <= 1) and ts_time < end_time:
+            status |= EARLY
+    s = (s_min - margin) % 1440
+    e = (e_min + margin) % 1440
+    in_window = s <= t <= e if s <= e else (t >= s or t <= e)
+    if keyword in ("#上班打卡", "#下班打卡") and not in_window:
+        status |= OUT_OF_WINDOW
+    return status
+
+
+def benchmark(n: int = 1_000_000, reference_rows: int = 50_000, seed: int = 0):
+    import time
+    from datetime import time as dtime
+
+    rng = np.random.default_rng(seed)
+    shift_times = {
+        "F班": (dtime(12, 0), dtime(21, 0)), "I班": (dtime(15, 0), dtime(0, 0)), "J班": (dtime(18, 0), dtime(2, 0)),
+    }
+    shift_labels = np.array(
+        ["F班（12:00-21:00）", "I班（15:00-00:00）", "J班（18:00-02:00）", "F班（12:00-21:00）（补卡）", "I班", None],
+        dtype=object
+    )
+    df = pd.DataFrame({
+        "timestamp": pd.Timestamp("2025-08-01") + pd.to_timedelta(rng.integers(0, 31 * 86400, n), unit="s"),
+        "keyword": rng.choice(np.array(["#上班打卡", "#下班打卡"], dtype=object), n),
+        "shift": rng.choice(shift_labels, n, p=[0.35, 0.35, 0.2, 0.04, 0.04, 0.02]),
+    })
+
+    t0 = time.perf_counter()
+    encoded = encode_punches(df["timestamp"], df["keyword"], df["shift"], shift_times)
+    t1 = time.perf_counter()
+    status = classify_punches(*encoded)
+    t2 = time.perf_counter()
+    print(f"向量化：{n} 条，编码 {t1 - t0:.3f}s，分类 {t2 - t1:.3f}s，合计 {(t2 - t0) * 1e9 / n:.0f} ns/条")
+
+    sample = df.head(reference_rows)
+    t3 = time.perf_counter()
+    expected = [
+        _classify_one(ts, kw, sh, shift_times)
+        for ts, kw, sh in zip(sample["timestamp"], sample["keyword"], sample["shift"])
+    ]
+    t4 = time.perf_counter()
+    per_row = (t4 - t3) / len(sample)
+    print(f"逐行参考：{len(sample)} 条，{t4 - t3:.3f}s，{per_row * 1e9:.0f} ns/条（折算 {n} 条约 {per_row * n:.1f}s）")
+
+    mismatches = int((status[:len(sample)] != np.array(expected)).sum())
+    print(f"结果校验：{mismatches} 条不一致")
+
+    # 跨天班次的预期结果（向量化与逐行参考都须满足；旧版只对 I班 判早退）
+    cases = [
+        ("2025-08-01 23:00:00", "#下班打卡", "I班（15:00-00:00）", EARLY),
+        ("2025-08-02 00:10:00", "#下班打卡", "I班（15:00-00:00）", 0),
+        ("2025-08-01 18:00:00", "#上班打卡", "J班（18:00-02:00）", 0),
+        ("2025-08-01 22:00:00", "#下班打卡", "J班（18:00-02:00）", EARLY),
+        ("2025-08-02 01:30:00", "#下班打卡", "J班（18:00-02:00）", EARLY),
+        ("2025-08-02 02:05:00", "#下班打卡", "J班（18:00-02:00）", 0),
+        ("2025-08-02 02:45:00", "#下班打卡", "J班（18:00-02:00）", OUT_OF_WINDOW),
+    ]
+    case_df = pd.DataFrame(cases, columns=["timestamp", "keyword", "shift", "expected"])
+    case_df["timestamp"] = pd.to_datetime(case_df["timestamp"])
+    vectorized = classify_frame(case_df, shift_times)
+    wrong = 0
+    for (ts, kw, sh, want), got in zip(case_df.itertuples(index=False), vectorized):
+        ref = _classify_one(ts, kw, sh, shift_times)
+        if got != want or ref != want:
+            wrong += 1
+            print(f"❌ {sh} {kw} {ts:%H:%M}：预期 {want}，向量化 {got}，逐行 {ref}")
+    print(f"跨天班次校验：{len(cases) - wrong}/{len(cases)} 条符合预期")
+    return mismatches + wrong
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(1 if benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000) else 0)
@@ -0,0 +1,107 @@
+import os
+import io
+import csv
+import gzip
+import json
+import shutil
+import logging
+from datetime import datetime
+
+from config import DATA_DIR, RAW_EXPORT_PART_MB
+from db_pg import get_conn
+
+# ===========================
+# 原始打卡数据流式导出（gzip 压缩的 CSV / NDJSON，恒定内存）
+# ===========================
+# 服务端游标按批拉取，逐行写入 gzip 文件，不经过 pandas；
+# 压缩后单个文件超过 RAW_EXPORT_PART_MB 时自动切分为下一个分卷（每个分卷都是完整可读的 gzip 文件，
+# CSV 分卷各自带表头），保证每个文件都能作为 Telegram 文档发送。
+RAW_COLUMNS = ("id", "username", "name", "timestamp", "keyword", "shift", "content")
+RAW_FORMATS = ("csv", "ndjson")
+
+_RAW_QUERY = """
+    SELECT id, username, name,
+           to_char(timestamp AT TIME ZONE 'Asia/Shanghai', 'YYYY-MM-DD HH24:MI:SS') AS timestamp,
+           keyword, shift, content
+    FROM messages
+    WHERE timestamp BETWEEN %s AND %s
+    ORDER BY timestamp, id
+"""
+
+FETCH_SIZE = 5000          # 服务端游标每批拉取行数
+SIZE_CHECK_EVERY = 1000    # 每写多少行检查一次分卷大小
+
+logger = logging.getLogger(__name__)
+
+
+def _open_part(path: str, fmt: str):
+    """打开一个 gzip 分卷，返回 (底层文件, 文本流, 行写入函数)"""
+    raw = open(path, "wb")
+    gz = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+    # CSV 带 BOM，Excel 直接打开中文不乱码
+    text = io.TextIOWrapper(gz, encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="")
+    if fmt == "csv":
+        writer = csv.writer(text)
+        writer.writerow(RAW_COLUMNS)
+        write_row = writer.writerow
+    else:
+        def write_row(row):
+            text.write(json.dumps(dict(zip(RAW_COLUMNS, row)), ensure_ascii=False))
+            text.write("\n")
+    return raw, text, write_row
+
+
+def export_raw(start: datetime, end: datetime, fmt: str = "csv", part_mb: int = RAW_EXPORT_PART_MB) -> list[str]:
+    """
+    导出 [start, end] 内 messages 的全部原始记录。
+    :return: 分卷文件路径列表（按时间顺序）；没有数据时返回空列表
+    """
+    if fmt not in RAW_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+
+    start_str = start.strftime("%Y-%m-%d")
+    end_str = end.strftime("%Y-%m-%d")
+    export_dir = os.path.join(DATA_DIR, f"raw_{start_str}_{end_str}_{fmt}")   # 按格式区分，不同格式的并发导出互不清理
+    os.makedirs(export_dir, exist_ok=True)
+    base_name = f"打卡原始数据_{start_str}_{end_str}"
+    part_limit = part_mb * 1024 * 1024
+
+    paths = []
+    raw = text = write_row = None
+    total_rows = 0
+    completed = False
+    conn = get_conn()
+    try:
+        # 命名游标 = 服务端游标，结果集留在数据库端按批拉取
+        with conn.cursor(name="export_raw") as cur:
+            cur.itersize = FETCH_SIZE
+            cur.execute(_RAW_QUERY, (start, end))
+            for row in cur:
+                if raw is None or (total_rows % SIZE_CHECK_EVERY == 0 and raw.tell() >= part_limit):
+                    if text is not None:
+                        text.close()
+                        raw.close()
+                    path = os.path.join(export_dir, f"{base_name}_part{len(paths) + 1}.{fmt}.gz")
+                    raw, text, write_row = _open_part(path, fmt)
+                    paths.append(path)
+                write_row(row)
+                total_rows += 1
+        completed = True
+    finally:
+        if text is not None:
+            text.close()      # GzipFile 不会关闭传入的底层文件，需要分别关闭
+            raw.close()
+        conn.close()
+        # 没有数据或中途出错时不会有人发送 / 清理分卷，连同目录一起删除
+        if not completed or not paths:
+            shutil.rmtree(export_dir, ignore_errors=True)
+
+    # 只有一个分卷时去掉分卷后缀
+    if len(paths) == 1:
+        single_path = os.path.join(export_dir, f"{base_name}.{fmt}.gz")
+        os.replace(paths[0], single_path)
+        paths = [single_path]
+
+    size_mb = sum(os.path.getsize(p) for p in paths) / 1024 / 1024
+    logger.info(f"📦 原始数据导出完成：{total_rows} 行，{len(paths)} 个文件，共 {size_mb:.1f} MB")
+    return paths
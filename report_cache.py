@@ -0,0 +1,123 @@
+import os
+import shutil
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from config import DATA_DIR, BEIJING_TZ, REPORT_CACHE_MAX_MB, REPORT_CACHE_MAX_FILES
+from db_pg import get_conn, get_data_version
+from shift_manager import get_shift_times_short
+
+# ===========================
+# 已结束周期报表缓存
+# ===========================
+# 缓存键 = 报表类型 + 时间区间 + 数据版本戳 + 用户/班次配置摘要。
+# 任何写入 messages 的路径都会递增对应日期的 data_versions，版本戳随之变化，旧缓存自然失效；
+# 缓存文件按修改时间做 LRU（命中时 touch），超过数量/容量上限时淘汰最旧的文件。
+REPORT_CACHE_DIR = os.path.join(DATA_DIR, "report_cache")
+
+logger = logging.getLogger(__name__)
+
+
+def is_closed_period(end_datetime: datetime) -> bool:
+    """区间结束时间早于今天 00:00（北京时间）才视为已结束周期，才参与缓存"""
+    if end_datetime.tzinfo is None:
+        end_datetime = end_datetime.replace(tzinfo=BEIJING_TZ)
+    today_start = datetime.now(BEIJING_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    return end_datetime <= today_start
+
+
+def config_digest() -> str:
+    """用户名单与班次配置也会影响报表内容（缺勤补齐 / 班次格式化），一并纳入缓存键"""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT name FROM users ORDER BY name;")
+            names = [row[0] for row in cur.fetchall()]
+    shifts = sorted(
+        (name, start.strftime("%H:%M"), end.strftime("%H:%M"))
+        for name, (start, end) in get_shift_times_short().items()
+    )
+    return hashlib.md5(repr((names, shifts)).encode("utf-8")).hexdigest()
+
+
+def report_cache_key(kind: str, start_datetime: datetime, end_datetime: datetime) -> str | None:
+    """生成缓存键；数据库不可用时返回 None（直接走不缓存的导出流程）"""
+    try:
+        # I班跨天下班卡会落到前一天的 sheet，版本区间前后各多取一天
+        version = get_data_version(start_datetime - timedelta(days=1), end_datetime + timedelta(days=1))
+        raw = f"{kind}|{start_datetime.isoformat()}|{end_datetime.isoformat()}|{version}|{config_digest()}"
+    except Exception as e:
+        logger.error(f"❌ 报表缓存键生成失败，跳过缓存: {e}")
+        return None
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(REPORT_CACHE_DIR, f"{key}.xlsx")
+
+
+def _summary_path(key: str) -> str:
+    return os.path.join(REPORT_CACHE_DIR, f"{key}.txt")
+
+
+def load_cached_report(key: str) -> str | None:
+    """命中时返回缓存文件路径（调用方经 export_spool.spool_file 交付），并刷新 LRU 时间；未命中返回 None"""
+    path = _cache_path(key)
+    if not os.path.exists(path):
+        logger.info(f"📦 报表缓存未命中: {key[:12]}")
+        return None
+    os.utime(path, None)
+    logger.info(f"📦 报表缓存命中: {key[:12]}")
+    return path
+
+
+def load_cached_summary(key: str) -> str:
+    """读取与缓存报表一同保存的异常汇总文本（聊天消息用）"""
+    path = _summary_path(key)
+    if not os.path.exists(path):
+        return ""
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def store_cached_report(key: str, content: bytes | str, summary: str = ""):
+    """把新生成的报表（内存中的 bytes 或已落盘文件的路径）及其异常汇总文本放入缓存，并按 LRU 淘汰超出上限的旧文件"""
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    path = _cache_path(key)
+    with open(_summary_path(key), "w", encoding="utf-8") as f:
+        f.write(summary or "")
+    tmp_path = f"{path}.tmp"
+    if isinstance(content, bytes):
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+    else:
+        shutil.copyfile(content, tmp_path)
+    os.replace(tmp_path, path)
+    logger.info(f"📦 报表已写入缓存: {key[:12]}")
+    _evict()
+
+
+def _evict():
+    entries = []
+    for fname in os.listdir(REPORT_CACHE_DIR):
+        if not fname.endswith(".xlsx"):
+            continue
+        path = os.path.join(REPORT_CACHE_DIR, fname)
+        st = os.stat(path)
+        entries.append((st.st_mtime, st.st_size, path))
+
+    entries.sort()  # 最久未使用的在前
+    total_size = sum(size for _, size, _ in entries)
+    max_bytes = REPORT_CACHE_MAX_MB * 1024 * 1024
+
+    while entries and (len(entries) > REPORT_CACHE_MAX_FILES or total_size > max_bytes):
+        _, size, path = entries.pop(0)
+        try:
+            os.remove(path)
+            summary_path = path[:-len(".xlsx")] + ".txt"
+            if os.path.exists(summary_path):
+                os.remove(summary_path)
+            total_size -= size
+            logger.info(f"🧹 报表缓存淘汰: {os.path.basename(path)}")
+        except OSError as e:
+            logger.warning(f"⚠️ 报表缓存淘汰失败: {path} -> {e}")
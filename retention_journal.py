@@ -0,0 +1,205 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from config import BEIJING_TZ
+from db_pg import engine
+
+# ===========================
+# 清理任务日志（进程中途重启后从断点继续）
+# ===========================
+# retention_runs：每次清理一行，记录 任务类型 / 日期区间 / 当前阶段 / 已登记到的最大 messages.id；
+# retention_images：该次清理要删除的每张图片及状态（pending / deleted / failed / abandoned）、尝试次数、下次重试时间。
+# 阶段依次为：
+#   collect        按 messages.id 顺序分块登记图片，每块与 last_message_id 在同一事务提交
+#   delete_images  区间完整覆盖的月份目录先按前缀整月删除；其余到期的图片（pending，或已到重试时间的 failed）分块删除，逐张回写状态
+#   purge_rows     图片全部处理完毕后清理数据库（images：置空 content；data：删除打卡记录）
+#   done
+# 每一步都可重复执行：重跑时只会补登记 / 补删除尚未完成的部分。
+RETRY_SCHEDULE = (timedelta(minutes=10), timedelta(hours=1), timedelta(hours=6), timedelta(hours=24))
+# ✅ 第 n 次删除失败后等待 RETRY_SCHEDULE[n-1] 再重试；超过次数的图片标记为 abandoned，不再阻塞清理
+
+logger = logging.getLogger(__name__)
+
+
+def _row_dict(row) -> dict:
+    return dict(row._mapping)
+
+
+# ===========================
+# 清理任务：创建 / 续跑 / 阶段推进
+# ===========================
+def open_run(job: str, start_day: str, end_day: str) -> dict:
+    """同一任务、同一区间有未完成的清理时直接续跑，否则新建"""
+    with engine.begin() as conn:
+        row = conn.execute(
+            text("""
+                SELECT * FROM retention_runs
+                WHERE job = :job AND start_day = :start_day AND end_day = :end_day AND phase <> 'done'
+                ORDER BY id DESC LIMIT 1
+            """),
+            {"job": job, "start_day": start_day, "end_day": end_day}
+        ).fetchone()
+        if row:
+            logger.info(f"🔁 续跑清理任务 #{row.id}（{job} {start_day} ~ {end_day}），当前阶段 {row.phase}")
+            return _row_dict(row)
+
+        row = conn.execute(
+            text("""
+                INSERT INTO retention_runs (job, start_day, end_day)
+                VALUES (:job, :start_day, :end_day)
+                RETURNING *
+            """),
+            {"job": job, "start_day": start_day, "end_day": end_day}
+        ).fetchone()
+    logger.info(f"🆕 新建清理任务 #{row.id}（{job} {start_day} ~ {end_day}）")
+    return _row_dict(row)
+
+
+def unfinished_runs() -> list[dict]:
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT * FROM retention_runs WHERE phase <> 'done' ORDER BY id")).fetchall()
+    return [_row_dict(row) for row in rows]
+
+
+def set_phase(run_id: int, phase: str):
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                UPDATE retention_runs
+                SET phase = :phase, updated_at = now(),
+                    finished_at = CASE WHEN :phase = 'done' THEN now() ELSE NULL END
+                WHERE id = :run_id
+            """),
+            {"run_id": run_id, "phase": phase}
+        )
+
+
+# ===========================
+# 图片登记与状态回写
+# ===========================
+def record_images(run_id: int, images, last_message_id: int):
+    """images: [(message_id, public_id)]；与扫描进度 last_message_id 同一事务提交"""
+    with engine.begin() as conn:
+        if images:
+            conn.execute(
+                text("""
+                    INSERT INTO retention_images (run_id, message_id, public_id)
+                    VALUES (:run_id, :message_id, :public_id)
+                    ON CONFLICT (run_id, message_id) DO NOTHING
+                """),
+                [{"run_id": run_id, "message_id": mid, "public_id": pid} for mid, pid in images]
+            )
+        conn.execute(
+            text("UPDATE retention_runs SET last_message_id = :last_id, updated_at = now() WHERE id = :run_id"),
+            {"run_id": run_id, "last_id": last_message_id}
+        )
+
+
+def due_images(run_id: int, limit: int) -> list[str]:
+    """待删除（或已到重试时间）的 public_id"""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("""
+                SELECT DISTINCT public_id FROM retention_images
+                WHERE run_id = :run_id AND status IN ('pending', 'failed') AND next_attempt_at <= now()
+                LIMIT :limit
+            """),
+            {"run_id": run_id, "limit": limit}
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def mark_images(run_id: int, public_ids, failed_ids):
+    """本轮删除结果回写：成功（含 Cloudinary 已不存在）标记 deleted，失败按 RETRY_SCHEDULE 安排下次重试"""
+    failed = set(failed_ids)
+    done = [pid for pid in public_ids if pid not in failed]
+    now = datetime.now(BEIJING_TZ)
+    with engine.begin() as conn:
+        if done:
+            conn.execute(
+                text("""
+                    UPDATE retention_images SET status = 'deleted', attempts = attempts + 1
+                    WHERE run_id = :run_id AND public_id = ANY(:ids)
+                """),
+                {"run_id": run_id, "ids": done}
+            )
+        if failed:
+            rows = conn.execute(
+                text("""
+                    UPDATE retention_images SET attempts = attempts + 1
+                    WHERE run_id = :run_id AND public_id = ANY(:ids)
+                    RETURNING message_id, attempts
+                """),
+                {"run_id": run_id, "ids": list(failed)}
+            ).fetchall()
+            schedule = [
+                {
+                    "run_id": run_id, "message_id": mid,
+                    "status": "failed" if attempts <= len(RETRY_SCHEDULE) else "abandoned",
+                    "next_at": now + RETRY_SCHEDULE[min(attempts, len(RETRY_SCHEDULE)) - 1],
+                }
+                for mid, attempts in rows
+            ]
+            if schedule:
+                conn.execute(
+                    text("""
+                        UPDATE retention_images SET status = :status, next_attempt_at = :next_at
+                        WHERE run_id = :run_id AND message_id = :message_id
+                    """),
+                    schedule
+                )
+
+
+def prefix_months(run_id: int, folder: str, pending_only: bool = False) -> list[str]:
+    """本次清理登记的图片中，位于 folder/YYYY-MM/ 月份目录下的月份列表"""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(f"""
+                SELECT DISTINCT substring(public_id FROM length(:folder) + 2 FOR 7) FROM retention_images
+                WHERE run_id = :run_id AND public_id LIKE :folder || '/%'
+                {"AND status IN ('pending', 'failed')" if pending_only else ""}
+            """),
+            {"run_id": run_id, "folder": folder}
+        ).fetchall()
+    return sorted(row[0] for row in rows)
+
+
+def mark_prefix_deleted(run_id: int, prefix: str) -> int:
+    """整个目录已按前缀删除：该目录下尚未完成的图片一次性标记为 deleted"""
+    with engine.begin() as conn:
+        result = conn.execute(
+            text("""
+                UPDATE retention_images SET status = 'deleted', attempts = attempts + 1
+                WHERE run_id = :run_id AND public_id LIKE :prefix || '%' AND status IN ('pending', 'failed')
+            """),
+            {"run_id": run_id, "prefix": prefix}
+        )
+    return result.rowcount
+
+
+def image_counts(run_id: int) -> dict:
+    """各状态图片数；failed 为仍在等待重试的数量"""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT status, COUNT(*) FROM retention_images WHERE run_id = :run_id GROUP BY status"),
+            {"run_id": run_id}
+        ).fetchall()
+    return {status: count for status, count in rows}
+
+
+# ===========================
+# 清理过旧的任务日志
+# ===========================
+def prune_runs(keep_days: int = 180):
+    with engine.begin() as conn:
+        result = conn.execute(
+            text("""
+                DELETE FROM retention_runs
+                WHERE phase = 'done' AND finished_at < now() - make_interval(days => :keep_days)
+            """),
+            {"keep_days": keep_days}
+        )
+    if result.rowcount:
+        logger.info(f"🧹 已清理 {result.rowcount} 条过期的清理任务日志")
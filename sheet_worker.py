@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import pyarrow as pa
+from openpyxl import Workbook
+
+from sheet_writer import register_styles, write_day_sheet
+
+# ===========================
+# 每日明细页并行生成的工作进程（由 sheet_writer 以 python -m sheet_worker 单独启动）
+# ===========================
+# spawn 出的工作进程只会重新导入本模块（sheet_writer / punch_status / pyarrow / openpyxl），
+# 不会导入 bot.py、db_pg，也就不会连接数据库或加载班次。
+
+_table = None   # 工作进程内内存映射的全部明细（由 _init_worker 载入一次）
+
+
+def _init_worker(ipc_path: str):
+    global _table
+    _table = pa.ipc.open_file(pa.memory_map(ipc_path)).read_all()
+
+
+def _render_chunk(tasks, out_path: str) -> str:
+    """tasks: [(sheet 标题, 起始行, 结束行, 底色偏移)]"""
+    wb = Workbook(write_only=True)
+    styles = register_styles(wb)
+    for title, start, end, fill_offset in tasks:
+        write_day_sheet(wb, styles, title, _table.slice(start, end - start), fill_offset)
+    wb.save(out_path)
+    return out_path
+
+
+def render_chunks(ipc_path: str, chunks, tmp_dir: str) -> list[str]:
+    """每块任务写成 tmp_dir 下一个工作簿，按块顺序返回路径"""
+    with ProcessPoolExecutor(max_workers=len(chunks), mp_context=get_context("spawn"),
+                             initializer=_init_worker, initargs=(ipc_path,)) as pool:
+        futures = [
+            pool.submit(_render_chunk, chunk, os.path.join(tmp_dir, f"chunk_{i}.xlsx"))
+            for i, chunk in enumerate(chunks)
+        ]
+        return [f.result() for f in futures]
+
+
+if __name__ == "__main__":
+    # 参数：IPC 文件路径、输出目录；标准输入为分块任务（JSON），标准输出为各块工作簿路径（JSON）
+    paths = render_chunks(sys.argv[1], json.load(sys.stdin), sys.argv[2])
+    json.dump(paths, sys.stdout)
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
+import logging
+import subprocess
+from types import SimpleNamespace
+
+import pyarrow as pa
+from openpyxl import Workbook
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import PatternFill, Font, Alignment, Border, Side, NamedStyle
+from openpyxl.utils import get_column_letter
+
+from punch_status import LATE, EARLY, OUT_OF_WINDOW, MAKEUP, REST, NO_CHECKOUT
+
+# ===========================
+# 团队考勤表每日明细页写出（可在进程池中并行生成，最后拼装成一个工作簿）
+# ===========================
+# write-only 工作表的单元格以内联字符串写出，sheetN.xml 只通过样式编号（xf 下标）引用工作簿；
+# 所有工作簿都按 register_styles 的固定顺序注册命名样式，样式编号处处一致，
+# 因此工作进程（sheet_worker.py）生成的 sheet XML 可以原样放进主工作簿。
+DAY_HEADERS = ["姓名", "打卡时间", "关键词", "班次", "备注"]
+DAY_COLUMNS = ["name", "time", "keyword", "shift", "remark"]
+LENGTH_COLUMNS = [f"{col}_len" for col in DAY_COLUMNS]
+
+_THIN = Side(style="thin", color="000000")
+_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+_CENTER = Alignment(horizontal="center", vertical="center")
+
+_FILLS = {
+    "red": PatternFill(start_color="ffc8c8", end_color="ffc8c8", fill_type="solid"),
+    "yellow": PatternFill(start_color="fff1c8", end_color="fff1c8", fill_type="solid"),
+    "blue": PatternFill(start_color="c8eaff", end_color="c8eaff", fill_type="solid"),
+    "purple": PatternFill(start_color="E6CCFF", end_color="E6CCFF", fill_type="solid"),
+    "orange": PatternFill(start_color="FFDCB0", end_color="FFDCB0", fill_type="solid"),
+    "light_red": PatternFill(start_color="FFD6D6", end_color="FFD6D6", fill_type="solid"),
+    "user_a": PatternFill(start_color="f9f9f9", end_color="f9f9f9", fill_type="solid"),
+    "user_b": PatternFill(start_color="ffffff", end_color="ffffff", fill_type="solid"),
+}
+USER_FILLS = ("user_a", "user_b")   # 用户分组交替底色（跨 sheet 连续交替）
+
+logger = logging.getLogger(__name__)
+
+
+# ===========================
+# 样式模板（openpyxl 命名样式）
+# ===========================
+def register_styles(wb: Workbook) -> dict:
+    """
+    按固定顺序注册全部命名样式，返回 样式键 -> 样式名（styled_cell 使用）。
+    每个样式注册后立即求一次 style_id，使单元格样式（xf）编号也按固定顺序分配，与后续写入顺序无关。
+    """
+    anchor = SimpleNamespace(parent=wb)     # 只用于登记样式编号的占位工作表
+
+    def style(name, fill=None, font=None):
+        named = NamedStyle(name=name, alignment=_CENTER, border=_BORDER)
+        if fill is not None:
+            named.fill = fill
+        if font is not None:
+            named.font = font
+        wb.add_named_style(named)
+        cell = Cell(anchor)
+        cell.style = name
+        cell.style_id
+        return name
+
+    styles = {"plain": style("plain"), "header": style("header", font=Font(bold=True))}
+    for name, fill in _FILLS.items():
+        styles[name] = style(name, fill=fill)
+    styles["note"] = style("note", fill=PatternFill(fill_type="solid", fgColor="FFFF00"), font=Font(bold=True, color="000000"))
+    return styles
+
+
+def styled_cell(ws, value, style: str) -> Cell:
+    cell = WriteOnlyCell(ws, value)
+    cell.style = style
+    return cell
+
+
+def blank_row(ws, styles: dict, width: int):
+    return [styled_cell(ws, None, styles["plain"]) for _ in range(width)]
+
+
+def set_column_widths(ws, lengths):
+    for c_idx, max_length in enumerate(lengths, 1):
+        ws.column_dimensions[get_column_letter(c_idx)].width = min(max_length + 8, 30)
+
+
+# ===========================
+# 状态位 -> 行底色（迟到/早退 > 补卡 > 休息/缺勤 > 未打下班卡；单纯签到异常用橙色）
+# ===========================
+def status_fill(status: int, red, yellow, blue, purple, orange):
+    fill = None
+    if status & (LATE | EARLY):
+        fill = red
+    elif status & MAKEUP:
+        fill = yellow
+    elif status & REST:
+        fill = blue
+    elif status & NO_CHECKOUT:
+        fill = purple
+
+    if status & OUT_OF_WINDOW and not status & (LATE | EARLY):
+        fill = orange
+
+    return fill
+
+
+# ===========================
+# 单个每日明细页
+# ===========================
+def day_sheet_rows(names) -> tuple[int, int]:
+    """返回 (用户数, 写出后的最后一行行号)；用户之间空一行，首行为表头"""
+    users = sum(1 for i in range(len(names)) if i == 0 or names[i] != names[i - 1])
+    return users, 1 + len(names) + max(users - 1, 0)
+
+
+def write_day_sheet(wb: Workbook, styles: dict, title: str, day: pa.Table, fill_offset: int):
+    """
+    把一天的明细（已按 姓名/时间 排好序）写成一个工作表。
+    :param fill_offset: 此前所有 sheet 已消耗的用户底色次数（每个 sheet 开头 1 次 + 每个用户 1 次）
+    """
+    columns = {col: day.column(col).to_pylist() for col in DAY_COLUMNS + ["status"]}
+    names = columns["name"]
+
+    sheet = wb.create_sheet(title)
+    sheet.freeze_panes = "A2"
+    lengths = [
+        max(len(h), max(day.column(col).to_pylist(), default=0))
+        for h, col in zip(DAY_HEADERS, LENGTH_COLUMNS)
+    ]
+    set_column_widths(sheet, lengths)
+    sheet.append([styled_cell(sheet, h, styles["header"]) for h in DAY_HEADERS])
+
+    fill_pos = fill_offset + 1
+    row_idx = 2
+    user_start = 0
+    for i in range(len(names) + 1):
+        if i < len(names) and (i == user_start or names[i] == names[user_start]):
+            continue
+        # [user_start, i) 为同一用户的连续行
+        if user_start > 0:
+            sheet.append(blank_row(sheet, styles, len(DAY_HEADERS)))     # 不同用户之间空一行
+            row_idx += 1
+        user_fill = styles[USER_FILLS[fill_pos % 2]]
+        fill_pos += 1
+        for r in range(user_start, i):
+            row_fill_key = status_fill(columns["status"][r], "red", "yellow", "blue", "purple", "orange")
+            row_style = styles[row_fill_key] if row_fill_key else user_fill
+            # 合并姓名列：同一用户只在首行写姓名，其余为合并单元格（无填充）
+            first = styled_cell(sheet, names[r], user_fill) if r == user_start else styled_cell(sheet, None, styles["plain"])
+            sheet.append([first] + [styled_cell(sheet, columns[col][r], row_style) for col in DAY_COLUMNS[1:]])
+        if i - user_start > 1:
+            sheet.merged_cells.add(f"A{row_idx}:A{row_idx + i - user_start - 1}")
+        row_idx += i - user_start
+        user_start = i
+
+    sheet.auto_filter.ref = f"A1:{get_column_letter(len(DAY_HEADERS))}{row_idx - 1}"
+    return sheet
+
+
+# ===========================
+# 并行生成：独立的 sheet_worker 进程中运行进程池，各工作进程写出一个只含若干每日明细页的工作簿
+# ===========================
+def _split_tasks(tasks, parts: int):
+    """按行数把每日任务均衡地分成 parts 份（保持原顺序，每份连续）"""
+    total = sum(end - start for _, start, end, _ in tasks)
+    chunks, current, size = [], [], 0
+    target = total / parts if parts else total
+    for task in tasks:
+        current.append(task)
+        size += task[2] - task[1]
+        if size >= target * (len(chunks) + 1) and len(chunks) < parts - 1:
+            chunks.append(current)
+            current = []
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def write_day_sheets(wb: Workbook, styles: dict, table: pa.Table, tasks, excel_path, workers: int = 1):
+    """
+    写出全部每日明细页并保存工作簿到 excel_path（文件路径或可写的文件对象）。
+    workers <= 1 或只有一天时直接在本进程写；否则在进程池中分块生成，再把 sheet XML 拼装进主工作簿。
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        for title, start, end, fill_offset in tasks:
+            write_day_sheet(wb, styles, title, table.slice(start, end - start), fill_offset)
+        wb.save(excel_path)
+        return
+
+    tmp_dir = tempfile.mkdtemp(prefix="team_sheets_")
+    try:
+        ipc_path = os.path.join(tmp_dir, "days.arrow")
+        with pa.OSFile(ipc_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        chunks = _split_tasks(tasks, workers)
+        # 进程池放在单独启动的 python -m sheet_worker 中：spawn 出的工作进程会重新导入父进程的主模块，
+        # 若直接在机器人进程里开池，每个工作进程都会重新导入 bot.py / db_pg（连接数据库、加载班次）
+        result = subprocess.run(
+            [sys.executable, "-m", "sheet_worker", ipc_path, tmp_dir],
+            input=json.dumps(chunks), capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"每日明细页并行生成失败：{result.stderr.strip()[-2000:]}")
+        chunk_paths = json.loads(result.stdout)
+
+        # 主工作簿中先放同名空表（含筛选范围，供 workbook.xml 生成筛选定义名），保存后替换为子进程生成的 sheet XML
+        first_day_index = len(wb.worksheets) + 1
+        for title, start, end, _ in tasks:
+            placeholder = wb.create_sheet(title)
+            _, last_row = day_sheet_rows(table.column("name").slice(start, end - start).to_pylist())
+            placeholder.auto_filter.ref = f"A1:{get_column_letter(len(DAY_HEADERS))}{last_row}"
+        skeleton_path = os.path.join(tmp_dir, "skeleton.xlsx")
+        wb.save(skeleton_path)
+
+        replacements = {}
+        sheet_index = first_day_index
+        for chunk, chunk_path in zip(chunks, chunk_paths):
+            with zipfile.ZipFile(chunk_path) as zf:
+                for j in range(1, len(chunk) + 1):
+                    replacements[f"xl/worksheets/sheet{sheet_index}.xml"] = zf.read(f"xl/worksheets/sheet{j}.xml")
+                    sheet_index += 1
+
+        with zipfile.ZipFile(skeleton_path) as src, zipfile.ZipFile(excel_path, "w", zipfile.ZIP_DEFLATED) as dst:
+            for item in src.infolist():
+                dst.writestr(item, replacements.get(item.filename) or src.read(item.filename))
+        logger.info(f"🧵 {len(tasks)} 个每日明细页由 {len(chunks)} 个进程并行生成")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
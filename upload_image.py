@@ -1,26 +1,25 @@
 # upload_image.py
-import os
-import cloudinary
-import cloudinary.uploader
+from datetime import datetime
+
+import image_storage
+from config import BEIJING_TZ, CLOUDINARY_FOLDER
 
 # ===========================
-# Cloudinary 配置初始化
+# 按月分目录：punches/YYYY-MM（图片清理可按目录前缀整月删除，不必逐张查找 public_id）
 # ===========================
-cloudinary.config(
-    cloud_name=os.environ["cloudinary_cloud_name"],    # 云端名称（Cloudinary 控制台获取）
-    api_key=os.environ["cloudinary_api_key"],          # API Key
-    api_secret=os.environ["cloudinary_api_secret"]     # API Secret
-)
+def month_folder(when: datetime) -> str:
+    return f"{CLOUDINARY_FOLDER}/{when:%Y-%m}"
+
 
 # ===========================
-# 上传本地图片到 Cloudinary
+# 上传本地图片到截图存储（Cloudinary 或本地磁盘，见 image_storage.py）
 # ===========================
-def upload_image(local_path: str) -> str:
+def upload_image(local_path: str, taken_at: datetime | None = None) -> str:
     """
-    将本地图片文件上传至 Cloudinary，并返回可公开访问的 secure_url。
+    将本地图片文件上传至截图存储，并返回可公开访问的 URL。
     
     :param local_path: 本地图片文件路径
-    :return: Cloudinary 图片的 HTTPS 访问 URL (secure_url)
+    :param taken_at: 打卡时间（决定所在月份目录），默认当前北京时间
+    :return: 图片访问 URL（Cloudinary 为 secure_url）
     """
-    response = cloudinary.uploader.upload(local_path)  # 执行上传操作
-    return response["secure_url"]  # 返回图片安全链接 (https)
+    return image_storage.put(local_path, month_folder(taken_at or datetime.now(BEIJING_TZ)))